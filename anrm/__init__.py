@@ -8,7 +8,29 @@ Modules
 -------
 ::
 
- irvin_modules   --- components for albeck_* models
+ variants        --- registry of model variants built from shared fragments
+
+ network         --- generated reaction network as flat arrays
+ species         --- canonical species labels and species/pattern index
+ simulator       --- ODE simulation of a network
+ linsolve        --- dense, sparse direct and GMRES solvers for the integrator
+ jit             --- optional Numba kernels for the ODE and SSA inner loops
+ dosing          --- bolus events and inputs applied during a run
+ ssa             --- stochastic (Gillespie) simulation of a network
+ moments         --- linear noise approximation and moment closure
+ reducers        --- constant-memory statistics over streamed trajectories
+ compression     --- adaptive output sampling and lossless trajectory storage
+ service         --- asyncio simulation server that batches requests
+ sweep           --- parameter sweeps on a pool or a multi-node work queue
+ fate            --- apoptosis/necrosis calls from PARP trajectories
+ population      --- virtual cell populations with variable protein levels
+ tissue          --- multicellular runs coupled through extracellular TNFa
+ screen          --- single and double knockout/overexpression screens
+ data            --- bulk loading of experimental data onto simulation grids
+ mcmc            --- parallel-tempered ensemble MCMC over rate constants
+ profiles        --- parallel profile-likelihood identifiability analysis
+ surrogate       --- Gaussian-process emulator of fate and time of death
+ cascade         --- fate calls escalating from surrogate to ODE to SSA
 
  everything else (including mito.*)
                   --- the models
@@ -17,5 +39,29 @@ Scripts
 -------
 ::
 
+ benchmarks/startup.py --- import time of the package and its modules
+ benchmarks/linear_solvers.py --- integrator linear solvers compared
+ benchmarks/jit.py --- NumPy and Numba kernels compared
+ benchmarks/threads.py --- thread-pool and process-pool sweeps compared
 
 """
+
+import importlib
+
+# Submodules are imported on first attribute access (``anrm.simulator``,
+# ``anrm.irvin_mod``, ...) rather than here, so that ``import anrm`` stays
+# cheap and a model is only built when it is first used.
+_SUBMODULES = ('cascade', 'compression', 'data', 'dosing', 'fate',
+               'irvin_mod', 'irvin_modv2', 'jit', 'linsolve', 'mcmc',
+               'moments', 'network', 'population', 'profiles', 'reducers',
+               'screen', 'service', 'shared_anrm', 'simulator', 'species',
+               'ssa', 'surrogate', 'sweep', 'tissue', 'variants')
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('%s.%s' % (__name__, name))
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES))
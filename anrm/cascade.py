@@ -0,0 +1,326 @@
+"""
+Overview
+========
+
+Multi-fidelity fate calls: cheap estimates first, expensive models only
+where the fate is in doubt.
+
+In large screens most parameter sets are clearly apoptotic or clearly
+necrotic, and only a minority lie near a fate boundary. :py:class:`FateCascade`
+passes every parameter set through a sequence of tiers of increasing cost
+and stops at the first tier that is confident about its fate:
+
+``'surrogate'``
+    A trained :py:class:`~anrm.surrogate.FateEmulator`; confident where its
+    fate margin reaches the emulator's `confidence` (and the parameter set
+    lies within the emulator's domain).
+``'short'``
+    The ODE model integrated up to a short `horizon`. A cell that dies well
+    before the horizon dies the same way in the full run, so this tier only
+    settles clear early deaths.
+``'ode'``
+    The ODE model over the full time span. The call is confident where the
+    competing death mode (or the end of the time span) comes at least
+    `margin` later, relative to the time of death, and where a surviving
+    cell stays at least `margin` below the PARP threshold. Sets whose
+    integration fails are never confident and go on to the next tier.
+``'ssa'``
+    An ensemble of `n_cells` stochastic simulations
+    (:py:class:`~anrm.ssa.StochasticSimulator`), whose majority fate is
+    final.
+
+Tiers without their ingredient (no emulator, no horizon, no cells) are
+skipped. The :py:class:`CascadeResult` records which tier settled each
+parameter set, and how many sets each tier saw and settled, at what cost::
+
+    cascade = FateCascade(network, tspan, emulator=emu, horizon=3600.,
+                          n_cells=50, backend=backend)
+    result = cascade.run(params)
+    print(result)          # fraction settled and seconds spent per tier
+"""
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from anrm.fate import (APOPTOSIS, FAILED, FATE_NAMES, SURVIVAL,
+                       FateClassifier, classify, first_crossing)
+from anrm.sweep import run_chunks
+
+TIERS = ('surrogate', 'short', 'ode', 'ssa')
+
+
+class FateMargin(FateClassifier):
+    """Sweep reduction to fates, times of death and confidence margins.
+
+    The margin of a dead cell is the time until the competing death mode,
+    or the end of the time span if earlier, relative to its time of death;
+    that of a surviving cell is how far its highest PARP fraction stays
+    below the threshold, relative to the threshold.
+    """
+
+    def __call__(self, tspan, observables, params, values):
+        cparp = values[:, :, observables.index(self.cparp)]
+        aparp = values[:, :, observables.index(self.aparp)]
+        level = self.threshold * params[:, self.parp_index]
+        fates, times = classify(tspan, cparp, aparp,
+                                params[:, self.parp_index], self.threshold)
+        t_apo = first_crossing(tspan, cparp, level)
+        t_nec = first_crossing(tspan, aparp, level)
+        other = np.where(fates == APOPTOSIS, t_nec, t_apo)
+        other = np.where(np.isnan(other), tspan[-1],
+                         np.minimum(other, tspan[-1]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dead = (other - times) / np.maximum(times, tspan[1] - tspan[0])
+            highest = np.maximum(cparp.max(axis=1), aparp.max(axis=1))
+            alive = 1. - highest / level
+        margin = np.where(fates == SURVIVAL, alive, dead)
+        return fates, times.astype(np.float32), margin.astype(np.float32)
+
+
+class FateCascade(object):
+    """Fate calls by escalation from cheap to expensive models.
+
+    Parameters
+    ----------
+    network : anrm.network.Network
+        Network to simulate.
+    tspan : array of floats
+        Output times of the full ODE and SSA runs.
+    emulator : anrm.surrogate.FateEmulator, optional
+        Trained emulator for the 'surrogate' tier.
+    horizon : float, optional
+        End time of the 'short' tier.
+    margin : float
+        Smallest relative margin (see :py:class:`FateMargin`) at which the
+        ODE tiers are trusted.
+    n_cells : int
+        Size of the SSA ensemble of the 'ssa' tier (0 to skip it, in which
+        case the 'ode' tier is final).
+    threshold : float
+        Fraction of PARP cleaved or activated at death.
+    backend : optional
+        Sweep backend for the ODE tiers (see :py:mod:`anrm.sweep`).
+    processes : int, optional
+        Worker processes of the 'ssa' tier, each simulating the ensembles
+        of whole parameter sets; 0 runs them in the calling process.
+        Defaults to the `processes` of `backend` (e.g. a
+        :py:class:`~anrm.sweep.PoolBackend`), or 0 if it has none.
+    chunk_size : int
+        Parameter sets integrated together as one batch.
+    seed : int, optional
+        Seed of the SSA tier. The cells of the i-th parameter set use the
+        per-cell streams ``i * n_cells`` to ``(i + 1) * n_cells - 1`` (see
+        :py:meth:`anrm.ssa.StochasticSimulator.cell_rng`), so a set's result
+        is reproducible whatever other sets reach the tier, and wherever
+        it runs.
+    """
+
+    def __init__(self, network, tspan, emulator=None, horizon=None,
+                 margin=0.25, n_cells=50, threshold=0.5, backend=None,
+                 processes=None, chunk_size=64, seed=None, rtol=1e-3,
+                 atol=1e-6):
+        self.network = network
+        self.tspan = np.asarray(tspan, dtype=float)
+        self.emulator = emulator
+        self.horizon = horizon
+        self.margin = margin
+        self.n_cells = n_cells
+        self.reduce = FateMargin(network, threshold)
+        self.backend = backend
+        if processes is None:
+            processes = getattr(backend, 'processes', 0)
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.rtol = rtol
+        self.atol = atol
+
+    @property
+    def tiers(self):
+        """Names of the tiers in use, cheapest first."""
+
+        use = {'surrogate': self.emulator is not None,
+               'short': self.horizon is not None,
+               'ode': True, 'ssa': self.n_cells > 0}
+        return [name for name in TIERS if use[name]]
+
+    def run(self, param_values):
+        """Call the fate of each parameter set and return a
+        :py:class:`CascadeResult`.
+
+        `param_values` is a list of Parameter dicts or full Parameter
+        vectors, or a 2D array of the latter.
+        """
+
+        params = np.array([self.network.param_vector(p)
+                           for p in param_values])
+        n = len(params)
+        result = CascadeResult(n, self.tiers)
+        pending = np.arange(n)
+        for level, name in enumerate(self.tiers):
+            if not len(pending):
+                break
+            final = level == len(self.tiers) - 1
+            start = time.perf_counter()
+            fates, times, probs, confident, cost = getattr(
+                self, '_' + name)(params[pending], pending)
+            if final:
+                confident = np.ones(len(pending), dtype=bool)
+            done = pending[confident]
+            result.fates[done] = fates[confident]
+            result.death_times[done] = times[confident]
+            result.probabilities[done] = probs[confident]
+            result.tier[done] = level
+            result.stats.append({'tier': name, 'evaluated': len(pending),
+                                 'resolved': len(done),
+                                 'seconds': time.perf_counter() - start,
+                                 'simulations': cost})
+            pending = pending[~confident]
+        return result
+
+    def _surrogate(self, params, sets):
+        emu = self.emulator
+        with np.errstate(divide='ignore'):
+            theta = np.log10(params[:, emu.index])
+        pred = emu.predict(theta)
+        # The emulator only knows its own domain and the values of the
+        # Parameters it does not vary
+        others = np.ones(params.shape[1], dtype=bool)
+        others[emu.index] = False
+        inside = ((theta >= emu.bounds[:, 0]) &
+                  (theta <= emu.bounds[:, 1])).all(axis=1)
+        inside &= np.isclose(params[:, others], emu.base[others]).all(axis=1)
+        return (pred['fates'], pred['death_times'], _onehot(pred['fates']),
+                pred['confident'] & inside, 0)
+
+    def _short(self, params, sets):
+        tspan = self.tspan[self.tspan <= self.horizon]
+        fates, times, margin = self._ode_run(params, tspan)
+        confident = (fates > SURVIVAL) & (margin >= self.margin)
+        return fates, times, _onehot(fates), confident, len(params)
+
+    def _ode(self, params, sets):
+        fates, times, margin = self._ode_run(params, self.tspan)
+        confident = (fates != FAILED) & (margin >= self.margin)
+        return fates, times, _onehot(fates), confident, len(params)
+
+    def _ode_run(self, params, tspan):
+        chunks = (params[i:i + self.chunk_size]
+                  for i in range(0, len(params), self.chunk_size))
+        fates, times, margin = run_chunks(
+            self.network, chunks, tspan,
+            [self.reduce.cparp, self.reduce.aparp], self.backend, self.rtol,
+            self.atol, reduce=self.reduce)
+        return fates, times.astype(float), margin
+
+    def _ssa(self, params, sets):
+        from anrm.ssa import StochasticSimulator
+
+        sim = StochasticSimulator(self.network, seed=self.seed)
+        red = self.reduce
+        names = [red.cparp, red.aparp]
+        # The cells of set s have their own streams, so its result does
+        # not depend on which other sets reached this tier
+        tasks = [(np.arange(s * self.n_cells, (s + 1) * self.n_cells), p)
+                 for s, p in zip(sets, params)]
+        if self.processes == 0 or len(tasks) <= 1:
+            values = [sim.run_cells(cells, self.tspan, p, observables=names)
+                      for cells, p in tasks]
+        else:
+            # Workers rebuild the simulator with the resolved seed, so that
+            # their streams are those of the calling process
+            with ProcessPoolExecutor(
+                    self.processes, initializer=_init_ssa_worker,
+                    initargs=(self.network, sim.seed, self.tspan,
+                              names)) as pool:
+                values = list(pool.map(_ssa_cells, tasks))
+        fates = np.zeros(len(params), dtype=np.int8)
+        times = np.full(len(params), np.nan)
+        probs = np.zeros((len(params), len(FATE_NAMES)))
+        for i, (v, p) in enumerate(zip(values, params)):
+            cell_fates, cell_times = classify(
+                self.tspan, v[:, :, 0], v[:, :, 1], p[red.parp_index],
+                red.threshold)
+            probs[i] = np.bincount(cell_fates[cell_fates != FAILED],
+                                   minlength=len(FATE_NAMES)) \
+                / float(self.n_cells)
+            fates[i] = np.argmax(probs[i])
+            if fates[i] != SURVIVAL:
+                times[i] = np.median(cell_times[cell_fates == fates[i]])
+        return fates, times, probs, np.ones(len(params), dtype=bool), \
+            len(params) * self.n_cells
+
+
+class CascadeResult(object):
+    """Fate calls of a :py:class:`FateCascade` and where they were made.
+
+    Attributes
+    ----------
+    fates : array of int8
+        Fate of each parameter set (see :py:mod:`anrm.fate`), FAILED where
+        the simulations of the last tier failed.
+    death_times : array of floats
+        Time of death, NaN for survivors.
+    probabilities : array of floats
+        Fate probabilities, sets x fates: the fraction of SSA cells with
+        each fate for sets settled by the 'ssa' tier, 0 or 1 otherwise (all
+        0 for failed sets).
+    tier : array of integers
+        Index into :py:attr:`tiers` of the tier that settled each set.
+    tiers : list of strings
+        Tiers in use, cheapest first.
+    stats : list of dicts
+        Per tier that ran: its name ('tier'), the number of sets it
+        'evaluated' and 'resolved', the wall-clock 'seconds' it took and the
+        number of ODE or SSA 'simulations' it ran.
+    """
+
+    def __init__(self, n, tiers):
+        self.fates = np.zeros(n, dtype=np.int8)
+        self.death_times = np.full(n, np.nan)
+        self.probabilities = np.zeros((n, len(FATE_NAMES)))
+        self.tier = np.full(n, -1, dtype=np.int8)
+        self.tiers = list(tiers)
+        self.stats = []
+
+    def resolved_fractions(self):
+        """Return the fraction of all sets settled by each tier."""
+
+        counts = np.bincount(self.tier[self.tier >= 0],
+                             minlength=len(self.tiers))
+        return dict(zip(self.tiers, counts / float(max(len(self.tier), 1))))
+
+    def __str__(self):
+        total = sum(s['seconds'] for s in self.stats) or 1.
+        lines = ['%-10s %9s %9s %9s %9s %7s' % (
+            'tier', 'evaluated', 'resolved', 'fraction', 'seconds', 'share')]
+        for s in self.stats:
+            lines.append('%-10s %9d %9d %9.3f %9.2f %6.1f%%' % (
+                s['tier'], s['evaluated'], s['resolved'],
+                s['resolved'] / float(max(len(self.tier), 1)), s['seconds'],
+                100. * s['seconds'] / total))
+        failed = int((self.fates == FAILED).sum())
+        if failed:
+            lines.append('%d sets failed to simulate' % failed)
+        return '\n'.join(lines)
+
+
+# SSA simulator and arguments of the current pool worker.
+_worker = None
+
+def _init_ssa_worker(network, seed, tspan, observables):
+    from anrm.ssa import StochasticSimulator
+
+    global _worker
+    _worker = (StochasticSimulator(network, seed=seed), tspan, observables)
+
+def _ssa_cells(task):
+    sim, tspan, observables = _worker
+    cells, params = task
+    return sim.run_cells(cells, tspan, params, observables=observables)
+
+def _onehot(fates):
+    # Failed sets have no fate, and a zero row
+    return np.eye(len(FATE_NAMES) + 1)[fates][:, :len(FATE_NAMES)]
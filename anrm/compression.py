@@ -0,0 +1,251 @@
+"""
+Overview
+========
+
+Adaptive output sampling and compact storage of trajectories.
+
+ANRM time courses are mostly flat with sharp switches (PARP sits at
+``PARP_0`` for hours, then is cleaved within minutes), so a uniform output
+grid is either wasteful or too coarse at the switch. This module keeps only
+the points needed to reproduce a densely sampled trajectory to within a
+tolerance:
+
+- :py:class:`AdaptiveSampler` selects, in a single streaming pass, the
+  subset of a dense sample through which piecewise-linear interpolation
+  stays within ``atol + rtol * scale`` of every dense point (a
+  multi-column "swinging door" algorithm),
+- :py:class:`CompressedTrajectory` stores the selected points losslessly:
+  the float64 bit patterns are XOR-delta encoded along time, split into byte
+  planes and deflated. Decoding reproduces the recorded points bit for bit,
+  and :py:meth:`CompressedTrajectory.interpolate` reads back values at any
+  time with the sampling error bound.
+
+:py:meth:`anrm.simulator.Simulator.run_adaptive` combines both with the
+integrator.
+"""
+
+import json
+import struct
+import zlib
+
+import numpy as np
+
+_MAGIC = b'ANRMTRJ\0'
+_VERSION = 1
+
+
+class AdaptiveSampler(object):
+    """Streaming selection of the points needed for linear interpolation.
+
+    Parameters
+    ----------
+    rtol : float
+        Tolerance relative to `scale`.
+    atol : float or array of floats
+        Absolute tolerance, per column if an array.
+    scale : float or array of floats, optional
+        Magnitude each column's relative tolerance refers to (e.g.
+        ``PARP_0`` for PARP observables). Defaults to the largest absolute
+        value seen in the first chunk, but at least 1, which is too small
+        for columns that start near 0 and grow; pass it for those.
+        :py:meth:`anrm.simulator.Simulator.run_adaptive` derives it from
+        the model.
+    """
+
+    def __init__(self, rtol=1e-3, atol=1e-6, scale=None):
+        self.rtol = rtol
+        self.atol = atol
+        self.scale = scale
+        self._tol = None
+        self._times = []
+        self._values = []
+        self._pending_t = []
+        self._pending_x = []
+        self._window = None
+
+    def update(self, t, x):
+        """Consume dense points `t` (times) and `x` (times x columns)."""
+
+        t = np.asarray(t, dtype=float)
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        if self._tol is None:
+            scale = self.scale
+            if scale is None:
+                scale = np.maximum(np.abs(x).max(axis=0), 1.)
+            self._tol = self.atol + self.rtol * np.asarray(scale, dtype=float)
+            self._keep(t[0], x[0])
+            t, x = t[1:], x[1:]
+        self._pending_t.extend(t)
+        self._pending_x.extend(x)
+        self._advance()
+
+    def finish(self):
+        """Return (times, values) of the selected points, ending at the last."""
+
+        if self._pending_t:
+            self._keep(self._pending_t[-1], self._pending_x[-1])
+            self._pending_t, self._pending_x = [], []
+            self._window = None
+        return np.array(self._times), np.array(self._values)
+
+    @property
+    def tolerance(self):
+        """Interpolation error bound of each column."""
+        return self._tol
+
+    def _keep(self, t, x):
+        self._times.append(t)
+        self._values.append(np.array(x))
+
+    def _advance(self):
+        """Emit points for as long as the pending window becomes infeasible.
+
+        From the last kept point (the anchor), an endpoint k is admissible if
+        the chord anchor->k passes within tolerance of every point strictly
+        between them. When no later endpoint can be admissible any more, the
+        last admissible one is kept and becomes the new anchor. The scan
+        state is kept between calls, so every dense point is examined once
+        per anchor.
+        """
+
+        while self._pending_t:
+            ta, xa = self._times[-1], self._values[-1]
+            if self._window is None:
+                self._window = [np.full(len(xa), -np.inf),
+                                np.full(len(xa), np.inf), None, 0]
+            lo, hi, last_ok, k = self._window
+            infeasible = False
+            while k < len(self._pending_t):
+                dt = self._pending_t[k] - ta
+                xk = self._pending_x[k]
+                slope = (xk - xa) / dt
+                if np.all(slope >= lo) and np.all(slope <= hi):
+                    last_ok = k
+                lo = np.maximum(lo, (xk - self._tol - xa) / dt)
+                hi = np.minimum(hi, (xk + self._tol - xa) / dt)
+                if np.any(lo > hi):
+                    infeasible = True
+                    break
+                k += 1
+            if not infeasible:
+                # Window still feasible: wait for more points
+                self._window = [lo, hi, last_ok, k]
+                return
+            self._window = None
+            self._keep(self._pending_t[last_ok], self._pending_x[last_ok])
+            del self._pending_t[:last_ok + 1]
+            del self._pending_x[:last_ok + 1]
+
+
+class CompressedTrajectory(object):
+    """Irregularly sampled observable trajectories with lossless encoding.
+
+    Parameters
+    ----------
+    times : array of floats
+        Recorded times, increasing.
+    values : array of floats
+        Recorded values, times x observables.
+    names : list of strings
+        Observable names.
+    tolerance : array of floats, optional
+        Interpolation error bound of each observable, as guaranteed by the
+        sampler that selected the points.
+    """
+
+    def __init__(self, times, values, names, tolerance=None):
+        self.times = np.asarray(times, dtype=float)
+        self.values = np.asarray(values, dtype=float).reshape(
+            len(self.times), len(names))
+        self.names = list(names)
+        self.tolerance = (None if tolerance is None else
+                          np.broadcast_to(np.asarray(tolerance, dtype=float),
+                                          (len(self.names),)).copy())
+
+    def __getitem__(self, name):
+        """Return the recorded values of observable `name`."""
+        return self.values[:, self.names.index(name)]
+
+    def interpolate(self, t, names=None):
+        """Return values at times `t` by linear interpolation.
+
+        Within the recorded time range, the result is within `tolerance` of
+        the dense trajectory the points were selected from.
+        """
+
+        t = np.asarray(t, dtype=float)
+        cols = (range(len(self.names)) if names is None else
+                [self.names.index(n) for n in names])
+        return np.column_stack([np.interp(t, self.times, self.values[:, c])
+                                for c in cols])
+
+    # Encoding
+    # --------
+
+    def to_bytes(self, level=6):
+        """Encode the trajectory as a compact, versioned byte string."""
+
+        header = json.dumps({
+            'names': self.names,
+            'n_times': len(self.times),
+            'tolerance': (None if self.tolerance is None else
+                          self.tolerance.tolist()),
+        }).encode('utf-8')
+        blobs = [_encode_columns(self.times[:, None], level),
+                 _encode_columns(self.values, level)]
+        parts = [_MAGIC, struct.pack('<II', _VERSION, len(header)), header]
+        for blob in blobs:
+            parts.extend([struct.pack('<Q', len(blob)), blob])
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Decode a byte string produced by :py:meth:`to_bytes`."""
+
+        if data[:len(_MAGIC)] != _MAGIC:
+            raise ValueError("Not an ANRM trajectory")
+        pos = len(_MAGIC)
+        version, hlen = struct.unpack_from('<II', data, pos)
+        if version != _VERSION:
+            raise ValueError("Unsupported trajectory version %d" % version)
+        pos += 8
+        header = json.loads(data[pos:pos + hlen].decode('utf-8'))
+        pos += hlen
+        n = header['n_times']
+        arrays = []
+        for width in (1, len(header['names'])):
+            (size,) = struct.unpack_from('<Q', data, pos)
+            pos += 8
+            arrays.append(_decode_columns(data[pos:pos + size], n, width))
+            pos += size
+        return cls(arrays[0][:, 0], arrays[1], header['names'],
+                   header['tolerance'])
+
+    def save(self, path, level=6):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes(level))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+
+def _encode_columns(a, level):
+    """XOR-delta encode float64 columns along axis 0, byte-shuffle, deflate."""
+
+    bits = np.ascontiguousarray(a, dtype='<f8').view('<u8')
+    delta = bits.copy()
+    delta[1:] ^= bits[:-1]
+    planes = delta.view(np.uint8).reshape(delta.shape + (8,))
+    return zlib.compress(np.ascontiguousarray(
+        planes.transpose(2, 1, 0)).tobytes(), level)
+
+def _decode_columns(blob, n, width):
+    """Inverse of :py:func:`_encode_columns`."""
+
+    planes = np.frombuffer(zlib.decompress(blob), dtype=np.uint8)
+    planes = planes.reshape(8, width, n).transpose(2, 1, 0)
+    delta = np.ascontiguousarray(planes).view('<u8').reshape(n, width)
+    bits = np.bitwise_xor.accumulate(delta, axis=0)
+    return bits.view('<f8')
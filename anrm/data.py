@@ -0,0 +1,339 @@
+"""
+Overview
+========
+
+Experimental data: bulk loading and alignment to simulation time grids.
+
+Plate-reader and live-cell imaging exports come as long tables: one row per
+well and time point, with reporter columns (cleaved PARP, viability, ...) and
+condition columns (ligand dose, inhibitor, ...). :py:func:`read_table` loads
+a CSV or Parquet file into one NumPy array per column, and
+:py:class:`Dataset` maps them onto the model:
+
+- reporter columns become observables (``Obs_cPARP``, ``Obs_aPARP``, ...),
+- condition columns become initial-condition Parameters (``TNFa_0``, ...),
+  optionally with a unit conversion factor,
+- wells that share a condition share one simulation.
+
+:py:meth:`Dataset.align` precomputes, for every measurement, the two
+bracketing points of the simulation output grid and the linear
+interpolation weight. Comparing a simulation with the data is then one
+vectorized gather, whatever the number of wells::
+
+    data = Dataset.from_file('plate.csv',
+                             observables={'cPARP': 'Obs_cPARP'},
+                             conditions={'TNF_ng_ml': ('TNFa_0', 2.4e3)})
+    tspan = np.linspace(0, 20000, 201)
+    align = data.align(tspan, sigma={'Obs_cPARP': 2e4})
+    results = Simulator(network).run_batch(tspan,
+                                           data.param_sets(network))
+    names = list(network.observables)
+    values = np.array([np.column_stack([r[o] for o in names])
+                       for r in results])
+    align.log_likelihood(values, names)
+
+An :py:class:`Alignment` is also a sweep reduction (see
+:py:class:`anrm.sweep.SweepSpec`) returning one log-likelihood per block of
+`n_conditions` rows, for chunks made of the :py:meth:`Dataset.param_sets`
+of several parameter vectors.
+
+Parquet files, and faster multithreaded CSV parsing, need pyarrow. Without
+it, CSV files are parsed by NumPy.
+"""
+
+import csv
+import gzip
+
+import numpy as np
+
+
+def read_table(path, columns=None, delimiter=','):
+    """Return the columns of a CSV or Parquet file as a dict of arrays.
+
+    Numeric columns are float arrays and the others are string (or object)
+    arrays. `columns` selects the columns to load (default: all).
+    """
+
+    path = str(path)
+    if path.endswith(('.parquet', '.pq')):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("reading Parquet files requires pyarrow")
+        table = pq.read_table(path, columns=columns)
+        return _from_arrow(table)
+    try:
+        import pyarrow.csv as pacsv
+    except ImportError:
+        return _read_csv(path, columns, delimiter)
+    table = pacsv.read_csv(
+        path, parse_options=pacsv.ParseOptions(delimiter=delimiter),
+        convert_options=pacsv.ConvertOptions(include_columns=columns))
+    return _from_arrow(table)
+
+
+class Dataset(object):
+    """Measurements of observables in wells under initial conditions.
+
+    Use :py:meth:`from_file` or :py:meth:`from_columns` to build one.
+
+    Attributes
+    ----------
+    observables : list of strings
+        Observables measured, in column order of `values`.
+    condition_params : list of strings
+        Initial-condition Parameters set by the conditions.
+    wells : array
+        Well identifiers.
+    conditions : 2D array of floats
+        Distinct conditions (n_conditions x condition_params), in model
+        units.
+    well_condition : array of ints
+        Condition of each well.
+    times : array of floats
+        Time of each measurement, sorted by well and then time.
+    well_index : array of ints
+        Well of each measurement.
+    values : 2D array of floats
+        Measured values (measurements x observables), NaN where missing.
+    """
+
+    def __init__(self, observables, condition_params, wells, conditions,
+                 well_condition, times, well_index, values):
+        self.observables = list(observables)
+        self.condition_params = list(condition_params)
+        self.wells = wells
+        self.conditions = conditions
+        self.well_condition = well_condition
+        self.times = times
+        self.well_index = well_index
+        self.values = values
+
+    @classmethod
+    def from_file(cls, path, observables, conditions=None, time='time',
+                  well='well', delimiter=','):
+        """Load a CSV or Parquet file; see :py:meth:`from_columns`."""
+
+        conditions = conditions or {}
+        names = [time] + list(observables) + list(conditions)
+        # The well column is optional, as in from_columns
+        if well is not None and well in _column_names(str(path), delimiter):
+            names.append(well)
+        return cls.from_columns(read_table(path, names, delimiter),
+                                observables, conditions, time, well)
+
+    @classmethod
+    def from_columns(cls, columns, observables, conditions=None, time='time',
+                     well='well'):
+        """Build a dataset from a dict of equal-length column arrays.
+
+        Parameters
+        ----------
+        columns : dict
+            Column arrays of a long table: one row per measurement time of
+            a well.
+        observables : dict
+            Maps reporter columns to observable names.
+        conditions : dict, optional
+            Maps condition columns to initial-condition Parameters, or to
+            (Parameter, factor) to convert units, e.g.
+            ``{'TNF_ng_ml': ('TNFa_0', 2.4e3)}``.
+        time : string
+            Time column, in the units of the simulations.
+        well : string, optional
+            Well identifier column. Without one, wells are the distinct
+            conditions.
+        """
+
+        conditions = conditions or {}
+        t = np.asarray(columns[time], dtype=float)
+        params, cond = [], np.empty((len(t), 0))
+        for column, target in conditions.items():
+            param, factor = (target, 1.) if isinstance(target, str) \
+                else target
+            params.append(param)
+            cond = np.column_stack(
+                [cond, factor * np.asarray(columns[column], dtype=float)])
+        if well is not None and well in columns:
+            ids = np.asarray(columns[well])
+        else:
+            ids = np.unique(cond, axis=0, return_inverse=True)[1].ravel() \
+                if params else np.zeros(len(t), dtype=int)
+        wells, well_index = np.unique(ids, return_inverse=True)
+        well_index = well_index.ravel()
+
+        order = np.lexsort((t, well_index))
+        t, well_index, cond = t[order], well_index[order], cond[order]
+        values = np.column_stack(
+            [np.asarray(columns[c], dtype=float)[order] for c in observables])
+
+        first = np.searchsorted(well_index, np.arange(len(wells)))
+        per_well = cond[first]
+        varying = np.any(cond != per_well[well_index], axis=1)
+        if np.any(varying):
+            raise ValueError("conditions vary within well %s" %
+                             wells[well_index[np.argmax(varying)]])
+        if params:
+            unique, well_condition = np.unique(per_well, axis=0,
+                                               return_inverse=True)
+        else:
+            unique = np.empty((1, 0))
+            well_condition = np.zeros(len(wells), dtype=int)
+        return cls(list(observables.values()), params, wells, unique,
+                   well_condition.ravel(), t, well_index, values)
+
+    @property
+    def n_conditions(self):
+        return len(self.conditions)
+
+    def __len__(self):
+        return len(self.times)
+
+    def param_sets(self, network, param_values=None):
+        """Return one Parameter vector per condition.
+
+        `param_values` sets the other Parameters, and may be a Parameter
+        vector or a dict.
+        """
+
+        if isinstance(param_values, dict) or param_values is None:
+            base = network.param_vector(param_values)
+        else:
+            base = np.asarray(param_values, dtype=float)
+        params = np.tile(base, (self.n_conditions, 1))
+        params[:, [network.param_index(p)
+                   for p in self.condition_params]] = self.conditions
+        return params
+
+    def align(self, tspan, sigma=1.):
+        """Return the :py:class:`Alignment` of the data on `tspan`."""
+
+        return Alignment(self, tspan, sigma)
+
+
+class Alignment(object):
+    """Interpolation of simulations onto the measurements of a dataset.
+
+    Measurements outside `tspan` are ignored.
+
+    Parameters
+    ----------
+    dataset : Dataset
+        The measurements.
+    tspan : array of floats
+        Increasing output times of the simulations.
+    sigma : float or dict
+        Standard deviation of the measurement error, per observable if a
+        dict.
+    """
+
+    def __init__(self, dataset, tspan, sigma=1.):
+        self.dataset = dataset
+        self.observables = dataset.observables
+        self.tspan = np.asarray(tspan, dtype=float)
+        if isinstance(sigma, dict):
+            sigma = [sigma[o] for o in self.observables]
+        self.sigma = np.broadcast_to(np.asarray(sigma, dtype=float),
+                                     (len(self.observables),))
+        times = dataset.times
+        n_times = len(self.tspan)
+        hi = np.clip(np.searchsorted(self.tspan, times, side='right'), 1,
+                     n_times - 1)
+        lo = hi - 1
+        self.weight = ((times - self.tspan[lo]) /
+                       (self.tspan[hi] - self.tspan[lo]))[:, None]
+        # Flat (condition, time) indices of the bracketing output points
+        condition = dataset.well_condition[dataset.well_index]
+        self._lo = condition * n_times + lo
+        self._hi = condition * n_times + hi
+        inside = (times >= self.tspan[0]) & (times <= self.tspan[-1])
+        self._mask = inside[:, None] & np.isfinite(dataset.values)
+        self._data = np.where(self._mask, dataset.values, 0.)
+
+    def interpolate(self, values, observables=None):
+        """Return simulated values at the measurements.
+
+        `values` holds the simulations of all conditions, shaped
+        (..., conditions, times, observables), with the observables named
+        by `observables` (default: those of the dataset, in order). Returns
+        an array shaped (..., measurements, dataset observables).
+        """
+
+        values = np.asarray(values)
+        if observables is not None:
+            values = values[..., [list(observables).index(o)
+                                  for o in self.observables]]
+        flat = values.reshape(values.shape[:-3] + (-1, values.shape[-1]))
+        lo = flat[..., self._lo, :]
+        return lo + self.weight * (flat[..., self._hi, :] - lo)
+
+    def residuals(self, values, observables=None):
+        """Return (simulated - measured) / sigma, 0 where not measured."""
+
+        resid = (self.interpolate(values, observables) - self._data) \
+            / self.sigma
+        return np.where(self._mask, resid, 0.)
+
+    def log_likelihood(self, values, observables=None):
+        """Gaussian log-likelihood of the simulations, -inf if they failed.
+
+        Returns one value per leading index of `values`.
+        """
+
+        logl = -0.5 * (self.residuals(values, observables) ** 2).sum(
+            axis=(-2, -1))
+        return np.where(np.isfinite(logl), logl, -np.inf)
+
+    def __call__(self, tspan, observables, params, values):
+        n = self.dataset.n_conditions
+        values = values.reshape((-1, n) + values.shape[1:])
+        return self.log_likelihood(values, observables)
+
+
+# Helpers
+# =======
+
+def _from_arrow(table):
+    columns = {}
+    for name in table.column_names:
+        array = table.column(name).to_numpy()
+        if array.dtype.kind in 'iub':
+            array = array.astype(float)
+        columns[name] = array
+    return columns
+
+def _column_names(path, delimiter):
+    if path.endswith(('.parquet', '.pq')):
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    return _csv_header(path, delimiter)
+
+def _csv_header(path, delimiter):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        header = next(csv.reader(f, delimiter=delimiter))
+    return [h.strip() for h in header]
+
+def _read_csv(path, columns, delimiter):
+    header = _csv_header(path, delimiter)
+    names = header if columns is None else \
+        [h for h in header if h in columns]
+    missing = set(columns or ()) - set(names)
+    if missing:
+        raise KeyError("no column %s in %s" % (', '.join(sorted(missing)),
+                                               path))
+    usecols = [header.index(n) for n in names]
+    # Read the cells as text, so that blank cells stay distinguishable
+    # from numbers and a single data row still gives a 2-D table
+    table = np.genfromtxt(path, delimiter=delimiter, skip_header=1,
+                          usecols=usecols, dtype=str, encoding='utf-8',
+                          autostrip=True, ndmin=2)
+    return {n: _column(table[:, i]) for i, n in enumerate(names)}
+
+def _column(cells):
+    # Numeric columns become float, with NaN for the blank cells
+    blank = cells == ''
+    try:
+        return np.where(blank, 'nan', cells).astype(float)
+    except ValueError:
+        return cells
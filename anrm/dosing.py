@@ -0,0 +1,114 @@
+"""
+Overview
+========
+
+Dosing schedules: time-varying inputs for ANRM simulations.
+
+A :py:class:`Schedule` collects two kinds of inputs that are applied to named
+species while a :py:class:`~anrm.simulator.Simulator` integrates a model:
+
+- **discrete events**, which change a species amount instantaneously:
+
+  - :py:meth:`Schedule.bolus` adds an amount (ligand exposure, addition of a
+    Smac mimetic or caspase inhibitor),
+  - :py:meth:`Schedule.set_level` sets an amount (e.g. washout to zero),
+
+- **piecewise-constant inputs**, which add a constant flux (molecules/s) to a
+  species over a time window (:py:meth:`Schedule.infuse`).
+
+Species are referred to by any name accepted by
+:py:meth:`anrm.network.Network.species_index`, so ``'TNFa'``, ``'Fas'`` and
+``'XIAP'`` address the free species declared by the initial conditions of
+those monomers.
+
+The simulator integrates up to every event or input breakpoint, applies the
+change, and restarts the solver from the modified state, so a whole treatment
+protocol is a single run::
+
+    schedule = Schedule()
+    schedule.pulse('TNFa', 3000, start=0, duration=1800)
+    schedule.bolus(7200, 'TNFa', 3000)
+    schedule.set_level(10800, 'XIAP', 0)
+    result = Simulator(model).run(tspan, schedule=schedule)
+
+Events at time `t` are applied before the output at `t` is recorded, i.e.
+trajectories are right-continuous.
+"""
+
+import numpy as np
+
+
+class Schedule(object):
+    """A protocol of bolus events and piecewise-constant inputs."""
+
+    def __init__(self):
+        self.events = []
+        self.inputs = []
+
+    def bolus(self, time, species, amount):
+        """Add `amount` of `species` at `time`."""
+
+        self.events.append((float(time), species, 'add', float(amount)))
+        return self
+
+    def set_level(self, time, species, amount):
+        """Set the amount of `species` to `amount` at `time`."""
+
+        self.events.append((float(time), species, 'set', float(amount)))
+        return self
+
+    def repeat_bolus(self, species, amount, start, interval, count):
+        """Add `amount` of `species` `count` times, every `interval` s."""
+
+        for i in range(count):
+            self.bolus(start + i * interval, species, amount)
+        return self
+
+    def pulse(self, species, amount, start, duration):
+        """Expose to `amount` of `species` for `duration` s, then wash out.
+
+        Washout removes the remaining free species only; ligand already bound
+        to its receptor is unaffected.
+        """
+
+        self.bolus(start, species, amount)
+        self.set_level(start + duration, species, 0.)
+        return self
+
+    def infuse(self, species, rate, start=0., stop=np.inf):
+        """Add `species` at a constant `rate` (molecules/s) in [start, stop)."""
+
+        if stop <= start:
+            raise ValueError("Input window must have stop > start")
+        self.inputs.append((species, float(rate), float(start), float(stop)))
+        return self
+
+    def breakpoints(self, t0, t1):
+        """Return the sorted times in (t0, t1] where the inputs change."""
+
+        times = set(e[0] for e in self.events)
+        for _, _, start, stop in self.inputs:
+            times.update((start, stop))
+        return sorted(t for t in times if t0 < t <= t1)
+
+    def apply(self, network, time, y):
+        """Apply the events scheduled at `time` to state `y` in place."""
+
+        for t, species, kind, amount in self.events:
+            if t != time:
+                continue
+            i = network.species_index(species)
+            if kind == 'add':
+                y[..., i] += amount
+            else:
+                y[..., i] = amount
+        return y
+
+    def influx(self, network, time):
+        """Return the constant input flux vector in effect from `time` on."""
+
+        flux = np.zeros(network.n_species)
+        for species, rate, start, stop in self.inputs:
+            if start <= time < stop:
+                flux[network.species_index(species)] += rate
+        return flux
@@ -0,0 +1,107 @@
+"""
+Overview
+========
+
+Cell-fate calls from simulated PARP trajectories.
+
+In ANRM, PARP is the reporter of both death modes: caspase-3 cleaves it in
+apoptosis (``Obs_cPARP``) and RIP1/RIP3 signalling activates it in
+necroptosis (``Obs_aPARP``). A cell is called
+
+- apoptotic if cleaved PARP reaches `threshold` * ``PARP_0`` first,
+- necrotic if active PARP reaches `threshold` * ``PARP_0`` first,
+- surviving if neither happens within the simulated time,
+
+and its time of death is the (linearly interpolated) time of that crossing.
+Cells whose trajectories are not finite, such as the NaN rows a sweep
+returns for simulations that failed to integrate, get the code
+:py:data:`FAILED` instead of a fate.
+"""
+
+import numpy as np
+
+SURVIVAL, APOPTOSIS, NECROSIS = 0, 1, 2
+FATE_NAMES = ('survival', 'apoptosis', 'necrosis')
+# Code of cells without a fate call; not an index into FATE_NAMES.
+FAILED = -1
+
+
+def first_crossing(tout, x, level):
+    """Return the first time each row of `x` reaches `level`.
+
+    Parameters
+    ----------
+    tout : array of floats
+        Output times.
+    x : array of floats
+        Trajectories, cells x times (or a single trajectory).
+    level : float or array of floats
+        Level to reach, per cell if an array.
+
+    Returns an array of crossing times, NaN where `level` is never reached.
+    """
+
+    x = np.atleast_2d(x)
+    level = np.broadcast_to(np.asarray(level, dtype=float), (len(x),))
+    above = x >= level[:, None]
+    hit = above.any(axis=1)
+    i = np.argmax(above, axis=1)
+    times = np.full(len(x), np.nan)
+    # Interpolate between the last point below and the first one above
+    rows = np.nonzero(hit & (i > 0))[0]
+    i1 = i[rows]
+    x0, x1 = x[rows, i1 - 1], x[rows, i1]
+    t0, t1 = tout[i1 - 1], tout[i1]
+    frac = (level[rows] - x0) / np.where(x1 > x0, x1 - x0, 1.)
+    times[rows] = t0 + frac * (t1 - t0)
+    rows = np.nonzero(hit & (i == 0))[0]
+    times[rows] = tout[0]
+    return times
+
+def classify(tout, cparp, aparp, parp_0, threshold=0.5):
+    """Call the fate and time of death of each cell.
+
+    `cparp` and `aparp` are cleaved and active PARP trajectories (cells x
+    times) and `parp_0` the total PARP of each cell. Returns (fates, times),
+    with fates coded as :py:data:`SURVIVAL`, :py:data:`APOPTOSIS` and
+    :py:data:`NECROSIS`, or :py:data:`FAILED` for cells with non-finite
+    trajectories, and NaN times for cells that did not die.
+    """
+
+    level = threshold * np.asarray(parp_0, dtype=float)
+    t_apo = first_crossing(tout, cparp, level)
+    t_nec = first_crossing(tout, aparp, level)
+    fates = np.full(len(t_apo), SURVIVAL, dtype=np.int8)
+    apo = np.isfinite(t_apo) & ~(t_nec < t_apo)
+    nec = np.isfinite(t_nec) & ~apo
+    fates[apo] = APOPTOSIS
+    fates[nec] = NECROSIS
+    failed = ~(np.isfinite(np.atleast_2d(cparp)).all(axis=1) &
+               np.isfinite(np.atleast_2d(aparp)).all(axis=1))
+    fates[failed] = FAILED
+    apo &= ~failed
+    nec &= ~failed
+    times = np.where(apo, t_apo, np.where(nec, t_nec, np.nan))
+    return fates, times
+
+
+class FateClassifier(object):
+    """Sweep reduction that keeps only each cell's fate and time of death.
+
+    Use as the `reduce` argument of :py:func:`anrm.sweep.run_chunks`; the
+    sweep's observables must include `cparp` and `aparp`.
+    """
+
+    def __init__(self, network, threshold=0.5, cparp='Obs_cPARP',
+                 aparp='Obs_aPARP', parp_0='PARP_0'):
+        self.threshold = threshold
+        self.cparp = cparp
+        self.aparp = aparp
+        self.parp_index = network.param_index(parp_0)
+
+    def __call__(self, tspan, observables, params, values):
+        cparp = values[:, :, observables.index(self.cparp)]
+        aparp = values[:, :, observables.index(self.aparp)]
+        fates, times = classify(tspan, cparp, aparp,
+                                params[:, self.parp_index], self.threshold)
+        return fates, times.astype(np.float32)
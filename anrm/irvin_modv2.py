@@ -278,11 +278,11 @@ def SecondaryComplex_to_Bid():
     # -------------RIP3 Binding Interactions
     Ripto1_Flip_S = FADD(bDD=ANY, bDED1=ANY, bDED2=ANY) % RIP1(bDD=ANY, bRHIM=None, state='unmod') % TRADD(bDD1=ANY, bDD2=ANY, state='active') % flip_S(bDED=ANY) % proC8(bDED=ANY)
     Necrosome1 = FADD(bDD=ANY, bDED1=ANY, bDED2=ANY) % RIP1(bDD=ANY, bRHIM=6, state='unmod') % TRADD(bDD1=ANY, bDD2=ANY, state='active') % flip_S(bDED=ANY) % proC8(bDED=ANY) % RIP3(bRHIM= 6, state = 'unmod')
-    Rule('RIP3_binding1', Ripto1_Flip_S + RIP3(bRHIM= None, state = 'unmod') <> Necrosome1, KF, KR)
+    Rule('RIP3_binding1', Ripto1_Flip_S + RIP3(bRHIM= None, state = 'unmod') | Necrosome1, KF, KR)
 
     Ripto2_Flip_S = FADD(bDD=ANY, bDED1=ANY, bDED2=ANY) % RIP1(bDD=ANY, bRHIM=None, state='unmod') % flip_S(bDED=ANY) % proC8(bDED=ANY)
     Necrosome2 = FADD(bDD=ANY, bDED1=ANY, bDED2=ANY) % RIP1(bDD=ANY, bRHIM=5, state='unmod') % flip_S(bDED=ANY) % proC8(bDED=ANY) % RIP3(bRHIM= 5, state = 'unmod')
-    Rule('RIP3_binding2', Ripto2_Flip_S + RIP3(bRHIM= None, state = 'unmod') <> Necrosome2, KF, KR)
+    Rule('RIP3_binding2', Ripto2_Flip_S + RIP3(bRHIM= None, state = 'unmod') | Necrosome2, KF, KR)
     
     #RIP3 Truncation
     catalyze_state(C8(bC8=None), 'bC8', RIP3(), 'bRHIM', 'state', 'unmod', 'trunc', [KF, KR, KC])
@@ -452,7 +452,7 @@ def Bax_tetramerizes():
     #       Bax(s1=3, s2=2, **active_unbound) %
     #       Bax(s1=4, s2=3, **active_unbound))
     KF_scaled = 1e-6*rate_scaling_factor
-    Rule('Bax_dimerization', active_bax_monomer + active_bax_monomer <> bax2,
+    Rule('Bax_dimerization', active_bax_monomer + active_bax_monomer | bax2,
          Parameter('Bax_dimerization_kf', KF_scaled),
          Parameter('Bax_dimerization_kr', KR))
     # Notes on the parameter values used below:
@@ -468,7 +468,7 @@ def Bax_tetramerizes():
     #    applied here to make the rate match the original Albeck ODEs.
     KF_Bax_tetramerization = 2*1.0e-6*rate_scaling_factor
     KR_Bax_tetramerization = 0.5*1.0e-3
-    Rule('Bax_tetramerization', bax2 + bax2 <> bax4,
+    Rule('Bax_tetramerization', bax2 + bax2 | bax4,
          Parameter('Bax_tetramerization_kf', KF_Bax_tetramerization),
          Parameter('Bax_tetramerization_kr', KR_Bax_tetramerization))
 
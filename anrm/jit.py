@@ -0,0 +1,329 @@
+"""
+Overview
+========
+
+Optional Numba kernels for the right-hand side, Jacobian and SSA loop.
+
+The NumPy evaluation in :py:class:`~anrm.network.Network` is vectorized,
+but every right-hand side or Jacobian evaluation is still a dozen array
+operations with temporaries, and for a network of the size of ANRM the call
+overhead dominates. This module generates, from the reactions of a network,
+straight-line Python source with one line per reaction (or per Jacobian
+contribution) and compiles it with Numba:
+
+- ``rhs(y, k, dy)``: dy/dt of a batch of states, without temporaries;
+- ``jac(y, k, data)``: the values of the Jacobian in a fixed CSC pattern;
+- ``ssa(y, k, tspan, out, seed, ...)``: the whole Gillespie loop, with the
+  propensities inlined.
+
+The kernels are compiled with ``nogil=True``, so threads can run them
+concurrently. The source is written to `cache_dir` under a name derived from
+a hash of the reaction structure, and Numba caches the compiled machine code
+next to it, so a network is only compiled again when its reactions change
+(Parameter values are arguments, not constants).
+
+Numba is optional. :py:func:`kernels` returns None, with a warning, when it
+is not installed, and :py:class:`~anrm.simulator.Simulator` and
+:py:class:`~anrm.ssa.StochasticSimulator` (``jit=True``) then keep using
+NumPy. ``benchmarks/jit.py`` compares both paths.
+"""
+
+import hashlib
+import importlib.util
+import os
+import warnings
+
+import numpy as np
+import scipy.sparse as sparse
+
+# Bump when the generated code changes, to invalidate cached kernels.
+_GENERATOR_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'anrm',
+                                 'jit')
+
+_loaded = {}
+
+
+def available():
+    """Return whether Numba is installed."""
+
+    return importlib.util.find_spec('numba') is not None
+
+def network_key(network):
+    """Hash of the reaction structure of `network` (not of its values)."""
+
+    h = hashlib.sha1(('anrm-jit-%d-%d' % (_GENERATOR_VERSION,
+                                          network.n_species)).encode('ascii'))
+    for a in (network.reactants, network.products):
+        h.update(np.ascontiguousarray(a, dtype=np.int64).tobytes())
+        h.update(str(a.shape).encode('ascii'))
+    return h.hexdigest()
+
+def kernels(network, cache_dir=None):
+    """Return the compiled :py:class:`Kernels` of `network`, or None.
+
+    Compiles (or loads from `cache_dir`, by default
+    :py:data:`DEFAULT_CACHE_DIR`) the kernels of the network's structure.
+    Returns None, with a warning, if Numba is not installed.
+    """
+
+    if not available():
+        warnings.warn("Numba is not installed; using the NumPy kernels")
+        return None
+    key = network_key(network)
+    if key not in _loaded:
+        _loaded[key] = Kernels(network, _load(network, key, cache_dir))
+    return _loaded[key]
+
+
+class Kernels(object):
+    """Compiled kernels of one network structure.
+
+    Wraps the generated module with the precomputed Jacobian pattern and
+    state-change tables, and builds solver callables from it.
+    """
+
+    def __init__(self, network, module):
+        self.module = module
+        self.n_species = network.n_species
+        self.n_reactions = network.n_reactions
+        pattern, _ = _jacobian_entries(network)
+        self.indices = pattern.indices.astype(np.int64)
+        self.indptr = pattern.indptr.astype(np.int64)
+        self.nnz = pattern.nnz
+        S = network.stoichiometry.tocsc()
+        self.change_index = S.indices.astype(np.int64)
+        self.change_delta = S.data.astype(float)
+        self.change_ptr = S.indptr.astype(np.int64)
+
+    def rhs(self, y, k, out=None):
+        """dy/dt for state(s) `y` and matching rate constants `k`."""
+
+        y2, k2 = _rows(y, k)
+        if out is None:
+            out = np.empty(y2.shape)
+        self.module.rhs(y2, k2, out.reshape(y2.shape))
+        return out.reshape(np.shape(y))
+
+    def jacobian(self, y, k):
+        """Sparse (CSC) Jacobian of a state, or block-diagonal Jacobian of a
+        batch, as :py:meth:`Network.jacobian` and
+        :py:meth:`Network.batch_jacobian`."""
+
+        y2, k2 = _rows(y, k)
+        data = np.empty((len(y2), self.nnz))
+        self.module.jac(y2, k2, data)
+        indices, indptr = self._batch_pattern(len(y2))
+        n = len(y2) * self.n_species
+        return sparse.csc_matrix((data.ravel(), indices, indptr),
+                                 shape=(n, n))
+
+    def functions(self, k, batch, influx=0.):
+        """Right-hand side and Jacobian callables for the BDF solver, as
+        :py:meth:`anrm.simulator.Simulator._functions` builds them."""
+
+        shape = (batch, self.n_species)
+        k2 = np.ascontiguousarray(np.broadcast_to(k, (batch,
+                                                      self.n_reactions)))
+        dy = np.empty(shape)
+        data = np.empty((batch, self.nnz))
+        indices, indptr = self._batch_pattern(batch)
+        n = batch * self.n_species
+        module = self.module
+
+        def fun(t, y):
+            module.rhs(y.reshape(shape), k2, dy)
+            return dy.ravel() + influx
+
+        def jac(t, y):
+            module.jac(y.reshape(shape), k2, data)
+            return sparse.csc_matrix((data.ravel().copy(), indices, indptr),
+                                     shape=(n, n))
+
+        return fun, jac
+
+    def ssa(self, y0, k, tspan, seed):
+        """Run one Gillespie trajectory; returns the states at `tspan`."""
+
+        out = np.empty((len(tspan), self.n_species))
+        self.module.ssa(np.array(y0, dtype=float), np.asarray(k, float),
+                        np.asarray(tspan, float), out, int(seed),
+                        self.change_index, self.change_delta, self.change_ptr)
+        return out
+
+    def _batch_pattern(self, batch):
+        cached = getattr(self, '_pattern', None)
+        if cached is None or cached[0] != batch:
+            offsets = np.arange(batch)
+            indices = (self.indices[None, :] +
+                       self.n_species * offsets[:, None]).ravel()
+            indptr = np.concatenate(
+                [(self.indptr[:-1][None, :] +
+                  self.nnz * offsets[:, None]).ravel(),
+                 [batch * self.nnz]])
+            cached = (batch, indices, indptr)
+            self._pattern = cached
+        return cached[1], cached[2]
+
+
+# Code generation
+# ===============
+
+def source(network):
+    """Return the Python/Numba source of the kernels of `network`."""
+
+    n = network.n_species
+    lines = ['# Generated by anrm.jit for network %r; do not edit.' %
+             network.name,
+             '# %d species, %d reactions' % (n, network.n_reactions),
+             'import numpy as np',
+             'from numba import njit',
+             '', '']
+
+    # Right-hand side
+    lines += ['@njit(cache=True, nogil=True)',
+              'def rhs(y, k, dy):',
+              '    for b in range(y.shape[0]):',
+              '        x = y[b]',
+              '        c = k[b]',
+              '        d = dy[b]',
+              '        d[:] = 0.']
+    S = network.stoichiometry.tocsc()
+    for j in range(network.n_reactions):
+        lines.append('        r = c[%d]%s' % (
+            j, ''.join(' * x[%d]' % s for s in network.reactants[j]
+                       if s < n)))
+        for i, coeff in zip(S.indices[S.indptr[j]:S.indptr[j + 1]],
+                            S.data[S.indptr[j]:S.indptr[j + 1]]):
+            lines.append('        d[%d] %s' % (i, _increment(coeff, 'r')))
+    lines += ['', '']
+
+    # Jacobian values in the fixed CSC pattern
+    _, entries = _jacobian_entries(network)
+    lines += ['@njit(cache=True, nogil=True)',
+              'def jac(y, k, data):',
+              '    for b in range(y.shape[0]):',
+              '        x = y[b]',
+              '        c = k[b]',
+              '        v = data[b]',
+              '        v[:] = 0.']
+    for j, others, targets in entries:
+        lines.append('        r = c[%d]%s' % (
+            j, ''.join(' * x[%d]' % s for s in others if s < n)))
+        for pos, coeff in targets:
+            lines.append('        v[%d] %s' % (pos, _increment(coeff, 'r')))
+    lines += ['', '']
+
+    # SSA propensities and direct-method loop
+    lines += ['@njit(cache=True, nogil=True)',
+              'def propensities(x, c, a):']
+    for j in range(network.n_reactions):
+        factors, seen = [], {}
+        for s in network.reactants[j]:
+            if s < n:
+                m = seen.get(s, 0)
+                seen[s] = m + 1
+                factors.append(' * x[%d]' % s if m == 0 else
+                               ' * max(x[%d] - %d., 0.)' % (s, m))
+        lines.append('    a[%d] = c[%d]%s' % (j, j, ''.join(factors)))
+    lines += ['', '',
+              '@njit(cache=True, nogil=True)',
+              'def ssa(y, k, tspan, out, seed, index, delta, ptr):',
+              '    np.random.seed(seed)',
+              '    R = %d' % network.n_reactions,
+              '    a = np.empty(R)',
+              '    y[:] = np.round(y)',
+              '    t = tspan[0]',
+              '    i = 0',
+              '    while i < len(tspan):',
+              '        propensities(y, k, a)',
+              '        a0 = a.sum()',
+              '        t_next = np.inf',
+              '        if a0 > 0.:',
+              '            t_next = t + np.random.exponential(1. / a0)',
+              '        while i < len(tspan) and tspan[i] < t_next:',
+              '            out[i, :] = y',
+              '            i += 1',
+              '        if i == len(tspan):',
+              '            break',
+              '        u = np.random.random() * a0',
+              '        j = 0',
+              '        acc = a[0]',
+              '        while acc <= u and j < R - 1:',
+              '            j += 1',
+              '            acc += a[j]',
+              '        for q in range(ptr[j], ptr[j + 1]):',
+              '            y[index[q]] += delta[q]',
+              '        t = t_next',
+              '']
+    return '\n'.join(lines)
+
+def _increment(coeff, name):
+    if coeff == 1:
+        return '+= %s' % name
+    if coeff == -1:
+        return '-= %s' % name
+    return '+= %r * %s' % (float(coeff), name)
+
+def _jacobian_entries(network):
+    """Return the CSC pattern of the Jacobian and how to fill it.
+
+    Each entry of the list is (reaction, other reactant slots, targets): the
+    derivative of the reaction rate with respect to one reactant slot is the
+    rate constant times the other slots, and is added, times the
+    stoichiometric coefficient, at each (position in the data array,
+    coefficient) of `targets`.
+    """
+
+    n = network.n_species
+    S = network.stoichiometry.tocsc()
+    rows, cols, contributions = [], [], []
+    for row, col, others in zip(network._dv_rows, network._dv_cols,
+                                network._dv_others):
+        species = S.indices[S.indptr[row]:S.indptr[row + 1]]
+        coeffs = S.data[S.indptr[row]:S.indptr[row + 1]]
+        rows.extend(species)
+        cols.extend([col] * len(species))
+        contributions.append((row, others, species, coeffs, col))
+    pattern = sparse.csc_matrix((np.ones(len(rows)), (rows, cols)),
+                                shape=(n, n))
+    pattern.sort_indices()
+    position = {}
+    for c in range(n):
+        for p in range(pattern.indptr[c], pattern.indptr[c + 1]):
+            position[(pattern.indices[p], c)] = p
+    entries = [(int(row), [int(s) for s in others],
+                [(position[(i, col)], coeff)
+                 for i, coeff in zip(species, coeffs)])
+               for row, others, species, coeffs, col in contributions]
+    return pattern, entries
+
+def _load(network, key, cache_dir=None):
+    """Write the kernel source to the cache (once) and import it."""
+
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    name = 'anrm_jit_%s' % key
+    path = os.path.join(cache_dir, name + '.py')
+    if not os.path.exists(path):
+        # Write under a temporary name first, so that concurrent workers
+        # never import a partial file
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(source(network))
+        os.replace(tmp, path)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def _rows(y, k):
+    """Return `y` and `k` as C-contiguous 2D arrays of matching rows."""
+
+    y2 = np.ascontiguousarray(np.atleast_2d(y), dtype=float)
+    k2 = np.ascontiguousarray(np.broadcast_to(k, (len(y2), np.shape(k)[-1])),
+                              dtype=float)
+    return y2, k2
@@ -0,0 +1,210 @@
+"""
+Overview
+========
+
+Linear solvers for the Newton iterations of the stiff integrator.
+
+Every implicit BDF step solves systems ``(I - c J) x = b`` with the Jacobian
+`J` of the network. SciPy's BDF factorizes them with SuperLU and a fresh
+fill-reducing column ordering each time, which is wasteful once the network
+is large (pore assembly and transport multiply the species count) and
+overkill when it is small. :py:class:`~anrm.simulator.Simulator` takes one
+of the following instead (its `linear_solver` argument):
+
+``'dense'``
+    LAPACK LU of the dense matrix; fastest for small systems.
+``'splu'``
+    SuperLU with a COLAMD ordering computed at every factorization (SciPy's
+    default).
+``'splu-reuse'``
+    SuperLU with the COLAMD ordering computed once and reused for every
+    later factorization of the same system, as the sparsity pattern of the
+    network does not change between steps.
+``'gmres'``
+    Restarted GMRES on the sparse matrix, preconditioned with an incomplete
+    LU factorization (recomputed whenever the integrator would refactorize).
+``'auto'``
+    One of the above by system size (see :py:func:`choose`).
+
+The solvers plug into :py:class:`scipy.integrate.BDF` by replacing its
+``lu`` and ``solve_lu`` methods (see :py:func:`attach`), so the step-size and
+order control of the integrator are unchanged.
+"""
+
+import numpy as np
+import scipy.linalg as linalg
+import scipy.sparse as sparse
+import scipy.sparse.linalg as splinalg
+
+# System sizes (species x batch) up to which 'auto' picks dense LU and
+# sparse direct factorization; larger systems use GMRES. On synthetic pore
+# assembly networks (benchmarks/linear_solvers.py) dense LU and SuperLU break
+# even at a few hundred species and GMRES overtakes SuperLU at about a
+# thousand (at 4881 species: 180 s dense, 38 s splu, 31 s splu-reuse, 9 s
+# gmres).
+DENSE_MAX = 300
+DIRECT_MAX = 1000
+
+
+class LinearSolver(object):
+    """Factorization and solution of the integrator's Newton systems."""
+
+    name = None
+
+    def factor(self, A):
+        """Return a factorization of the sparse matrix `A`."""
+        raise NotImplementedError
+
+    def solve(self, factor, b):
+        """Solve with a factorization returned by :py:meth:`factor`."""
+        raise NotImplementedError
+
+    def __repr__(self):
+        return '%s()' % type(self).__name__
+
+
+class DenseLU(LinearSolver):
+    """LAPACK LU of the matrix converted to dense."""
+
+    name = 'dense'
+
+    def factor(self, A):
+        if sparse.issparse(A):
+            A = A.toarray()
+        return linalg.lu_factor(A, overwrite_a=True, check_finite=False)
+
+    def solve(self, factor, b):
+        return linalg.lu_solve(factor, b, check_finite=False)
+
+
+class SparseLU(LinearSolver):
+    """SuperLU with a new COLAMD ordering at every factorization."""
+
+    name = 'splu'
+
+    def factor(self, A):
+        return splinalg.splu(sparse.csc_matrix(A))
+
+    def solve(self, factor, b):
+        return factor.solve(b)
+
+
+class ReusedOrderingLU(LinearSolver):
+    """SuperLU reusing the column ordering of the first factorization.
+
+    The ordering depends only on the sparsity pattern, which is the same at
+    every step (and for every solver restart) of a given network and batch
+    size, so only the numerical factorization is repeated.
+    """
+
+    name = 'splu-reuse'
+
+    def __init__(self):
+        self.perm = None
+
+    def factor(self, A):
+        A = sparse.csc_matrix(A)
+        if self.perm is None or len(self.perm) != A.shape[1]:
+            lu = splinalg.splu(A, permc_spec='COLAMD')
+            self.perm = lu.perm_c.copy()
+            self._inverse = np.argsort(self.perm)
+            return lu, None
+        return splinalg.splu(A[:, self._inverse],
+                             permc_spec='NATURAL'), self.perm
+
+    def solve(self, factor, b):
+        lu, perm = factor
+        if perm is None:
+            return lu.solve(b)
+        return lu.solve(b)[perm]
+
+
+class GMRES(LinearSolver):
+    """ILU-preconditioned restarted GMRES.
+
+    Parameters
+    ----------
+    rtol : float
+        Relative residual at which the iterations stop; the Newton iteration
+        of the integrator tolerates inexact solves, but not very inexact
+        ones.
+    drop_tol, fill_factor : float
+        Parameters of the incomplete factorization (see
+        :py:func:`scipy.sparse.linalg.spilu`).
+    restart, maxiter : int
+        GMRES restart length and maximum number of restarts.
+    """
+
+    name = 'gmres'
+
+    def __init__(self, rtol=1e-10, drop_tol=1e-5, fill_factor=10, restart=30,
+                 maxiter=20):
+        self.rtol = rtol
+        self.drop_tol = drop_tol
+        self.fill_factor = fill_factor
+        self.restart = restart
+        self.maxiter = maxiter
+
+    def factor(self, A):
+        A = sparse.csc_matrix(A)
+        ilu = splinalg.spilu(A, drop_tol=self.drop_tol,
+                             fill_factor=self.fill_factor)
+        M = splinalg.LinearOperator(A.shape, ilu.solve)
+        return A, ilu, M
+
+    def solve(self, factor, b):
+        A, ilu, M = factor
+        x0 = ilu.solve(b)
+        try:
+            x, info = splinalg.gmres(A, b, x0=x0, M=M, rtol=self.rtol,
+                                     atol=0., restart=self.restart,
+                                     maxiter=self.maxiter)
+        except TypeError:
+            # SciPy < 1.12 calls the relative tolerance `tol`
+            x, info = splinalg.gmres(A, b, x0=x0, M=M, tol=self.rtol,
+                                     atol=0., restart=self.restart,
+                                     maxiter=self.maxiter)
+        # On failure the Newton iteration sees a poor update, rejects the
+        # step and retries with a smaller one.
+        return x
+
+
+SOLVERS = {'dense': DenseLU, 'splu': SparseLU, 'splu-reuse': ReusedOrderingLU,
+           'gmres': GMRES}
+
+
+def choose(n):
+    """Return the name of the solver 'auto' picks for `n` unknowns."""
+
+    if n <= DENSE_MAX:
+        return 'dense'
+    if n <= DIRECT_MAX:
+        return 'splu-reuse'
+    return 'gmres'
+
+def make(spec, n):
+    """Return a :py:class:`LinearSolver` for `spec` and system size `n`.
+
+    `spec` is a solver name, 'auto', or a :py:class:`LinearSolver`.
+    """
+
+    if isinstance(spec, LinearSolver):
+        return spec
+    if spec == 'auto':
+        spec = choose(n)
+    try:
+        return SOLVERS[spec]()
+    except KeyError:
+        raise ValueError("Unknown linear solver '%s'; expected one of %s" %
+                         (spec, ', '.join(sorted(SOLVERS) + ['auto'])))
+
+def attach(solver, linear):
+    """Make the BDF integrator `solver` use the linear solver `linear`."""
+
+    def lu(A):
+        solver.nlu += 1
+        return linear.factor(A)
+
+    solver.lu = lu
+    solver.solve_lu = linear.solve
+    return solver
@@ -0,0 +1,352 @@
+"""
+Overview
+========
+
+Bayesian inference of ANRM rate constants with ensemble MCMC.
+
+:py:class:`EnsembleSampler` samples the posterior of a set of Parameters
+(e.g. ``Kc_PARPactiv``, ``Kc_PARPautoa``, ``Ka_RIP1_FADD``, ``KF``) in
+log10 space, under a uniform prior on a box, with
+
+- the affine-invariant "stretch move" of Goodman & Weare (2010), in the
+  red/blue form of Foreman-Mackey et al. (2013) so that the proposals of half
+  an ensemble are independent and can be evaluated together, and
+- optionally, parallel tempering: one ensemble per temperature on a
+  geometric ladder, with swaps between neighbouring temperatures after every
+  step, which lets walkers cross between separated modes.
+
+All proposals of one half-step, across all temperatures, are evaluated as
+one set of chunks through a sweep backend (see :py:mod:`anrm.sweep`): each
+chunk is integrated as a batch and reduced to log-likelihoods inside the
+worker, so throughput scales with the number of processes of a
+:py:class:`~anrm.sweep.PoolBackend`.
+
+The sampler state (positions, chain, random generator) is written to a
+checkpoint file every few steps, and :py:meth:`EnsembleSampler.run` resumes
+from it when it exists, so long runs survive interruption::
+
+    like = GaussianLikelihood({'Obs_cPARP': cparp_data}, sigma=2e4)
+    sampler = EnsembleSampler(network, tspan, like,
+                              ['Kc_PARPactiv', 'Kc_PARPautoa', 'KF'],
+                              bounds=[(-12, -8), (-6, -2), (-8, -4)],
+                              n_temps=4, checkpoint='anrm-mcmc.npz')
+    with PoolBackend() as backend:
+        sampler.backend = backend
+        sampler.run(5000)
+    samples = sampler.flatchain(burn=1000)
+
+Goodman, J., & Weare, J. (2010). Ensemble samplers with affine invariance.
+Communications in Applied Mathematics and Computational Science, 5(1),
+65-80.
+
+Foreman-Mackey, D., Hogg, D. W., Lang, D., & Goodman, J. (2013). emcee: The
+MCMC Hammer. PASP, 125(925), 306-312.
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from anrm.sweep import SerialBackend, SweepSpec
+
+
+class GaussianLikelihood(object):
+    """Independent Gaussian errors on observable time courses.
+
+    Usable as the `reduce` step of a sweep: it turns a chunk's observables
+    into one log-likelihood per parameter set, -inf for failed simulations.
+
+    Parameters
+    ----------
+    data : dict
+        Maps observable names to measured values on the sampler's `tspan`
+        (NaN where not measured).
+    sigma : float or dict
+        Standard deviation of the measurement error, per observable if a
+        dict.
+    """
+
+    def __init__(self, data, sigma):
+        self.observables = list(data)
+        self.data = np.column_stack([np.asarray(data[o], dtype=float)
+                                     for o in self.observables])
+        if isinstance(sigma, dict):
+            sigma = [sigma[o] for o in self.observables]
+        self.sigma = np.broadcast_to(np.asarray(sigma, dtype=float),
+                                     self.data.shape)
+        self._mask = np.isfinite(self.data)
+
+    def __call__(self, tspan, observables, params, values):
+        cols = [observables.index(o) for o in self.observables]
+        resid = (values[:, :, cols] - self.data) / self.sigma
+        resid = np.where(self._mask, resid, 0.)
+        logl = -0.5 * (resid ** 2).sum(axis=(1, 2))
+        return np.where(np.isfinite(logl), logl, -np.inf)
+
+
+class EnsembleSampler(object):
+    """Affine-invariant ensemble sampler with optional parallel tempering.
+
+    Parameters
+    ----------
+    network : anrm.network.Network
+        Network to simulate.
+    tspan : array of floats
+        Output times of the simulations.
+    log_likelihood : callable
+        Picklable sweep reduction returning one log-likelihood per parameter
+        set, such as :py:class:`GaussianLikelihood`. Its `observables`
+        attribute, if present, selects the simulated observables.
+    parameters : list of strings
+        Names of the sampled Parameters; they are sampled as log10 values.
+    bounds : list of (low, high)
+        Uniform prior bounds of each log10 Parameter.
+    n_walkers : int
+        Walkers per temperature (even, at least twice the dimension).
+    n_temps : int
+        Number of temperatures; 1 disables tempering.
+    t_max : float
+        Highest temperature of the geometric ladder.
+    param_values : dict, optional
+        Values of the Parameters that are not sampled.
+    backend : optional
+        Sweep backend evaluating the likelihood (default: serial).
+    chunk_size : int
+        Proposals integrated together as one batch.
+    stretch : float
+        Scale `a` of the stretch move.
+    seed : int, optional
+        Seed of the sampler's random generator.
+    checkpoint : string, optional
+        File to save the sampler state to and resume from.
+    """
+
+    def __init__(self, network, tspan, log_likelihood, parameters, bounds,
+                 n_walkers=32, n_temps=1, t_max=50., param_values=None,
+                 backend=None, chunk_size=16, stretch=2., seed=None,
+                 checkpoint=None, rtol=1e-3, atol=1e-6):
+        self.network = network
+        self.parameters = list(parameters)
+        self.bounds = np.asarray(bounds, dtype=float).reshape(-1, 2)
+        self.dim = len(self.parameters)
+        if n_walkers % 2 or n_walkers < 2 * self.dim:
+            raise ValueError("n_walkers must be even and at least %d" %
+                             (2 * self.dim))
+        self.n_walkers = n_walkers
+        self.betas = t_max ** -np.linspace(0., 1., n_temps)
+        self.base = network.param_vector(param_values)
+        self.index = [network.param_index(p) for p in self.parameters]
+        observables = getattr(log_likelihood, 'observables', None)
+        if observables is None:
+            observables = list(network.observables)
+        self.spec = SweepSpec(network, np.asarray(tspan, dtype=float),
+                              list(observables), rtol, atol, log_likelihood)
+        self.backend = backend or SerialBackend()
+        self.chunk_size = chunk_size
+        self.stretch = stretch
+        self.rng = np.random.default_rng(seed)
+        self.checkpoint = checkpoint
+
+        self.position = None
+        self.logl = None
+        self.iteration = 0
+        self._chain = []
+        self._chain_logl = []
+        self.accepted = np.zeros(n_temps)
+        self.proposed = np.zeros(n_temps)
+        self.swaps_accepted = np.zeros(max(n_temps - 1, 0))
+        self.swaps_proposed = np.zeros(max(n_temps - 1, 0))
+        self.n_evaluations = 0
+        self.evaluation_time = 0.
+
+    @property
+    def n_temps(self):
+        return len(self.betas)
+
+    # Likelihood evaluation
+    # ---------------------
+
+    def log_prior(self, theta):
+        """Log of the (unnormalized) uniform prior of log10 values."""
+
+        inside = np.all((theta >= self.bounds[:, 0]) &
+                        (theta <= self.bounds[:, 1]), axis=-1)
+        return np.where(inside, 0., -np.inf)
+
+    def evaluate(self, theta):
+        """Return the log-likelihood of each row of log10 values `theta`.
+
+        Rows outside the prior are not simulated.
+        """
+
+        theta = np.atleast_2d(theta)
+        logl = np.full(len(theta), -np.inf)
+        inside = np.nonzero(np.isfinite(self.log_prior(theta)))[0]
+        if len(inside):
+            params = np.tile(self.base, (len(inside), 1))
+            params[:, self.index] = 10. ** theta[inside]
+            chunks = [params[i:i + self.chunk_size]
+                      for i in range(0, len(params), self.chunk_size)]
+            start = time.time()
+            logl[inside] = np.concatenate(self.backend.run(self.spec, chunks))
+            self.evaluation_time += time.time() - start
+            self.n_evaluations += len(inside)
+        return logl
+
+    @property
+    def evaluations_per_second(self):
+        """Likelihood throughput so far."""
+        return self.n_evaluations / max(self.evaluation_time, 1e-12)
+
+    # Sampling
+    # --------
+
+    def run(self, n_steps, p0=None, checkpoint_every=10):
+        """Advance the sampler until `n_steps` steps have been taken.
+
+        Resumes from the checkpoint file if it exists. Otherwise the walkers
+        start at `p0` (temps x walkers x dim, or walkers x dim for all
+        temperatures), or by default in a small ball around the nominal
+        Parameter values, clipped to the prior box.
+        """
+
+        if self.position is None:
+            if self.checkpoint and os.path.exists(self.checkpoint):
+                self.load(self.checkpoint)
+            else:
+                self._start(p0)
+        while self.iteration < n_steps:
+            self.step()
+            if self.checkpoint and (self.iteration % checkpoint_every == 0 or
+                                    self.iteration == n_steps):
+                self.save(self.checkpoint)
+        return self
+
+    def _start(self, p0):
+        shape = (self.n_temps, self.n_walkers, self.dim)
+        if p0 is None:
+            center = np.log10(np.maximum(self.base[self.index], 1e-300))
+            width = 0.01 * (self.bounds[:, 1] - self.bounds[:, 0])
+            p0 = center + width * self.rng.standard_normal(shape)
+            p0 = np.clip(p0, self.bounds[:, 0], self.bounds[:, 1])
+        self.position = np.broadcast_to(np.asarray(p0, float), shape).copy()
+        self.logl = self.evaluate(self.position.reshape(-1, self.dim)) \
+            .reshape(shape[:2])
+
+    def step(self):
+        """Take one stretch-move step in every ensemble, then try swaps."""
+
+        half = self.n_walkers // 2
+        a = self.stretch
+        for first in (True, False):
+            active = slice(0, half) if first else slice(half, None)
+            other = slice(half, None) if first else slice(0, half)
+            x = self.position[:, active]
+            partners = self.position[:, other]
+            z = ((a - 1.) * self.rng.random((self.n_temps, half)) + 1.) ** 2 / a
+            pick = self.rng.integers(0, half, (self.n_temps, half))
+            chosen = np.take_along_axis(partners, pick[:, :, None], axis=1)
+            proposal = chosen + z[:, :, None] * (x - chosen)
+            logl = self.evaluate(proposal.reshape(-1, self.dim)) \
+                .reshape(self.n_temps, half)
+            old = self.logl[:, active]
+            with np.errstate(invalid='ignore'):
+                log_ratio = ((self.dim - 1.) * np.log(z) +
+                             self.betas[:, None] * (logl - old))
+            log_ratio = np.where(np.isfinite(logl), log_ratio, -np.inf)
+            accept = np.log(self.rng.random(log_ratio.shape)) < log_ratio
+            x[accept] = proposal[accept]
+            old[accept] = logl[accept]
+            self.position[:, active] = x
+            self.logl[:, active] = old
+            self.accepted += accept.sum(axis=1)
+            self.proposed += half
+        self._swap()
+        self.iteration += 1
+        self._chain.append(self.position[0].copy())
+        self._chain_logl.append(self.logl[0].copy())
+
+    def _swap(self):
+        """Propose exchanges between neighbouring temperatures."""
+
+        for t in range(self.n_temps - 1, 0, -1):
+            hot = self.rng.permutation(self.n_walkers)
+            cold = self.rng.permutation(self.n_walkers)
+            dbeta = self.betas[t - 1] - self.betas[t]
+            with np.errstate(invalid='ignore'):
+                log_ratio = dbeta * (self.logl[t, hot] - self.logl[t - 1, cold])
+            accept = np.log(self.rng.random(self.n_walkers)) < log_ratio
+            h, c = hot[accept], cold[accept]
+            self.position[t, h], self.position[t - 1, c] = \
+                self.position[t - 1, c].copy(), self.position[t, h].copy()
+            self.logl[t, h], self.logl[t - 1, c] = \
+                self.logl[t - 1, c].copy(), self.logl[t, h].copy()
+            self.swaps_accepted[t - 1] += accept.sum()
+            self.swaps_proposed[t - 1] += self.n_walkers
+
+    # Results
+    # -------
+
+    @property
+    def chain(self):
+        """Positions of the posterior (T=1) walkers, steps x walkers x dim."""
+        return np.array(self._chain).reshape(-1, self.n_walkers, self.dim)
+
+    @property
+    def chain_logl(self):
+        """Log-likelihoods matching :py:attr:`chain`."""
+        return np.array(self._chain_logl).reshape(-1, self.n_walkers)
+
+    def flatchain(self, burn=0, thin=1):
+        """Posterior samples of log10 values, with burn-in and thinning."""
+        return self.chain[burn::thin].reshape(-1, self.dim)
+
+    @property
+    def acceptance_fraction(self):
+        """Fraction of accepted stretch moves, per temperature."""
+        return self.accepted / np.maximum(self.proposed, 1)
+
+    @property
+    def swap_acceptance_fraction(self):
+        """Fraction of accepted swaps between temperatures t and t+1."""
+        return self.swaps_accepted / np.maximum(self.swaps_proposed, 1)
+
+    # Checkpointing
+    # -------------
+
+    def save(self, path):
+        """Write the sampler state to `path` (an ``.npz`` file)."""
+
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, position=self.position, logl=self.logl,
+                 chain=self.chain, chain_logl=self.chain_logl,
+                 iteration=self.iteration, betas=self.betas,
+                 counters=np.concatenate([self.accepted, self.proposed,
+                                          self.swaps_accepted,
+                                          self.swaps_proposed]),
+                 parameters=np.array(self.parameters),
+                 rng=np.array(json.dumps(self.rng.bit_generator.state)))
+        os.replace(tmp, path)
+
+    def load(self, path):
+        """Restore the sampler state saved by :py:meth:`save`."""
+
+        with np.load(path) as f:
+            if list(f['parameters']) != self.parameters or \
+                    not np.allclose(f['betas'], self.betas):
+                raise ValueError("Checkpoint '%s' is for a different "
+                                 "sampler setup" % path)
+            self.position = f['position']
+            self.logl = f['logl']
+            self._chain = list(f['chain'])
+            self._chain_logl = list(f['chain_logl'])
+            self.iteration = int(f['iteration'])
+            n, m = self.n_temps, self.n_temps - 1
+            counters = f['counters']
+            self.accepted = counters[:n]
+            self.proposed = counters[n:2 * n]
+            self.swaps_accepted = counters[2 * n:2 * n + m]
+            self.swaps_proposed = counters[2 * n + m:]
+            self.rng.bit_generator.state = json.loads(str(f['rng']))
@@ -0,0 +1,360 @@
+"""
+Overview
+========
+
+Means and variances of the stochastic model in one deterministic run.
+
+Questions such as "how variable is the time to cPARP at ``Fas_0`` = 3000"
+concern the spread of the stochastic model, but do not need thousands of
+SSA trajectories (see :py:mod:`anrm.ssa`) when the noise is moderate.
+:py:class:`MomentSimulator` derives ODEs for the mean `m` and the covariance
+`C` of the species counts from the stoichiometry `S` and the mass-action
+rates `v` of the network, and integrates them with the stiff engine of
+:py:class:`~anrm.simulator.Simulator`:
+
+``'lna'`` (linear noise approximation)
+    ``dm/dt = S v(m)`` and ``dC/dt = J C + C J' + S diag(v(m)) S'``, with
+    `J` the Jacobian of the deterministic model at `m`.
+``'2ma'`` (second-order moment closure)
+    As above, but with the expected propensities ``E[v]`` of the stochastic
+    model, which for mass-action kinetics depend on the means and
+    covariances only (third central moments are set to zero), in both the
+    mean and the noise term.
+
+The state is `m` followed by `C` flattened, and the covariance part of the
+Jacobian is the sparse Kronecker sum ``I (x) J + J (x) I``, so the cost grows
+with the number of nonzeros of `J` times the number of species rather than
+with the square of the state size.
+
+:py:meth:`MomentSimulator.validate` runs a small SSA ensemble and reports
+where the approximation departs from it::
+
+    sim = MomentSimulator(network, method='2ma')
+    result = sim.run(tspan, {'Fas_0': 3000})
+    result.mean('Obs_cPARP'), result.std('Obs_cPARP')
+    result.crossing_time('Obs_cPARP', 0.5 * PARP_0)   # (mean, sd)
+    sim.validate(tspan, {'Fas_0': 3000}, n_cells=200)
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+
+from anrm import linsolve
+from anrm.fate import first_crossing
+from anrm.simulator import Simulator, _check_tspan
+
+METHODS = ('lna', '2ma')
+
+
+class MomentSimulator(Simulator):
+    """Mean and covariance ODEs of a network (see module docstring).
+
+    Parameters
+    ----------
+    model : pysb.Model or Network
+        Model to simulate.
+    method : string
+        'lna' for the linear noise approximation, '2ma' for the
+        second-order moment closure.
+
+    The remaining parameters are those of
+    :py:class:`~anrm.simulator.Simulator`. Dosing schedules are supported:
+    boluses shift the means and leave the covariances as they are, and
+    levels set with :py:meth:`~anrm.dosing.Schedule.set_level` are exact,
+    so they also zero the variance and covariances of their species.
+    """
+
+    def __init__(self, model, method='lna', rtol=1e-3, atol=1e-6,
+                 max_step=np.inf, linear_solver='auto'):
+        Simulator.__init__(self, model, rtol, atol, max_step, linear_solver)
+        if method not in METHODS:
+            raise ValueError("Unknown method '%s'; expected one of %s" %
+                             (method, ', '.join(METHODS)))
+        self.method = method
+        net = self.network
+        n = net.n_species
+
+        # vec(S diag(v) S') = K v, with K[(i, l), j] = S[i, j] S[l, j]
+        S = net.stoichiometry.tocsc()
+        rows, cols, data = [], [], []
+        for j in range(net.n_reactions):
+            idx = S.indices[S.indptr[j]:S.indptr[j + 1]]
+            val = S.data[S.indptr[j]:S.indptr[j + 1]]
+            rows.append((idx[:, None] * n + idx[None, :]).ravel())
+            cols.append(np.full(len(idx) ** 2, j))
+            data.append(np.outer(val, val).ravel())
+        self._noise = sparse.csr_matrix(
+            (np.concatenate(data + [[]]),
+             (np.concatenate(rows + [[]]).astype(np.intp),
+              np.concatenate(cols + [[]]).astype(np.intp))),
+            shape=(n * n, net.n_reactions))
+
+        # Pairs of reactant slots of every reaction, for the covariance
+        # correction of the expected propensities: reaction, the two
+        # species, the remaining slots (padded with n), and whether the
+        # pair is one species twice (n * (n - 1) propensity).
+        order = net.reactants.shape[1]
+        pair_j, pair_a, pair_b, pair_rest = [], [], [], []
+        for p in range(order):
+            for q in range(p + 1, order):
+                rest = [s for s in range(order) if s not in (p, q)]
+                for j in np.nonzero((net.reactants[:, p] < n) &
+                                    (net.reactants[:, q] < n))[0]:
+                    pair_j.append(j)
+                    pair_a.append(net.reactants[j, p])
+                    pair_b.append(net.reactants[j, q])
+                    pair_rest.append(net.reactants[j, rest])
+        self._pair_j = np.array(pair_j, dtype=np.intp)
+        self._pair_a = np.array(pair_a, dtype=np.intp)
+        self._pair_b = np.array(pair_b, dtype=np.intp)
+        self._pair_rest = np.array(pair_rest, dtype=np.intp).reshape(
+            len(pair_j), max(order - 2, 0))
+        self._pair_same = self._pair_a == self._pair_b
+
+    def run(self, tspan, param_values=None, y0=None, schedule=None,
+            covariance=False):
+        """Integrate the moment equations and return a
+        :py:class:`MomentResult`.
+
+        Takes the arguments of :py:meth:`Simulator.run`; the initial amounts
+        are exact (zero covariance). With `covariance`, the full species
+        covariance matrix is kept at every output time.
+        """
+
+        tspan = _check_tspan(tspan)
+        net = self.network
+        n = net.n_species
+        params = net.param_vector(param_values)
+        k = net.rate_constants(params)
+        if y0 is None:
+            y0 = net.initial_state(params)
+        x0 = np.concatenate([np.asarray(y0, dtype=float), np.zeros(n * n)])
+        if schedule is not None:
+            schedule = _MomentSchedule(schedule, n)
+        obs = net.obs_matrix.toarray()
+        means = np.empty((len(tspan), n))
+        variances = np.empty((len(tspan), n))
+        obs_variances = np.empty((len(tspan), len(net.observables)))
+        cov = np.empty((len(tspan), n, n)) if covariance else None
+        for i, block in self._integrate(tspan, x0, k, schedule):
+            C = block[:, n:].reshape(len(block), n, n)
+            C = 0.5 * (C + C.transpose(0, 2, 1))
+            means[i:i + len(block)] = block[:, :n]
+            variances[i:i + len(block)] = np.diagonal(C, axis1=1, axis2=2)
+            obs_variances[i:i + len(block)] = np.einsum('on,lnm,om->lo',
+                                                        obs, C, obs)
+            if covariance:
+                cov[i:i + len(block)] = C
+        return MomentResult(net, tspan, means, variances, obs_variances, cov)
+
+    def validate(self, tspan, param_values=None, n_cells=100, tolerance=0.2,
+                 seed=None, observables=None):
+        """Compare the moments with a small SSA ensemble.
+
+        Runs `n_cells` SSA trajectories and the moment equations with the
+        same Parameters. Returns a dict that maps every observable to a dict
+        with the relative error of the mean ('mean_error') and the ratio of
+        the standard deviations ('sd_ratio', moments over SSA) at every
+        output time, and the first time at which either is off by more than
+        `tolerance` beyond the sampling error of the ensemble
+        ('diverges_at', None if never).
+        """
+
+        from anrm.ssa import StochasticSimulator
+
+        tspan = _check_tspan(tspan)
+        net = self.network
+        names = net.observables if observables is None else observables
+        result = self.run(tspan, param_values)
+        ssa = StochasticSimulator(net, seed=seed)
+        runs = [ssa.run(tspan, param_values) for _ in range(n_cells)]
+        report = {}
+        for name in names:
+            x = np.array([r[name] for r in runs])
+            m_ssa, sd_ssa = x.mean(axis=0), x.std(axis=0, ddof=1)
+            m, sd = result.mean(name), result.std(name)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scale = np.maximum(np.abs(m_ssa), 1.)
+                mean_error = (m - m_ssa) / scale
+                sd_ratio = np.where(sd_ssa > 0, sd / sd_ssa,
+                                    np.where(sd > 0, np.inf, 1.))
+            # Allow for the sampling error of the ensemble statistics
+            mean_slack = tolerance + 3. * sd_ssa / np.sqrt(n_cells) / scale
+            sd_slack = tolerance + 3. / np.sqrt(2. * (n_cells - 1))
+            bad = ((np.abs(mean_error) > mean_slack) |
+                   (np.abs(sd_ratio - 1.) > sd_slack)) & \
+                (np.maximum(sd, sd_ssa) >= 1.)
+            report[name] = {'mean_error': mean_error, 'sd_ratio': sd_ratio,
+                            'diverges_at': (float(tspan[np.argmax(bad)])
+                                            if bad.any() else None)}
+        return report
+
+    # Moment equations
+    # ----------------
+
+    def _segment(self, a, b, x, k, influx, t_out):
+        """Integrate the moment state `x` from `a` to `b` in place, as
+        :py:meth:`Simulator._segment` does for species."""
+
+        from scipy.integrate import BDF
+
+        n = self.network.n_species
+        # Error control over means and covariances alike; the tolerances
+        # are tightened so that the means keep the accuracy of a plain run.
+        scale = np.sqrt(x.size / float(n))
+        fun, jac = self._moment_functions(k, influx)
+        solver = BDF(fun, a, x.copy(), b, rtol=self.rtol / scale,
+                     atol=self.atol / scale, max_step=self.max_step, jac=jac)
+        linsolve.attach(solver, self._linear_solver(x.size))
+        j = 0
+        while solver.status == 'running':
+            message = solver.step()
+            if solver.status == 'failed':
+                raise RuntimeError("Integration failed at t=%g: %s" %
+                                   (solver.t, message))
+            m = np.searchsorted(t_out, solver.t, 'right')
+            if m > j:
+                yield j, solver.dense_output()(t_out[j:m]).T
+                j = m
+        x[...] = solver.y
+
+    def _expected_rates(self, m, C, k):
+        """Return E[v] under the closure and its derivative wrt vec(C)."""
+
+        n = self.network.n_species
+        v = self.network.reaction_rates(m, k)
+        mext = np.append(m, 1.)
+        weight = k[self._pair_j] * mext[self._pair_rest].prod(axis=1)
+        pair = C[self._pair_a, self._pair_b] - \
+            np.where(self._pair_same, m[self._pair_a], 0.)
+        v = v + np.bincount(self._pair_j, weight * pair,
+                            minlength=len(v))
+        dv_dC = sparse.csr_matrix(
+            (weight, (self._pair_j, self._pair_a * n + self._pair_b)),
+            shape=(len(v), n * n))
+        return v, dv_dC
+
+    def _moment_functions(self, k, influx=None):
+        net = self.network
+        n = net.n_species
+        S = net.stoichiometry
+        eye = sparse.identity(n, format='csr')
+        closure = self.method == '2ma'
+        if influx is None or not influx.any():
+            influx = 0.
+
+        def fun(t, x):
+            m, C = x[:n], x[n:].reshape(n, n)
+            J = net.jacobian(m, k)
+            if closure:
+                v, _ = self._expected_rates(m, C, k)
+            else:
+                v = net.reaction_rates(m, k)
+            JC = J.dot(C)
+            dC = JC + JC.T + self._noise.dot(v).reshape(n, n)
+            return np.concatenate([S.dot(v) + influx, dC.ravel()])
+
+        def jac(t, x):
+            # The dependence of J on the means in J C + C J' is left out;
+            # the Newton iteration of the integrator only needs an
+            # approximate Jacobian.
+            m, C = x[:n], x[n:].reshape(n, n)
+            dv = net.rate_jacobian(m, k)
+            J = sparse.csr_matrix(S.dot(dv))
+            top = [J, None]
+            if closure:
+                _, dv_dC = self._expected_rates(m, C, k)
+                top[1] = S.dot(dv_dC)
+            kron = sparse.kron(J, eye) + sparse.kron(eye, J)
+            return sparse.bmat([top, [self._noise.dot(dv), kron]],
+                               format='csc')
+
+        return fun, jac
+
+
+class MomentResult(object):
+    """Means and variances from :py:meth:`MomentSimulator.run`.
+
+    Attributes
+    ----------
+    tout : array of floats
+        Output times.
+    means, variances : array of floats
+        Mean and variance of every species count, times x species.
+    covariance : array of floats or None
+        Species covariance matrices, times x species x species, if asked
+        for.
+    """
+
+    def __init__(self, network, tout, means, variances, obs_variances,
+                 covariance=None):
+        self.network = network
+        self.tout = tout
+        self.means = means
+        self.variances = variances
+        self.covariance = covariance
+        self._obs_means = network.observe(means)
+        self._obs_variances = obs_variances
+
+    def mean(self, name):
+        """Mean trajectory of an observable or species."""
+
+        if name in self.network.observables:
+            return self._obs_means[:, self.network.observable_index(name)]
+        return self.means[:, self.network.species_index(name)]
+
+    def variance(self, name):
+        """Variance trajectory of an observable or species."""
+
+        if name in self.network.observables:
+            return self._obs_variances[:,
+                                       self.network.observable_index(name)]
+        return self.variances[:, self.network.species_index(name)]
+
+    def std(self, name):
+        """Standard deviation trajectory of an observable or species."""
+
+        return np.sqrt(np.maximum(self.variance(name), 0.))
+
+    def crossing_time(self, name, level):
+        """Mean and standard deviation of the time `name` reaches `level`.
+
+        The mean is the crossing time of the mean trajectory; the standard
+        deviation is that of the amount at this time divided by the slope of
+        the mean (first-order propagation). Returns (NaN, NaN) if the mean
+        never reaches `level`.
+        """
+
+        mean = self.mean(name)
+        t = first_crossing(self.tout, mean, level)[0]
+        if np.isnan(t):
+            return np.nan, np.nan
+        slope = np.gradient(mean, self.tout)
+        rate = np.interp(t, self.tout, slope)
+        sd = np.interp(t, self.tout, self.std(name))
+        return t, (sd / abs(rate) if rate != 0 else np.inf)
+
+
+class _MomentSchedule(object):
+    """A dosing schedule applied to a moment state (means, then vec(C))."""
+
+    def __init__(self, schedule, n):
+        self.schedule = schedule
+        self.n = n
+
+    def breakpoints(self, t0, t1):
+        return self.schedule.breakpoints(t0, t1)
+
+    def influx(self, network, time):
+        return self.schedule.influx(network, time)
+
+    def apply(self, network, time, x):
+        self.schedule.apply(network, time, x)
+        C = x[self.n:].reshape(self.n, self.n)
+        for t, species, kind, amount in self.schedule.events:
+            if t == time and kind == 'set':
+                # A level that is set is known exactly
+                i = network.species_index(species)
+                C[i, :] = 0.
+                C[:, i] = 0.
+        return x
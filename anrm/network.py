@@ -0,0 +1,797 @@
+"""
+Overview
+========
+
+A flat, PySB-free representation of a generated ANRM reaction network.
+
+The models in this package are written as PySB rules, but everything the
+simulators need once BioNetGen has expanded those rules fits in a handful of
+NumPy arrays:
+
+- the species names, in BioNetGen order,
+- one mass-action reaction per rate term, given as reactant and product
+  species indices plus a rate constant (a numeric factor times a model
+  Parameter),
+- the Parameter table,
+- the observable matrix (observables x species),
+- the initial-condition map (Parameter -> species).
+
+:py:class:`Network` holds these arrays and evaluates the reaction rates, the
+right-hand side of the ODEs and their (sparse) Jacobian. It is built from a
+PySB model with :py:meth:`Network.from_model`; only that classmethod imports
+PySB, so code that receives a ready-made :py:class:`Network` (e.g. a pool
+worker) never pays for it.
+
+A generated network can be compiled to a flat, versioned binary file with
+:py:meth:`Network.save`. :py:meth:`Network.load` memory-maps it, so workers
+start without PySB or BioNetGen and share one copy of the arrays::
+
+    Network.from_model(model).save('anrm.net')     # once
+    network = Network.load('anrm.net')             # in every worker
+
+:py:meth:`Network.prune` removes the reactions that can never fire (zero
+rate constant, or a reactant that cannot be formed from the initial
+conditions) and the species that can never appear, and reports them.
+"""
+
+import copy
+import json
+import os
+import re
+import struct
+
+import numpy as np
+import scipy.sparse as sparse
+
+# Species symbols in BioNetGen rate expressions are named ``s0``, ``s1``, ...
+# (``__s0`` in newer versions of PySB).
+_species_symbol = re.compile(r'^_*s(\d+)$')
+
+# Compiled network files: magic, format version, alignment of the arrays.
+_MAGIC = b'ANRMNET\0'
+_VERSION = 1
+_ALIGN = 64
+
+
+class Network(object):
+    """Mass-action reaction network with array-based rate evaluation.
+
+    Parameters
+    ----------
+    species : list of strings
+        Species names, one per state variable.
+    parameters : list of strings
+        Parameter names.
+    param_values : array of floats
+        Nominal Parameter values, in the order of `parameters`.
+    reactants, products : list of sequences of integers
+        Species indices consumed and produced by each reaction. Repeated
+        indices denote stoichiometry greater than one.
+    rate_param : array of integers
+        Index into `parameters` of the rate constant of each reaction.
+    rate_factor : array of floats
+        Numeric factor multiplying the rate constant of each reaction (e.g.
+        0.5 for symmetric homodimerization).
+    rules : list of strings
+        Name of the rule that generated each reaction.
+    reverse : list of bools
+        Whether each reaction is the reverse direction of its rule.
+    observables : list of strings
+        Observable names.
+    obs_matrix : sparse matrix
+        Observable coefficients, observables x species.
+    initial_params : list of strings
+        Parameter name of each declared initial condition.
+    initial_species : array of integers
+        Species index of each declared initial condition.
+    name : string, optional
+        Name of the model the network was generated from.
+    """
+
+    def __init__(self, species, parameters, param_values, reactants, products,
+                 rate_param, rate_factor, rules, reverse, observables,
+                 obs_matrix, initial_params, initial_species, name=None):
+        self.name = name
+        self.species = list(species)
+        self.parameters = list(parameters)
+        self.param_values = np.asarray(param_values, dtype=float)
+        self.rate_param = np.asarray(rate_param, dtype=np.intp)
+        self.rate_factor = np.asarray(rate_factor, dtype=float)
+        self.rules = list(rules)
+        self.reverse = [bool(r) for r in reverse]
+        self.observables = list(observables)
+        self.obs_matrix = sparse.csr_matrix(obs_matrix,
+                                            shape=(len(self.observables),
+                                                   len(self.species)))
+        self.initial_params = list(initial_params)
+        self.initial_species = np.asarray(initial_species, dtype=np.intp)
+
+        n = len(self.species)
+        # Reactant and product lists are padded to a rectangular array with
+        # the index `n`, which points at a constant 1 appended to the state.
+        self.reactants = _pad(reactants, n)
+        self.products = _pad(products, n)
+        self.stoichiometry = _stoichiometry(self.reactants, self.products, n)
+
+        # Precompute the layout of d(rate)/d(species): one entry per reactant
+        # slot, equal to the rate constant times the product of the other
+        # reactant slots.
+        order = self.reactants.shape[1]
+        rows, cols = np.nonzero(self.reactants < n)
+        self._dv_rows = rows
+        self._dv_cols = self.reactants[rows, cols]
+        others = np.array([[q for q in range(order) if q != p]
+                           for p in range(order)], dtype=np.intp)
+        if order > 1:
+            self._dv_others = self.reactants[rows[:, None], others[cols]]
+        else:
+            self._dv_others = np.zeros((len(rows), 0), dtype=np.intp)
+
+        self._path = None
+        self._build_indexes()
+
+    def _build_indexes(self):
+        self._param_index = dict((p, i) for i, p in
+                                 enumerate(self.parameters))
+        self._species_index = dict((s, i) for i, s in
+                                   enumerate(self.species))
+        self._obs_index = dict((o, i) for i, o in
+                               enumerate(self.observables))
+        self._initial_by_monomer = {}
+        for s in self.initial_species:
+            monomer = self.species[s].split('(')[0].strip()
+            self._initial_by_monomer.setdefault(monomer, []).append(int(s))
+        self._lookup = None
+
+    @property
+    def species_lookup(self):
+        """:py:class:`anrm.species.SpeciesIndex` of the species, built on
+        first use."""
+
+        if self._lookup is None:
+            from anrm.species import SpeciesIndex
+            self._lookup = SpeciesIndex(self.species)
+        return self._lookup
+
+    # Sizes
+    # -----
+
+    @property
+    def n_species(self):
+        return len(self.species)
+
+    @property
+    def n_reactions(self):
+        return len(self.rules)
+
+    # Parameters and initial conditions
+    # ---------------------------------
+
+    def param_index(self, name):
+        """Return the index of Parameter `name`."""
+
+        try:
+            return self._param_index[name]
+        except KeyError:
+            raise ValueError("Unknown parameter '%s'" % name)
+
+    def param_vector(self, param_values=None):
+        """Return a full Parameter vector with `param_values` applied.
+
+        `param_values` may be None (nominal values), a full array of values,
+        or a dict mapping Parameter names to values that override the nominal
+        ones.
+        """
+
+        if param_values is None:
+            return self.param_values.copy()
+        if isinstance(param_values, dict):
+            values = self.param_values.copy()
+            for name, value in param_values.items():
+                values[self.param_index(name)] = value
+            return values
+        values = np.array(param_values, dtype=float)
+        if values.shape[-1] != len(self.parameters):
+            raise ValueError("Expected %d parameter values, got %d" %
+                             (len(self.parameters), values.shape[-1]))
+        return values
+
+    def rate_constants(self, param_values):
+        """Return the rate constant of every reaction.
+
+        `param_values` is a full Parameter vector, or an array of them (one
+        per row), as returned by :py:meth:`param_vector`.
+        """
+
+        return self.rate_factor * param_values[..., self.rate_param]
+
+    def initial_state(self, param_values):
+        """Return the initial species amounts for a full Parameter vector."""
+
+        param_values = np.asarray(param_values, dtype=float)
+        y0 = np.zeros(param_values.shape[:-1] + (self.n_species,))
+        idx = [self._param_index[p] for p in self.initial_params]
+        np.add.at(y0, (Ellipsis, self.initial_species),
+                  param_values[..., idx])
+        return y0
+
+    # Name resolution
+    # ---------------
+
+    def species_index(self, name):
+        """Return the index of the species referred to by `name`.
+
+        `name` may be a species index, a species name as generated by
+        BioNetGen (e.g. ``'TNFa(blig=None)'``) or any equivalent spelling
+        of it (see :py:mod:`anrm.species`), the Parameter of an initial
+        condition (``'TNFa_0'``), or the name of a monomer (``'TNFa'``), in
+        which case the species declared by that monomer's initial condition
+        is used.
+        """
+
+        if isinstance(name, (int, np.integer)):
+            return int(name)
+        if name in self._species_index:
+            return self._species_index[name]
+        if name in self.initial_params:
+            return int(self.initial_species[self.initial_params.index(name)])
+        matches = self._initial_by_monomer.get(name, [])
+        if len(matches) == 1:
+            return matches[0]
+        if len(matches) > 1:
+            raise ValueError("Monomer '%s' has %d initial conditions; use "
+                             "the species or parameter name instead" %
+                             (name, len(matches)))
+        if '(' in name:
+            try:
+                index = self.species_lookup.index(name)
+            except ValueError:
+                index = None
+            if index is not None:
+                return index
+        raise ValueError("Unknown species '%s'" % name)
+
+    def match(self, pattern):
+        """Return the indices of the species matched by a pattern.
+
+        `pattern` is written like a species, with unmentioned sites left
+        free, ``ANY``/``+`` for any bond and ``WILD``/``?`` for bound or
+        not, e.g. ``"Bax(state='A')"`` or ``'Bax(bf!+)'``.
+        """
+
+        return self.species_lookup.match(pattern)
+
+    def observable_index(self, name):
+        """Return the index of observable `name`."""
+
+        try:
+            return self._obs_index[name]
+        except KeyError:
+            raise ValueError("Unknown observable '%s'" % name)
+
+    # Rate evaluation
+    # ---------------
+
+    def reaction_rates(self, y, k):
+        """Return the mass-action rate of every reaction.
+
+        `y` is a state vector or an array of them (one per row); `k` holds
+        the matching rate constants from :py:meth:`rate_constants`.
+        """
+
+        y = np.asarray(y, dtype=float)
+        yext = np.concatenate([y, np.ones(y.shape[:-1] + (1,))], axis=-1)
+        return k * yext[..., self.reactants].prod(axis=-1)
+
+    def rhs(self, y, k):
+        """Return dy/dt for state(s) `y` and rate constants `k`."""
+
+        v = self.reaction_rates(y, k)
+        return self.stoichiometry.dot(v.T).T
+
+    def rate_jacobian(self, y, k):
+        """Return d(reaction rates)/d(species) at `y` as a sparse matrix."""
+
+        yext = np.append(y, 1.0)
+        data = k[self._dv_rows] * yext[self._dv_others].prod(axis=1)
+        return sparse.csr_matrix((data, (self._dv_rows, self._dv_cols)),
+                                 shape=(self.n_reactions, self.n_species))
+
+    def jacobian(self, y, k):
+        """Return the sparse (CSC) Jacobian of :py:meth:`rhs` at `y`."""
+
+        return sparse.csc_matrix(self.stoichiometry.dot(
+            self.rate_jacobian(y, k)))
+
+    def batch_jacobian(self, y, k):
+        """Return the block-diagonal Jacobian of a batch of states.
+
+        `y` and `k` hold one state and one set of rate constants per row;
+        the result is the sparse (CSC) Jacobian of the flattened batch.
+        """
+
+        dv = self.batch_rate_jacobian(y, k)
+        return sparse.csc_matrix(self._batch_stoichiometry(len(y)).dot(dv))
+
+    def batch_rate_jacobian(self, y, k):
+        """Return the block-diagonal d(reaction rates)/d(species) of a
+        batch, as :py:meth:`rate_jacobian` for each row of `y` and `k`."""
+
+        batch = len(y)
+        yext = np.concatenate([y, np.ones((batch, 1))], axis=1)
+        data = k[:, self._dv_rows] * yext[:, self._dv_others].prod(axis=-1)
+        offsets = np.arange(batch)[:, None]
+        rows = (offsets * self.n_reactions + self._dv_rows).ravel()
+        cols = (offsets * self.n_species + self._dv_cols).ravel()
+        return sparse.csr_matrix((data.ravel(), (rows, cols)),
+                                 shape=(batch * self.n_reactions,
+                                        batch * self.n_species))
+
+    def _batch_stoichiometry(self, batch):
+        """Return the block-diagonal stoichiometry of `batch` copies."""
+
+        cached = getattr(self, '_batch_S', None)
+        if cached is None or cached[0] != batch:
+            cached = (batch, sparse.kron(sparse.identity(batch),
+                                         self.stoichiometry, format='csr'))
+            self._batch_S = cached
+        return cached[1]
+
+    def jacobian_sparsity(self):
+        """Return the structural nonzero pattern of the Jacobian."""
+
+        pattern = sparse.csr_matrix(
+            (np.ones(len(self._dv_rows)), (self._dv_rows, self._dv_cols)),
+            shape=(self.n_reactions, self.n_species))
+        return sparse.csc_matrix(abs(self.stoichiometry).dot(pattern) != 0)
+
+    def observe(self, y):
+        """Project state(s) `y` onto the observables."""
+
+        return self.obs_matrix.dot(np.asarray(y).T).T
+
+    def observable_scale(self, y0, observables=None):
+        """Return the expected magnitude of each observable.
+
+        Every monomer is conserved at its total in the initial state `y0`,
+        so a species holds at most the total of its scarcest monomer, and an
+        observable is scaled by the largest such bound among its species
+        (e.g. ``PARP_0`` for cleaved PARP). Observables with no bound get 1.
+        """
+
+        from anrm.species import parse
+
+        y0 = np.asarray(y0, dtype=float)
+        counts = [{} for _ in self.species]
+        totals = {}
+        for s, name in enumerate(self.species):
+            for monomer in parse(name):
+                counts[s][monomer.name] = counts[s].get(monomer.name, 0) + 1
+            for m, c in counts[s].items():
+                totals[m] = totals.get(m, 0.) + c * y0[s]
+        bound = np.array([min([totals[m] / c for m, c in count.items()] or
+                              [0.]) for count in counts])
+        rows = range(len(self.observables)) if observables is None else \
+            [self.observable_index(o) for o in observables]
+        obs = abs(self.obs_matrix[list(rows)]).tocsr()
+        scale = np.ones(obs.shape[0])
+        for i in range(obs.shape[0]):
+            row = obs.getrow(i)
+            if row.nnz:
+                scale[i] = max(1., (row.data * bound[row.indices]).max())
+        return scale
+
+    # Static pruning
+    # --------------
+
+    def prune(self, param_values=None, seeds=()):
+        """Return a copy without reactions and species that cannot matter.
+
+        Reactions whose rate constant is zero are removed, and so are the
+        species that cannot be reached from the nonzero initial conditions
+        (and `seeds`) through the remaining reactions, along with every
+        reaction that consumes one of them. Such species stay at zero and
+        such reactions never fire, so simulations of the pruned network give
+        the same results for the kept species, only faster.
+
+        Parameters
+        ----------
+        param_values : dict or array of floats, optional
+            Parameter values the decision is based on (see
+            :py:meth:`param_vector`); the pruned network is only valid for
+            values that are zero where these are.
+        seeds : list, optional
+            Species (anything :py:meth:`species_index` accepts) to treat as
+            present even if their initial amount is zero, e.g. species that
+            are dosed or perturbed later.
+
+        Returns the pruned :py:class:`Network` and a :py:class:`Pruning`
+        report of what was dropped.
+        """
+
+        params = self.param_vector(param_values)
+        n = self.n_species
+        live = self.rate_constants(params) != 0
+        reached = np.zeros(n + 1, dtype=bool)
+        reached[n] = True
+        reached[self.initial_species[self.initial_state(params)
+                                     [self.initial_species] != 0]] = True
+        reached[[self.species_index(s) for s in seeds]] = True
+
+        # Fire every live reaction whose reactants have all been reached,
+        # until no new product turns up.
+        fires = np.zeros(self.n_reactions, dtype=bool)
+        while True:
+            now = live & reached[self.reactants].all(axis=1)
+            if (now == fires).all():
+                break
+            fires = now
+            reached[self.products[fires]] = True
+
+        keep_species = np.flatnonzero(reached[:n])
+        keep_reactions = np.flatnonzero(fires)
+        pruned = self._subnetwork(keep_species, keep_reactions)
+        return pruned, Pruning(self, keep_species, keep_reactions, live)
+
+    def _subnetwork(self, keep_species, keep_reactions):
+        """Return the network restricted to the given species and
+        reactions, which must not involve any other species."""
+
+        m = len(keep_species)
+        new_index = np.full(self.n_species + 1, m, dtype=np.intp)
+        new_index[keep_species] = np.arange(m)
+        reactants = new_index[self.reactants[keep_reactions]]
+        products = new_index[self.products[keep_reactions]]
+        keep_initial = [i for i, s in enumerate(self.initial_species)
+                        if new_index[s] < m]
+        return Network([self.species[s] for s in keep_species],
+                       self.parameters, self.param_values,
+                       [r[r < m] for r in reactants],
+                       [p[p < m] for p in products],
+                       self.rate_param[keep_reactions],
+                       self.rate_factor[keep_reactions],
+                       [self.rules[j] for j in keep_reactions],
+                       [self.reverse[j] for j in keep_reactions],
+                       self.observables, self.obs_matrix[:, keep_species],
+                       [self.initial_params[i] for i in keep_initial],
+                       new_index[self.initial_species[keep_initial]],
+                       name=self.name)
+
+    # Construction from PySB
+    # ----------------------
+
+    @classmethod
+    def from_model(cls, model):
+        """Generate the reaction network of a PySB model.
+
+        Runs BioNetGen through :py:func:`pysb.bng.generate_equations` and
+        splits every reaction rate into mass-action terms. Raises ValueError
+        for rate laws that are not mass-action.
+        """
+
+        from pysb.bng import generate_equations
+        generate_equations(model)
+
+        parameters = [p.name for p in model.parameters]
+        param_values = [p.value for p in model.parameters]
+        param_index = dict((p, i) for i, p in enumerate(parameters))
+        rules_by_name = dict((r.name, r) for r in model.rules)
+
+        reactants, products = [], []
+        rate_param, rate_factor, rules, reverse = [], [], [], []
+        for rxn in model.reactions:
+            rule_names = _as_tuple(rxn['rule'])
+            reverse_flags = _as_tuple(rxn['reverse'])
+            for term in _add_args(rxn['rate']):
+                pname, factor, species = _parse_mass_action(term, param_index)
+                rule, rev = _rule_for(pname, rule_names, reverse_flags,
+                                      rules_by_name)
+                reactants.append(species)
+                products.append(tuple(rxn['products']))
+                rate_param.append(param_index[pname])
+                rate_factor.append(factor)
+                rules.append(rule)
+                reverse.append(rev)
+
+        obs_rows, obs_cols, obs_data = [], [], []
+        for i, obs in enumerate(model.observables):
+            obs_rows.extend([i] * len(obs.species))
+            obs_cols.extend(obs.species)
+            obs_data.extend(obs.coefficients)
+        obs_matrix = sparse.csr_matrix(
+            (obs_data, (obs_rows, obs_cols)),
+            shape=(len(model.observables), len(model.species)))
+
+        # Look the initial species up by canonical label instead of testing
+        # every species for isomorphism
+        from anrm.species import SpeciesIndex
+        lookup = SpeciesIndex([str(s) for s in model.species])
+        initial_params, initial_species = [], []
+        for pattern, value in _initials(model):
+            initial_params.append(value.name)
+            index = lookup.index(str(pattern))
+            if index is None:
+                index = model.get_species_index(pattern)
+            initial_species.append(index)
+
+        network = cls(lookup.species, parameters, param_values, reactants,
+                      products, rate_param, rate_factor, rules, reverse,
+                      [o.name for o in model.observables], obs_matrix,
+                      initial_params, initial_species, name=model.name)
+        network._lookup = lookup
+        return network
+
+
+    # Compiled network files
+    # ----------------------
+
+    def save(self, path):
+        """Write the network to `path` as a flat, versioned binary file.
+
+        The file holds a JSON header (names and array layout) followed by the
+        raw, aligned arrays, including the derived ones (stoichiometry and
+        Jacobian layout), so that :py:meth:`load` can map it without
+        recomputing anything or importing PySB.
+        """
+
+        arrays = [(name, np.ascontiguousarray(value, dtype=dtype))
+                  for name, value, dtype in self._flat_arrays()]
+        layout, offset = [], 0
+        for name, value in arrays:
+            layout.append([name, value.dtype.str, list(value.shape), offset])
+            offset += _aligned(value.nbytes)
+        header = json.dumps({
+            'name': self.name, 'species': self.species,
+            'parameters': self.parameters, 'rules': self.rules,
+            'observables': self.observables,
+            'initial_params': self.initial_params, 'arrays': layout,
+        }).encode('utf-8')
+        start = _aligned(len(_MAGIC) + 8 + len(header))
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(_MAGIC + struct.pack('<II', _VERSION, len(header)))
+            f.write(header)
+            f.write(b'\0' * (start - f.tell()))
+            for name, value in arrays:
+                f.write(value.tobytes())
+                f.write(b'\0' * (_aligned(value.nbytes) - value.nbytes))
+        os.replace(tmp, path)
+
+    def _flat_arrays(self):
+        S, O = self.stoichiometry, self.obs_matrix
+        S.sort_indices()
+        O.sort_indices()
+        return [('param_values', self.param_values, '<f8'),
+                ('rate_param', self.rate_param, '<i8'),
+                ('rate_factor', self.rate_factor, '<f8'),
+                ('reverse', self.reverse, '|u1'),
+                ('initial_species', self.initial_species, '<i8'),
+                ('reactants', self.reactants, '<i8'),
+                ('products', self.products, '<i8'),
+                ('S_data', S.data, '<f8'), ('S_indices', S.indices, '<i4'),
+                ('S_indptr', S.indptr, '<i4'),
+                ('obs_data', O.data, '<f8'), ('obs_indices', O.indices, '<i4'),
+                ('obs_indptr', O.indptr, '<i4'),
+                ('dv_rows', self._dv_rows, '<i8'),
+                ('dv_cols', self._dv_cols, '<i8'),
+                ('dv_others', self._dv_others, '<i8')]
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load a network written by :py:meth:`save`.
+
+        With `mmap`, the arrays are read-only views of a memory map of the
+        file, so processes that load the same file share its pages, and such
+        a network is pickled (e.g. to pool workers) as its path plus its
+        current Parameter values.
+        """
+
+        if mmap:
+            data = np.memmap(path, dtype=np.uint8, mode='r')
+        else:
+            with open(path, 'rb') as f:
+                data = np.frombuffer(f.read(), dtype=np.uint8)
+        if data[:len(_MAGIC)].tobytes() != _MAGIC:
+            raise ValueError("'%s' is not an ANRM network file" % path)
+        version, hlen = struct.unpack('<II', data[len(_MAGIC):
+                                                  len(_MAGIC) + 8].tobytes())
+        if version != _VERSION:
+            raise ValueError("Unsupported network file version %d" % version)
+        pos = len(_MAGIC) + 8
+        header = json.loads(data[pos:pos + hlen].tobytes().decode('utf-8'))
+        start = _aligned(pos + hlen)
+        arrays = {}
+        for name, dtype, shape, offset in header['arrays']:
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape, dtype=np.int64))
+            arrays[name] = np.frombuffer(
+                data, dtype, count, start + offset).reshape(shape)
+
+        self = cls.__new__(cls)
+        self.name = header['name']
+        self.species = header['species']
+        self.parameters = header['parameters']
+        self.rules = header['rules']
+        self.observables = header['observables']
+        self.initial_params = header['initial_params']
+        self.param_values = arrays['param_values']
+        self.rate_param = arrays['rate_param'].astype(np.intp, copy=False)
+        self.rate_factor = arrays['rate_factor']
+        self.reverse = arrays['reverse'].astype(bool).tolist()
+        self.initial_species = arrays['initial_species'].astype(np.intp,
+                                                                copy=False)
+        self.reactants = arrays['reactants'].astype(np.intp, copy=False)
+        self.products = arrays['products'].astype(np.intp, copy=False)
+        n, R = len(self.species), len(self.rules)
+        self.stoichiometry = sparse.csr_matrix(
+            (arrays['S_data'], arrays['S_indices'], arrays['S_indptr']),
+            shape=(n, R), copy=False)
+        self.obs_matrix = sparse.csr_matrix(
+            (arrays['obs_data'], arrays['obs_indices'], arrays['obs_indptr']),
+            shape=(len(self.observables), n), copy=False)
+        self._dv_rows = arrays['dv_rows'].astype(np.intp, copy=False)
+        self._dv_cols = arrays['dv_cols'].astype(np.intp, copy=False)
+        self._dv_others = arrays['dv_others'].astype(np.intp, copy=False)
+        self._path = os.path.abspath(path) if mmap else None
+        self._build_indexes()
+        return self
+
+    def detach(self):
+        """Return a copy that pickles with all its arrays.
+
+        A memory-mapped network pickles as the path of its file, which is
+        cheap between processes of one node but goes stale if the file is
+        replaced. The copy still shares the mapped arrays in memory.
+        """
+
+        if self._path is None:
+            return self
+        network = copy.copy(self)
+        network._path = None
+        return network
+
+    def __reduce_ex__(self, protocol):
+        if self._path is None:
+            return object.__reduce_ex__(self, protocol)
+        # Mapped networks travel as their file plus what may have changed
+        state = {'name': self.name, 'param_values': self.param_values}
+        return (_load_mapped, (self._path,), state)
+
+
+class Pruning(object):
+    """What :py:meth:`Network.prune` dropped from a network.
+
+    Attributes
+    ----------
+    species : list of strings
+        Names of the dropped (unreachable) species.
+    zero_rate : array of integers
+        Indices of the reactions dropped for a zero rate constant.
+    unreachable : array of integers
+        Indices of the reactions dropped for consuming an unreachable
+        species.
+    rules : list of strings
+        Rules none of whose reactions were kept.
+    keep_species, keep_reactions : array of integers
+        Indices in the original network of the kept species and reactions.
+    """
+
+    def __init__(self, network, keep_species, keep_reactions, live):
+        self.n_species = network.n_species
+        self.keep_species = keep_species
+        self.keep_reactions = keep_reactions
+        dropped = np.ones(network.n_reactions, dtype=bool)
+        dropped[keep_reactions] = False
+        self.zero_rate = np.flatnonzero(~live)
+        self.unreachable = np.flatnonzero(dropped & live)
+        kept = np.zeros(network.n_species, dtype=bool)
+        kept[keep_species] = True
+        self.species = [s for s, k in zip(network.species, kept) if not k]
+        kept_rules = set(network.rules[j] for j in keep_reactions)
+        self.rules = sorted(set(network.rules) - kept_rules)
+
+    def expand(self, y):
+        """Map pruned state(s) `y` back onto the original species, with
+        zeros for the dropped ones."""
+
+        y = np.asarray(y)
+        full = np.zeros(y.shape[:-1] + (self.n_species,), dtype=y.dtype)
+        full[..., self.keep_species] = y
+        return full
+
+    def __str__(self):
+        lines = ['Dropped %d of %d species and %d reactions '
+                 '(%d with zero rate, %d unreachable)' % (
+                     len(self.species), self.n_species,
+                     len(self.zero_rate) + len(self.unreachable),
+                     len(self.zero_rate), len(self.unreachable))]
+        if self.rules:
+            lines.append('Rules that never fire: %s' % ', '.join(self.rules))
+        if self.species:
+            lines.append('Unreachable species: %s' % ', '.join(self.species))
+        return '\n'.join(lines)
+
+
+# Helpers
+# =======
+
+def _load_mapped(path):
+    return Network.load(path, mmap=True)
+
+def _aligned(size):
+    return -(-size // _ALIGN) * _ALIGN
+
+def _pad(index_lists, fill):
+    """Pad a list of index sequences into a rectangular integer array."""
+
+    width = max([len(ix) for ix in index_lists] + [1])
+    out = np.full((len(index_lists), width), fill, dtype=np.intp)
+    for j, ix in enumerate(index_lists):
+        out[j, :len(ix)] = ix
+    return out
+
+def _stoichiometry(reactants, products, n):
+    """Build the sparse species x reactions stoichiometry matrix."""
+
+    rows, cols, data = [], [], []
+    for sign, table in ((-1., reactants), (1., products)):
+        j, p = np.nonzero(table < n)
+        rows.append(table[j, p])
+        cols.append(j)
+        data.append(np.full(len(j), sign))
+    S = sparse.coo_matrix((np.concatenate(data),
+                           (np.concatenate(rows), np.concatenate(cols))),
+                          shape=(n, len(reactants)))
+    S = S.tocsr()
+    S.eliminate_zeros()
+    return S
+
+def _as_tuple(value):
+    return tuple(value) if isinstance(value, (tuple, list)) else (value,)
+
+def _add_args(expr):
+    """Split a sympy expression into its additive terms."""
+
+    import sympy
+    return sympy.Add.make_args(sympy.expand(expr))
+
+def _parse_mass_action(term, param_index):
+    """Return (parameter name, factor, reactant indices) of a rate term."""
+
+    factor = 1.0
+    pname = None
+    species = []
+    for arg in term.as_ordered_factors():
+        base, exp = arg.as_base_exp()
+        if base.is_Number:
+            factor *= float(arg)
+            continue
+        name = str(base)
+        match = _species_symbol.match(name)
+        if match and exp.is_Integer and exp > 0:
+            species.extend([int(match.group(1))] * int(exp))
+        elif name in param_index and exp == 1 and pname is None:
+            pname = name
+        else:
+            raise ValueError("Rate term '%s' is not mass-action" % term)
+    if pname is None:
+        raise ValueError("Rate term '%s' has no rate parameter" % term)
+    return pname, factor, tuple(species)
+
+def _rule_for(pname, rule_names, reverse_flags, rules_by_name):
+    """Attribute a rate term to one of the rules that produced a reaction."""
+
+    for name, rev in zip(rule_names, reverse_flags):
+        rule = rules_by_name.get(name)
+        rate = rule.rate_reverse if (rule is not None and rev) else \
+            getattr(rule, 'rate_forward', None)
+        if rate is not None and rate.name == pname:
+            return name, bool(rev)
+    return rule_names[0], bool(reverse_flags[0])
+
+def _initials(model):
+    """Return (ComplexPattern, Parameter) pairs for both old and new PySB."""
+
+    if hasattr(model, 'initials'):
+        return [(ic.pattern, ic.value) for ic in model.initials]
+    return list(model.initial_conditions)
@@ -0,0 +1,183 @@
+"""
+Overview
+========
+
+Virtual cell populations with cell-to-cell variability in protein levels.
+
+Fractional killing by TNFa or Fas ligand is explained by differences in the
+levels of proteins such as procaspase-8, c-FLIP, XIAP, Bcl-2, RIP1 and Bax
+between otherwise identical cells. :py:func:`simulate_population` draws the
+initial amounts of these proteins from a (correlated) lognormal
+distribution, simulates every cell with the batched ODE engine and keeps only
+each cell's fate and time of death (see :py:mod:`anrm.fate`).
+
+Cells are generated and simulated chunk by chunk, and a chunk's trajectories
+are reduced to fates inside the worker that simulated it, so memory use is
+set by the chunk size and not by the number of cells; ``1e5``--``1e6`` cells
+per condition run on a multi-core node with a
+:py:class:`~anrm.sweep.PoolBackend`::
+
+    pop = simulate_population(network, 100000, tspan, cv=0.3,
+                              backend=PoolBackend())
+    pop.fractions()          # survival/apoptosis/necrosis over time
+    pop.death_time_histogram(bins, APOPTOSIS)
+"""
+
+import numpy as np
+
+from anrm.fate import FAILED, FATE_NAMES, SURVIVAL, FateClassifier
+from anrm.sweep import run_chunks
+
+# Initial-condition Parameters varied by default.
+DEFAULT_PROTEINS = ['proC8_0', 'flip_L_0', 'flip_S_0', 'XIAP_0', 'Bcl2_0',
+                    'RIP1_0', 'Bax_0']
+
+
+class LognormalSampler(object):
+    """Correlated lognormal samples with given means and CVs.
+
+    Parameters
+    ----------
+    means : array of floats
+        Mean of each variable. Variables with mean 0 are always 0.
+    cv : float or array of floats
+        Coefficient of variation of each variable.
+    corr : 2D array of floats, optional
+        Correlation matrix of the log-values (default: independent).
+    """
+
+    def __init__(self, means, cv=0.25, corr=None):
+        means = np.asarray(means, dtype=float)
+        d = len(means)
+        cv = np.broadcast_to(np.asarray(cv, dtype=float), (d,))
+        sigma = np.sqrt(np.log1p(cv ** 2))
+        with np.errstate(divide='ignore'):
+            self.mu = np.log(means) - sigma ** 2 / 2
+        corr = np.identity(d) if corr is None else np.asarray(corr, float)
+        if corr.shape != (d, d):
+            raise ValueError("corr must be a %d x %d matrix" % (d, d))
+        # Scale the factor of the correlation rather than factoring the
+        # covariance, which is singular when a protein has cv = 0
+        self.chol = sigma[:, None] * np.linalg.cholesky(corr)
+
+    def sample(self, n, rng):
+        """Draw `n` samples (rows) with the generator `rng`."""
+
+        z = rng.standard_normal((n, len(self.mu)))
+        return np.exp(self.mu + z.dot(self.chol.T))
+
+
+def simulate_population(network, n_cells, tspan, proteins=None, cv=0.25,
+                        corr=None, param_values=None, threshold=0.5,
+                        chunk_size=256, backend=None, seed=None, rtol=1e-3,
+                        atol=1e-6):
+    """Simulate `n_cells` cells with lognormally varying protein levels.
+
+    Parameters
+    ----------
+    network : anrm.network.Network
+        Network to simulate.
+    n_cells : int
+        Number of cells.
+    tspan : array of floats
+        Output times; fates are called on this grid.
+    proteins : list of strings, optional
+        Initial-condition Parameters to vary (default:
+        :py:data:`DEFAULT_PROTEINS`).
+    cv : float or array of floats
+        Coefficient of variation of each protein level.
+    corr : 2D array of floats, optional
+        Correlation of the log protein levels.
+    param_values : dict, optional
+        Overrides defining the condition (e.g. ``{'TNFa_0': 3000}``); the
+        varied proteins are centered on the resulting values.
+    threshold : float
+        Fraction of PARP that must be cleaved or activated for death.
+    chunk_size : int
+        Cells simulated together as one batch.
+    backend : optional
+        Sweep backend to run the chunks on (see :py:mod:`anrm.sweep`).
+    seed : int, optional
+        Seed of the protein-level sampling.
+
+    Returns a :py:class:`PopulationResult`.
+    """
+
+    proteins = DEFAULT_PROTEINS if proteins is None else list(proteins)
+    base = network.param_vector(param_values)
+    index = [network.param_index(p) for p in proteins]
+    sampler = LognormalSampler(base[index], cv, corr)
+    rng = np.random.default_rng(seed)
+
+    def chunks():
+        for start in range(0, n_cells, chunk_size):
+            n = min(chunk_size, n_cells - start)
+            params = np.tile(base, (n, 1))
+            params[:, index] = sampler.sample(n, rng)
+            yield params
+
+    tspan = np.asarray(tspan, dtype=float)
+    classifier = FateClassifier(network, threshold)
+    fates, times = run_chunks(network, chunks(), tspan,
+                              [classifier.cparp, classifier.aparp], backend,
+                              rtol, atol, reduce=classifier)
+    return PopulationResult(tspan, fates, times)
+
+
+class PopulationResult(object):
+    """Fates and times of death of a simulated population.
+
+    Attributes
+    ----------
+    tout : array of floats
+        Output times of the simulations.
+    fates : array of int8
+        Fate code of every cell (see :py:mod:`anrm.fate`), FAILED for cells
+        whose simulation failed.
+    death_times : array of float32
+        Time of death of every cell, NaN for survivors.
+    n_failed : int
+        Number of cells whose simulation failed.
+    """
+
+    def __init__(self, tout, fates, death_times):
+        self.tout = tout
+        self.fates = fates
+        self.death_times = death_times
+        self.n_failed = int((fates == FAILED).sum())
+
+    def counts(self):
+        """Return the number of cells of each fate, by fate name, and of
+        failed cells under 'failed'."""
+
+        n = np.bincount(self.fates[self.fates != FAILED],
+                        minlength=len(FATE_NAMES))
+        counts = dict(zip(FATE_NAMES, n.tolist()))
+        counts['failed'] = self.n_failed
+        return counts
+
+    def fractions(self, times=None):
+        """Return the fraction of cells in each fate at `times`.
+
+        A cell counts as surviving until its time of death. Failed cells
+        are left out. The result has one row per time and one column per
+        fate, in the order of :py:data:`anrm.fate.FATE_NAMES`.
+        """
+
+        times = self.tout if times is None else np.asarray(times, float)
+        out = np.zeros((len(times), len(FATE_NAMES)))
+        for code in range(1, len(FATE_NAMES)):
+            t = np.sort(self.death_times[self.fates == code])
+            out[:, code] = np.searchsorted(t, times, 'right')
+        out /= max(len(self.fates) - self.n_failed, 1)
+        out[:, 0] = 1. - out[:, 1:].sum(axis=1)
+        return out
+
+    def death_time_histogram(self, bins, fate=None):
+        """Histogram of the times of death, of one fate or of all deaths."""
+
+        if fate is None:
+            t = self.death_times[self.fates > SURVIVAL]
+        else:
+            t = self.death_times[self.fates == fate]
+        return np.histogram(t, bins)[0]
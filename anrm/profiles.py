@@ -0,0 +1,348 @@
+"""
+Overview
+========
+
+Profile-likelihood identifiability analysis.
+
+The profile of a Parameter is the best log-likelihood reachable with that
+Parameter fixed, as a function of its value: every other Parameter is
+re-optimized at each point. A profile that drops by more than
+``chi2(1).ppf(level) / 2`` on both sides of the optimum gives a finite
+likelihood-based confidence interval and the Parameter is identified by the
+data. A flat profile means it is not. Along a flat profile, the optimal
+values of the other Parameters show what compensates for it. For example,
+``Kc_C3_ubiqui`` rising one for one with ``Kf_C3_ubiqui`` means the data
+only constrain their ratio.
+
+:py:func:`profile_likelihood` first fits all Parameters (unless an
+`optimum` is given). It then walks a grid of log10 values outward from the
+optimum, in each direction, for every Parameter. Each grid point is
+optimized starting from the optimum of its neighbour, closer to the fit,
+which usually converges in a few iterations. A branch stops once the
+likelihood has fallen well past the confidence threshold.
+
+The two branches of every Parameter are independent tasks, distributed
+across a process pool. With two processes per Parameter, all profiles
+together take about as long as the longer half of a single serial profile.
+
+Gradients are central differences in log10 space. The point and its
+perturbations are integrated as one batch, so they share the integrator's
+step sequence, and the differences are not swamped by step-size noise::
+
+    like = GaussianLikelihood({'Obs_cPARP': cparp, 'Obs_aPARP': aparp},
+                              sigma=2e4)
+    result = profile_likelihood(network, tspan, like,
+                                ['Kf_C3_ubiqui', 'Kc_C3_ubiqui', 'KF'],
+                                bounds=[(-9, -3), (-5, 1), (-8, -2)])
+    print(result)
+    result.tradeoff('Kf_C3_ubiqui', 'Kc_C3_ubiqui')
+
+Raue, A., Kreutz, C., Maiwald, T., Bachmann, J., Schilling, M., Klingmuller,
+U., & Timmer, J. (2009). Structural and practical identifiability analysis
+of partially observed dynamical models by exploiting the profile
+likelihood. Bioinformatics, 25(15), 1923-1929.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import optimize, stats
+
+from anrm.simulator import Simulator
+from anrm.sweep import SweepSpec, simulate_chunk
+
+
+def profile_likelihood(network, tspan, log_likelihood, parameters, bounds,
+                       profiled=None, n_points=21, optimum=None,
+                       param_values=None, level=0.95, processes=None,
+                       step=1e-3, maxiter=50, rtol=1e-6, atol=1e-6):
+    """Compute the likelihood profiles of Parameters.
+
+    Parameters
+    ----------
+    network : anrm.network.Network
+        Network to simulate.
+    tspan : array of floats
+        Output times of the simulations.
+    log_likelihood : callable
+        Picklable sweep reduction returning one log-likelihood per parameter
+        set, such as :py:class:`anrm.mcmc.GaussianLikelihood`.
+    parameters : list of strings
+        Names of the estimated Parameters, handled as log10 values.
+    bounds : list of (low, high)
+        Bounds of each log10 Parameter; they are also the grid limits.
+    profiled : list of strings, optional
+        Parameters to profile (default: all of `parameters`).
+    n_points : int
+        Grid points per profile, evenly spaced between the bounds, on top
+        of the optimum itself.
+    optimum : array of floats, optional
+        log10 values of the fit; fitted from the nominal values if not
+        given.
+    param_values : dict, optional
+        Values of the Parameters that are not estimated.
+    level : float
+        Confidence level; branches stop once the likelihood has fallen
+        twice as far as its threshold.
+    processes : int, optional
+        Worker processes; 0 runs in the calling process.
+    step : float
+        Finite-difference step in log10 units.
+    maxiter : int
+        Optimizer iterations per grid point.
+
+    Returns a :py:class:`ProfileResult`.
+    """
+
+    start = time.time()
+    parameters = list(parameters)
+    profiled = parameters if profiled is None else list(profiled)
+    bounds = np.asarray(bounds, dtype=float).reshape(-1, 2)
+    observables = getattr(log_likelihood, 'observables', None)
+    if observables is None:
+        observables = list(network.observables)
+    spec = SweepSpec(network, np.asarray(tspan, dtype=float),
+                     list(observables), rtol, atol, log_likelihood)
+    base = network.param_vector(param_values)
+    index = [network.param_index(p) for p in parameters]
+
+    objective = _Objective(spec, base, index, bounds, step)
+    if optimum is None:
+        theta = np.log10(base[index])
+        optimum, fit_logl = objective.fit(
+            np.clip(theta, bounds[:, 0], bounds[:, 1]),
+            range(len(parameters)), 10 * maxiter)
+    else:
+        optimum = np.asarray(optimum, dtype=float)
+        fit_logl = objective.logl(optimum)
+    evaluations = objective.evaluations
+    drop = stats.chi2.ppf(level, 1)
+
+    tasks = []
+    for name in profiled:
+        i = parameters.index(name)
+        grid = np.linspace(bounds[i, 0], bounds[i, 1], n_points)
+        for branch in (grid[grid < optimum[i]][::-1],
+                       grid[grid > optimum[i]]):
+            if len(branch):
+                tasks.append((spec, base, index, bounds, step, maxiter, i,
+                              optimum, branch, fit_logl - drop))
+    # Longest branches first, so that they do not finish last
+    order = sorted(range(len(tasks)), key=lambda t: -len(tasks[t][8]))
+    out = [None] * len(tasks)
+    for t, r in zip(order, _map([tasks[t] for t in order], processes)):
+        out[t] = r
+
+    grids, logls, paths = {}, {}, {}
+    for name in profiled:
+        i = parameters.index(name)
+        grid, logl, path = [optimum[i]], [fit_logl], [optimum]
+        for task, (values, thetas, count) in zip(tasks, out):
+            if task[6] == i:
+                grid.extend(task[8])
+                logl.extend(values)
+                path.extend(thetas)
+        order = np.argsort(grid)
+        grids[name] = np.asarray(grid)[order]
+        logls[name] = np.asarray(logl)[order]
+        paths[name] = np.asarray(path)[order]
+    evaluations += sum(count for _, _, count in out)
+    return ProfileResult(parameters, bounds, optimum, fit_logl, grids, logls,
+                         paths, evaluations, time.time() - start)
+
+
+class ProfileResult(object):
+    """Likelihood profiles of a set of Parameters.
+
+    Attributes
+    ----------
+    parameters : list of strings
+        The estimated Parameters.
+    optimum : array of floats
+        Their fitted log10 values.
+    max_logl : float
+        Log-likelihood of the fit, or the best value met while profiling if
+        that is higher (the fit was then not the global optimum).
+    grid : dict
+        Maps each profiled Parameter to its log10 grid, ascending.
+    logl : dict
+        Maps each profiled Parameter to its profile on the grid, NaN past
+        the point where its branch stopped.
+    paths : dict
+        Maps each profiled Parameter to the log10 values of all Parameters
+        along its profile (points x parameters).
+    evaluations : int
+        Number of simulated parameter sets.
+    seconds : float
+        Wall time of the analysis.
+    """
+
+    def __init__(self, parameters, bounds, optimum, fit_logl, grid, logl,
+                 paths, evaluations, seconds):
+        self.parameters = parameters
+        self.bounds = bounds
+        self.optimum = optimum
+        self.max_logl = max([fit_logl] + [np.nanmax(v) for v in logl.values()])
+        self.grid = grid
+        self.logl = logl
+        self.paths = paths
+        self.evaluations = evaluations
+        self.seconds = seconds
+
+    def threshold(self, level=0.95):
+        """Log-likelihood at the edge of the `level` confidence region."""
+
+        return self.max_logl - stats.chi2.ppf(level, 1) / 2.
+
+    def interval(self, name, level=0.95):
+        """Return the (low, high) log10 confidence interval of `name`.
+
+        An end is -inf or inf when the profile stays above the threshold up
+        to the bound, i.e. the Parameter is not identified on that side.
+        Ends are interpolated linearly between grid points, so their
+        resolution is that of the grid.
+        """
+
+        grid, logl = self.grid[name], self.logl[name]
+        inside = np.nan_to_num(logl, nan=-np.inf) - self.threshold(level)
+        best = int(np.argmax(inside))
+        ends = []
+        for side in (-1, 1):
+            end = -side * np.inf
+            j = best
+            while 0 <= j + side < len(grid):
+                if inside[j + side] < 0:
+                    # Linear interpolation of the crossing
+                    a, b = inside[j], inside[j + side]
+                    if np.isfinite(b):
+                        end = grid[j] + (grid[j + side] - grid[j]) * a / (a - b)
+                    else:
+                        end = grid[j + side]
+                    break
+                j += side
+            else:
+                end = side * np.inf
+            ends.append(end)
+        return tuple(ends)
+
+    def identifiable(self, level=0.95):
+        """Map each profiled Parameter to whether its interval is finite."""
+
+        return {name: bool(np.all(np.isfinite(self.interval(name, level))))
+                for name in self.grid}
+
+    def tradeoff(self, name, other, level=0.95):
+        """Slope of `other` against `name` along the profile of `name`.
+
+        Both in log10 units, fitted over the points inside the `level`
+        confidence region. A slope near 1 (or -1) on a flat profile means
+        the data only constrain the ratio (or product) of the two
+        Parameters. NaN if fewer than two points are inside.
+        """
+
+        logl = np.nan_to_num(self.logl[name], nan=-np.inf)
+        inside = logl >= self.threshold(level)
+        if inside.sum() < 2:
+            return np.nan
+        x = self.grid[name][inside]
+        y = self.paths[name][inside, self.parameters.index(other)]
+        return float(np.polyfit(x, y, 1)[0])
+
+    def __str__(self, level=0.95):
+        width = max([len(n) for n in self.grid] + [9])
+        lines = ['max logL %.6g, %d simulations in %.1f s' % (
+            self.max_logl, self.evaluations, self.seconds),
+            '%-*s %10s %10s %10s  %s' % (width, 'parameter', 'log10 fit',
+                                         'low', 'high', 'identifiable')]
+        for name in self.grid:
+            low, high = self.interval(name, level)
+            lines.append('%-*s %10.4g %10.4g %10.4g  %s' % (
+                width, name, self.optimum[self.parameters.index(name)], low,
+                high, 'yes' if np.isfinite(low) and np.isfinite(high)
+                else 'no'))
+        return '\n'.join(lines)
+
+
+# Helpers
+# =======
+
+class _Objective(object):
+    """Negative log-likelihood of log10 values, with batched gradients."""
+
+    def __init__(self, spec, base, index, bounds, step):
+        self.spec = spec
+        self.base = base
+        self.index = index
+        self.bounds = bounds
+        self.step = step
+        self.simulator = Simulator(spec.network, rtol=spec.rtol,
+                                   atol=spec.atol)
+        self.evaluations = 0
+
+    def _evaluate(self, thetas):
+        params = np.tile(self.base, (len(thetas), 1))
+        params[:, self.index] = 10. ** np.asarray(thetas)
+        self.evaluations += len(params)
+        logl = simulate_chunk(self.simulator, self.spec, params)
+        return np.where(np.isfinite(logl), logl, -np.inf)
+
+    def logl(self, theta):
+        return float(self._evaluate([theta])[0])
+
+    def fit(self, theta, free, maxiter):
+        """Return `theta` with its `free` entries optimized, and its
+        log-likelihood."""
+
+        free = list(free)
+        if not free:
+            return theta, self.logl(theta)
+        theta = np.array(theta, dtype=float)
+        bounds = self.bounds[free]
+
+        def f(x):
+            point = theta.copy()
+            point[free] = x
+            n = len(free)
+            thetas = np.tile(point, (2 * n + 1, 1))
+            thetas[np.arange(1, n + 1), free] += self.step
+            thetas[np.arange(n + 1, 2 * n + 1), free] -= self.step
+            logl = self._evaluate(thetas)
+            if not np.isfinite(logl[0]):
+                return np.inf, np.zeros(n)
+            grad = -(logl[1:n + 1] - logl[n + 1:]) / (2 * self.step)
+            return -logl[0], np.where(np.isfinite(grad), grad, 0.)
+
+        res = optimize.minimize(f, theta[free], jac=True, method='L-BFGS-B',
+                                bounds=bounds, options={'maxiter': maxiter})
+        theta[free] = res.x
+        return theta, -float(res.fun)
+
+def _profile_branch(task):
+    """Walk one branch of a profile, warm-starting each point from the
+    previous one; return (logl, thetas, simulations)."""
+
+    (spec, base, index, bounds, step, maxiter, i, start, grid,
+     floor) = task
+    objective = _Objective(spec, base, index, bounds, step)
+    free = [j for j in range(len(index)) if j != i]
+    logl = np.full(len(grid), np.nan)
+    thetas = np.full((len(grid), len(index)), np.nan)
+    theta = np.array(start, dtype=float)
+    for k, value in enumerate(grid):
+        theta[i] = value
+        theta, logl[k] = objective.fit(theta, free, maxiter)
+        thetas[k] = theta
+        # Well past the confidence threshold: the rest adds nothing
+        if logl[k] < floor:
+            break
+    return logl, thetas, objective.evaluations
+
+def _map(tasks, processes):
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes == 0 or len(tasks) <= 1:
+        return [_profile_branch(t) for t in tasks]
+    with ProcessPoolExecutor(min(processes, len(tasks))) as pool:
+        return list(pool.map(_profile_branch, tasks))
@@ -0,0 +1,255 @@
+"""
+Overview
+========
+
+Online reducers for streamed trajectories.
+
+Reducers consume the observable chunks produced by
+:py:meth:`anrm.simulator.Simulator.stream` and
+:py:meth:`anrm.ssa.StochasticSimulator.stream` and accumulate ensemble
+statistics without keeping any trajectory around. Their memory use depends
+only on the number of output times and bins, never on the number of cells.
+
+Every reducer implements the same small protocol:
+
+- ``start()`` -- a new trajectory begins,
+- ``update(chunk)`` -- consume the next chunk of the current trajectory,
+- ``merge(other)`` -- fold in a reducer of the same kind filled elsewhere
+  (e.g. in another process),
+
+plus reducer-specific accessors for the results. The reducers provided are
+
+- :py:class:`Moments` -- running mean and variance per time point,
+- :py:class:`Histogram` -- per-time-point histogram of one observable,
+- :py:class:`FirstPassage` -- statistics of the first time an observable
+  crosses a threshold (e.g. time to half-maximal ``Obs_cPARP``).
+"""
+
+import numpy as np
+
+
+def reduce_stream(stream, reducers):
+    """Feed one trajectory's chunks to every reducer in `reducers`."""
+
+    for r in reducers:
+        r.start()
+    for chunk in stream:
+        for r in reducers:
+            r.update(chunk)
+    return reducers
+
+def reduce_ensemble(streams, reducers):
+    """Feed every trajectory of an ensemble to every reducer in `reducers`."""
+
+    for stream in streams:
+        reduce_stream(stream, reducers)
+    return reducers
+
+
+class Moments(object):
+    """Running mean and variance of observables at every output time.
+
+    Uses Welford's update within a process and Chan's pairwise formula in
+    :py:meth:`merge`.
+
+    Parameters
+    ----------
+    observables : list of strings
+        Names of the observables to track.
+    """
+
+    def __init__(self, observables):
+        self.observables = list(observables)
+        self.count = np.zeros(0)
+        self._mean = np.zeros((0, len(self.observables)))
+        self._m2 = np.zeros((0, len(self.observables)))
+        self._pos = 0
+
+    def start(self):
+        self._pos = 0
+
+    def update(self, chunk):
+        x = np.column_stack([chunk[name] for name in self.observables])
+        end = self._pos + len(x)
+        self._grow(end)
+        sl = slice(self._pos, end)
+        self.count[sl] += 1
+        delta = x - self._mean[sl]
+        self._mean[sl] += delta / self.count[sl, None]
+        self._m2[sl] += delta * (x - self._mean[sl])
+        self._pos = end
+
+    def merge(self, other):
+        self._grow(len(other.count))
+        n = len(other.count)
+        na, nb = self.count[:n], other.count
+        total = na + nb
+        safe = np.where(total > 0, total, 1)[:, None]
+        delta = other._mean - self._mean[:n]
+        self._mean[:n] += delta * (nb[:, None] / safe)
+        self._m2[:n] += other._m2 + delta ** 2 * (na * nb)[:, None] / safe
+        self.count[:n] = total
+        return self
+
+    @property
+    def mean(self):
+        """Mean of each observable, times x observables."""
+        return self._mean.copy()
+
+    @property
+    def variance(self):
+        """Sample variance of each observable, times x observables."""
+        denom = np.where(self.count > 1, self.count - 1, np.nan)
+        return self._m2 / denom[:, None]
+
+    def _grow(self, n):
+        if n > len(self.count):
+            extra = n - len(self.count)
+            width = len(self.observables)
+            self.count = np.concatenate([self.count, np.zeros(extra)])
+            self._mean = np.vstack([self._mean, np.zeros((extra, width))])
+            self._m2 = np.vstack([self._m2, np.zeros((extra, width))])
+
+
+class Histogram(object):
+    """Histogram of one observable at every output time.
+
+    Parameters
+    ----------
+    observable : string
+        Name of the observable.
+    bins : array of floats
+        Bin edges; values outside them are counted in the first or last bin.
+    """
+
+    def __init__(self, observable, bins):
+        self.observable = observable
+        self.bins = np.asarray(bins, dtype=float)
+        self.counts = np.zeros((0, len(self.bins) - 1), dtype=np.int64)
+        self._pos = 0
+
+    def start(self):
+        self._pos = 0
+
+    def update(self, chunk):
+        x = chunk[self.observable]
+        end = self._pos + len(x)
+        if end > len(self.counts):
+            extra = np.zeros((end - len(self.counts), self.counts.shape[1]),
+                             dtype=np.int64)
+            self.counts = np.vstack([self.counts, extra])
+        b = np.clip(np.searchsorted(self.bins, x, 'right') - 1,
+                    0, len(self.bins) - 2)
+        self.counts[np.arange(self._pos, end), b] += 1
+        self._pos = end
+
+    def merge(self, other):
+        n = len(other.counts)
+        if n > len(self.counts):
+            self.counts, other_counts = other.counts.copy(), self.counts
+            self.counts[:len(other_counts)] += other_counts
+        else:
+            self.counts[:n] += other.counts
+        return self
+
+
+class FirstPassage(object):
+    """First time an observable crosses a threshold, over many trajectories.
+
+    Crossing times are linearly interpolated between output times. Only
+    summary statistics and a histogram of the crossing times are kept; the
+    mean and variance are accumulated as in :py:class:`Moments`.
+
+    Parameters
+    ----------
+    observable : string
+        Name of the observable.
+    threshold : float
+        Level to cross.
+    bins : array of floats
+        Bin edges of the crossing-time histogram.
+    direction : +1 or -1
+        Whether to detect upward (default) or downward crossings.
+    """
+
+    def __init__(self, observable, threshold, bins, direction=1):
+        self.observable = observable
+        self.threshold = threshold
+        self.bins = np.asarray(bins, dtype=float)
+        self.direction = direction
+        self.counts = np.zeros(len(self.bins) - 1, dtype=np.int64)
+        self.n_crossed = 0
+        self.n_total = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._mean = 0.
+        self._m2 = 0.
+        self._last = None
+        self._done = True
+
+    def start(self):
+        self.n_total += 1
+        self._last = None
+        self._done = False
+
+    def update(self, chunk):
+        if self._done:
+            return
+        t = chunk.tout
+        x = self.direction * (chunk[self.observable] - self.threshold)
+        if self._last is not None:
+            t = np.concatenate([[self._last[0]], t])
+            x = np.concatenate([[self._last[1]], x])
+        above = np.nonzero(x >= 0)[0]
+        if len(above):
+            i = above[0]
+            if i == 0:
+                tc = t[0]
+            else:
+                tc = t[i - 1] + (t[i] - t[i - 1]) * (-x[i - 1]) / \
+                    (x[i] - x[i - 1])
+            self._record(tc)
+        else:
+            self._last = (t[-1], x[-1])
+
+    def merge(self, other):
+        self.counts += other.counts
+        na, nb = self.n_crossed, other.n_crossed
+        if nb:
+            delta = other._mean - self._mean
+            self._mean += delta * nb / (na + nb)
+            self._m2 += other._m2 + delta ** 2 * na * nb / (na + nb)
+        self.n_crossed += nb
+        self.n_total += other.n_total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def fraction(self):
+        """Fraction of trajectories that crossed the threshold."""
+        return self.n_crossed / float(max(self.n_total, 1))
+
+    @property
+    def mean(self):
+        """Mean crossing time of the trajectories that crossed."""
+        return self._mean if self.n_crossed else np.nan
+
+    @property
+    def variance(self):
+        """Sample variance of the crossing times."""
+        if self.n_crossed < 2:
+            return np.nan
+        return self._m2 / (self.n_crossed - 1)
+
+    def _record(self, tc):
+        self._done = True
+        self.n_crossed += 1
+        delta = tc - self._mean
+        self._mean += delta / self.n_crossed
+        self._m2 += delta * (tc - self._mean)
+        self.min = min(self.min, tc)
+        self.max = max(self.max, tc)
+        b = np.searchsorted(self.bins, tc, 'right') - 1
+        if 0 <= b < len(self.counts):
+            self.counts[b] += 1
@@ -0,0 +1,314 @@
+"""
+Overview
+========
+
+Knockout and overexpression screens over the initial conditions of a model.
+
+:py:func:`run_screen` perturbs every initial-condition Parameter (``RIP3_0``,
+``flip_S_0``, ``XIAP_0``, ...) alone and, optionally, in pairs: a knockout
+sets it to 0 and an overexpression multiplies it by `factor` (10 by
+default). It returns a :py:class:`ScreenResult` with the fate and time of
+death of every single perturbation (the diagonal) and every pair (off the
+diagonal), as compact matrices.
+
+Three things keep large screens cheap:
+
+- Every perturbation is simulated on its own pruned network (see
+  :py:meth:`anrm.network.Network.prune`): the species a knockout makes
+  unreachable, and the reactions they take part in, are dropped. Networks
+  are shared by perturbations that zero the same Parameters.
+- With `equilibrate`, cells are first run without ligand (the `ligands`
+  Parameters set to 0) before the ligand is added. The wild-type
+  equilibrium is computed once. It is reused, with the perturbed amounts
+  swapped in, for every perturbation of species that no reaction consumes
+  before the ligand arrives, such as receptors, adaptors and necrosome
+  components that wait for the ligand signal. Only the others are
+  equilibrated separately.
+- Simulations run in batches on a process pool.
+
+Example::
+
+    result = run_screen(network, tspan, ligands=['TNFa_0'],
+                        param_values={'TNFa_0': 3000}, equilibrate=20000.)
+    result.fates        # perturbations x perturbations, -1 where no call
+    print(result)
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from anrm.fate import FAILED, FATE_NAMES, SURVIVAL, classify
+
+KNOCKOUT = 'KO'
+OVEREXPRESSION = 'OE'
+
+
+class Perturbation(object):
+    """A knockout or an overexpression of one initial condition."""
+
+    def __init__(self, param, kind, factor=10.):
+        self.param = param
+        self.kind = kind
+        self.factor = 0. if kind == KNOCKOUT else factor
+
+    @property
+    def name(self):
+        if self.kind == KNOCKOUT:
+            return '%s KO' % self.param
+        return '%s x%g' % (self.param, self.factor)
+
+    def __repr__(self):
+        return 'Perturbation(%r, %r, %r)' % (self.param, self.kind,
+                                             self.factor)
+
+
+def perturbations(network, knockouts=None, overexpress=None, factor=10.,
+                  exclude=()):
+    """Return the single perturbations of a screen.
+
+    `knockouts` and `overexpress` are lists of initial-condition Parameters
+    (default: all of them but `exclude`); pass an empty list to skip one
+    kind.
+    """
+
+    params = [p for p in network.initial_params if p not in exclude]
+    params = list(dict.fromkeys(params))
+    knockouts = params if knockouts is None else knockouts
+    overexpress = params if overexpress is None else overexpress
+    return ([Perturbation(p, KNOCKOUT) for p in knockouts] +
+            [Perturbation(p, OVEREXPRESSION, factor) for p in overexpress])
+
+def run_screen(network, tspan, ligands=(), knockouts=None, overexpress=None,
+               factor=10., doubles=True, param_values=None,
+               equilibrate=None, threshold=0.5, prune=True, processes=None,
+               chunk_size=16, rtol=1e-3, atol=1e-6):
+    """Run a knockout/overexpression screen.
+
+    Parameters
+    ----------
+    network : anrm.network.Network
+        Network to screen.
+    tspan : array of floats
+        Output times after the ligand is added; fates are called on this
+        grid.
+    ligands : list of strings
+        Initial-condition Parameters of the ligands. They are not perturbed,
+        and they are held at 0 during pre-equilibration.
+    knockouts, overexpress : list of strings, optional
+        Parameters to knock out and to overexpress (default: every initial
+        condition but the ligands).
+    factor : float
+        Overexpression factor.
+    doubles : bool
+        Also run every pair of perturbations of different Parameters.
+    param_values : dict, optional
+        Condition of the screen, e.g. the ligand dose.
+    equilibrate : float, optional
+        Length of the ligand-free pre-equilibration, if any.
+    threshold : float
+        Fraction of PARP cleaved or activated at death.
+    prune : bool
+        Simulate each perturbation on its pruned network.
+    processes : int, optional
+        Worker processes; 0 runs in the calling process.
+    chunk_size : int
+        Perturbations integrated together as one batch.
+
+    Returns a :py:class:`ScreenResult`.
+    """
+
+    tspan = np.asarray(tspan, dtype=float)
+    ligands = list(ligands)
+    singles = perturbations(network, knockouts, overexpress, factor,
+                            exclude=ligands)
+    pairs = [(i, i) for i in range(len(singles))]
+    if doubles:
+        pairs += [(i, j) for i in range(len(singles))
+                  for j in range(i + 1, len(singles))
+                  if singles[i].param != singles[j].param]
+    base = network.param_vector(param_values)
+    # Row 0 is the wild type
+    params = np.tile(base, (len(pairs) + 1, 1))
+    for row, (i, j) in enumerate(pairs, 1):
+        for p in set([singles[i], singles[j]]):
+            params[row, network.param_index(p.param)] *= p.factor
+
+    # Pruned network per set of zeroed Parameters
+    groups = {}
+    zero = params[:, [network.param_index(p)
+                      for p in network.initial_params]] == 0
+    for row in range(len(params)):
+        groups.setdefault(zero[row].tobytes(), []).append(row)
+    networks = {}
+    for key, rows in groups.items():
+        if prune:
+            networks[key] = network.prune(params[rows[0]])
+        else:
+            networks[key] = (network, None)
+
+    lig_index = [network.param_index(p) for p in ligands]
+    lig_species = [network.species_index(p) for p in ligands]
+    free = params.copy()
+    free[:, lig_index] = 0.
+    y0 = network.initial_state(free)
+    if equilibrate is not None:
+        y0 = _equilibrate(network, networks, groups, free, y0, pairs,
+                          singles, equilibrate, processes, chunk_size, rtol,
+                          atol)
+    y0[:, lig_species] = params[:, lig_index]
+
+    tasks, slots = [], []
+    for key, rows in groups.items():
+        net, pruning = networks[key]
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            y = y0[chunk] if pruning is None else \
+                y0[chunk][:, pruning.keep_species]
+            tasks.append(('fate', net, tspan, params[chunk], y, rtol, atol,
+                          threshold))
+            slots.append(chunk)
+    fates = np.full(len(params), -1, dtype=np.int8)
+    times = np.full(len(params), np.nan)
+    for chunk, (f, t) in zip(slots, _map(tasks, processes)):
+        fates[chunk] = f
+        times[chunk] = t
+    return ScreenResult(singles, pairs, fates, times)
+
+
+class ScreenResult(object):
+    """Fates and times of death of a screen.
+
+    Attributes
+    ----------
+    perturbations : list of Perturbation
+        The single perturbations, in matrix order.
+    names : list of strings
+        Their names (e.g. ``'XIAP_0 KO'``, ``'RIP1_0 x10'``).
+    fates : 2D array of int8
+        Fate of each single (diagonal) and double perturbation, coded as in
+        :py:mod:`anrm.fate`; FAILED (-1) for pairs that were not run or
+        failed to integrate (or when PARP itself is knocked out).
+    death_times : 2D array of floats
+        Matching times of death, NaN for survivors and pairs not run.
+    wild_type : (int, float)
+        Fate and time of death without perturbation.
+    """
+
+    def __init__(self, singles, pairs, fates, times):
+        n = len(singles)
+        self.perturbations = singles
+        self.names = [p.name for p in singles]
+        self.fates = np.full((n, n), -1, dtype=np.int8)
+        self.death_times = np.full((n, n), np.nan)
+        for row, (i, j) in enumerate(pairs, 1):
+            self.fates[i, j] = self.fates[j, i] = fates[row]
+            self.death_times[i, j] = self.death_times[j, i] = times[row]
+        self.wild_type = (int(fates[0]), float(times[0]))
+
+    def single(self):
+        """Return (names, fates, times) of the single perturbations."""
+
+        return (self.names, np.diagonal(self.fates).copy(),
+                np.diagonal(self.death_times).copy())
+
+    def changed(self):
+        """Return the (name, name) pairs, equal for singles, whose fate
+        differs from the wild type."""
+
+        i, j = np.nonzero(np.triu((self.fates != self.wild_type[0]) &
+                                  (self.fates >= 0)))
+        return [(self.names[a], self.names[b]) for a, b in zip(i, j)]
+
+    def __str__(self):
+        code = {FAILED: '.', SURVIVAL: 'S'}
+        for f, name in enumerate(FATE_NAMES):
+            code.setdefault(f, name[0].upper())
+        width = max([len(n) for n in self.names] + [9])
+        wt_fate, wt_time = self.wild_type
+        lines = ['wild type: %s%s' % (FATE_NAMES[wt_fate] if wt_fate >= 0
+                                      else 'failed',
+                                      '' if np.isnan(wt_time)
+                                      else ' at %g' % wt_time)]
+        for i, name in enumerate(self.names):
+            time = self.death_times[i, i]
+            lines.append('%-*s %s %10s  %s' % (
+                width, name, code[int(self.fates[i, i])],
+                '' if np.isnan(time) else '%.4g' % time,
+                ''.join(code[int(f)] for f in self.fates[i])))
+        return '\n'.join(lines)
+
+
+# Helpers
+# =======
+
+def _equilibrate(network, networks, groups, free, y0, pairs, singles,
+                 t_eq, processes, chunk_size, rtol, atol):
+    """Return the ligand-free equilibrium of every row of `free`."""
+
+    # Species consumed by a reaction that can fire without ligand
+    _, pruning = network.prune(free[0])
+    live = pruning.keep_reactions
+    consumed = set(network.reactants[live].ravel()) - {network.n_species}
+
+    def inert(p):
+        return network.species_index(p.param) not in consumed
+
+    reuse = [0 < row and all(inert(singles[k]) for k in pairs[row - 1])
+             for row in range(len(free))]
+    tasks, slots = [], []
+    for key, rows in groups.items():
+        net, sub = networks[key]
+        rows = [r for r in rows if not reuse[r]]
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            y = y0[chunk] if sub is None else y0[chunk][:, sub.keep_species]
+            tasks.append(('equilibrate', net, np.array([0., t_eq]),
+                          free[chunk], y, rtol, atol, None))
+            slots.append((chunk, sub))
+    out = y0.copy()
+    for (chunk, sub), y in zip(slots, _map(tasks, processes)):
+        out[chunk] = y if sub is None else sub.expand(y)
+    # Perturbed amounts of inert species are carried over unchanged
+    shift = y0 - y0[0]
+    rows = np.nonzero(reuse)[0]
+    out[rows] = out[0] + shift[rows]
+    return out
+
+def _map(tasks, processes):
+    if processes == 0 or len(tasks) <= 1:
+        return [_run_task(t) for t in tasks]
+    with ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(_run_task, tasks))
+
+def _run_task(task):
+    """Simulate one batch: its final states, or its fates and times."""
+
+    from anrm.simulator import Simulator
+
+    kind, network, tspan, params, y0, rtol, atol, threshold = task
+    sim = Simulator(network, rtol=rtol, atol=atol)
+    if kind == 'equilibrate':
+        results = sim.run_batch(tspan, params, y0=y0)
+        return np.array([r.species[-1] for r in results])
+    observables = ['Obs_cPARP', 'Obs_aPARP']
+    try:
+        results = sim.run_batch(tspan, params, y0=y0, observables=observables)
+        values = np.array([r._obs for r in results])
+    except RuntimeError:
+        # Retry one by one; members that still fail are called FAILED
+        values = np.full((len(params), len(tspan), 2), np.nan)
+        for i in range(len(params)):
+            try:
+                values[i] = sim.run_batch(tspan, params[i:i + 1],
+                                          y0=y0[i:i + 1],
+                                          observables=observables)[0]._obs
+            except RuntimeError:
+                pass
+    parp_0 = params[:, network.param_index('PARP_0')]
+    fates, times = classify(tspan, values[:, :, 0], values[:, :, 1], parp_0,
+                            threshold)
+    # No PARP, no fate call
+    fates[parp_0 == 0] = FAILED
+    times[parp_0 == 0] = np.nan
+    return fates, times
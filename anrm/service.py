@@ -0,0 +1,297 @@
+"""
+Overview
+========
+
+A local asyncio simulation service with request batching.
+
+Dashboards and notebooks tend to send many small, concurrent "what if"
+requests that differ only in a few Parameter values (``flip_S_0``,
+``TNFa_0``, ...). Starting a process per request pays the model setup every
+time and leaves the cores underused. :py:class:`SimulationService` instead
+
+1. accepts requests as newline-delimited JSON over a local TCP or Unix
+   socket; several requests may be pipelined on one connection,
+2. coalesces the requests that arrive within a short window (and share an
+   output grid) into one batch,
+3. runs each batch with :py:meth:`anrm.simulator.Simulator.run_batch` in a
+   process pool whose workers receive the generated network once, at
+   startup,
+4. writes every result back as soon as its batch is done, tagged with the
+   request id, so responses may arrive out of order.
+
+A request looks like::
+
+    {"id": 7, "tspan": {"start": 0, "stop": 20000, "n": 101},
+     "params": {"flip_S_0": 5000}, "observables": ["Obs_cPARP", "Obs_aPARP"]}
+
+where ``tspan`` is either an evenly spaced grid as above or an explicit list
+of times, and ``params`` and ``observables`` are optional. The reply is::
+
+    {"id": 7, "tout": [...], "observables": {"Obs_cPARP": [...], ...}}
+
+or ``{"id": 7, "error": "..."}``.
+
+To run a service from a script::
+
+    service = SimulationService(Network.from_model(model))
+    asyncio.run(service.serve(port=8765))
+
+and to query it, :py:class:`ServiceClient`.
+"""
+
+import asyncio
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from anrm.simulator import Simulator
+
+# Simulator of the current pool worker, set up by _init_worker.
+_worker_sim = None
+
+
+def _init_worker(network, rtol, atol):
+    global _worker_sim
+    _worker_sim = Simulator(network, rtol=rtol, atol=atol)
+
+def _simulate_batch(tspan, param_sets, observables):
+    """Run one batch in a pool worker and return plain lists.
+
+    If the batch as a whole fails, its members are retried one by one, and
+    those that still fail are returned as their exception.
+    """
+
+    try:
+        results = _worker_sim.run_batch(tspan, param_sets,
+                                        observables=observables)
+    except Exception:
+        results = []
+        for params in param_sets:
+            try:
+                results.extend(_worker_sim.run_batch(
+                    tspan, [params], observables=observables))
+            except Exception as e:
+                results.append(e)
+    return [r if isinstance(r, Exception) else
+            dict((name, r[name].tolist()) for name in r.observable_names)
+            for r in results]
+
+
+class SimulationService(object):
+    """Batching simulation server around a generated network.
+
+    Parameters
+    ----------
+    network : anrm.network.Network
+        Network to simulate; sent to each worker process once.
+    processes : int, optional
+        Size of the worker pool (default: number of CPUs).
+    max_batch : int
+        Largest number of requests simulated together.
+    max_delay : float
+        Time in seconds to wait for more requests after the first one of a
+        batch arrives.
+    rtol, atol : float
+        Integrator tolerances.
+    """
+
+    def __init__(self, network, processes=None, max_batch=32,
+                 max_delay=0.005, rtol=1e-3, atol=1e-6):
+        self.network = network
+        self.processes = processes
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.rtol = rtol
+        self.atol = atol
+        self._queue = None
+        self._pool = None
+
+    async def serve(self, host='127.0.0.1', port=8765, path=None):
+        """Serve requests until cancelled.
+
+        Listens on the Unix socket `path` if given, else on `host`:`port`.
+        """
+
+        self._queue = asyncio.Queue()
+        self._pool = ProcessPoolExecutor(
+            self.processes, initializer=_init_worker,
+            initargs=(self.network, self.rtol, self.atol))
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+        batcher = asyncio.ensure_future(self._batcher())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self._pool.shutdown(wait=False)
+
+    async def _handle(self, reader, writer):
+        """Read pipelined requests from one connection and reply to each."""
+
+        lock = asyncio.Lock()
+        pending = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.ensure_future(self._answer(line, writer, lock))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    async def _answer(self, line, writer, lock):
+        request_id = None
+        try:
+            request = json.loads(line.decode('utf-8'))
+            request_id = request.get('id')
+            tspan = _parse_tspan(request['tspan'])
+            observables = request.get('observables')
+            if observables is None:
+                observables = list(self.network.observables)
+            for name in observables:
+                self.network.observable_index(name)
+            params = request.get('params') or {}
+            for name, value in params.items():
+                self.network.param_index(name)
+                # NaN or infinite rates would never let the solver finish
+                if not np.isfinite(float(value)) or float(value) < 0:
+                    raise ValueError("Parameter '%s' must be finite and "
+                                     "non-negative, not %r" % (name, value))
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put((tspan, tuple(observables), params, future))
+            values = await future
+            reply = {'id': request_id, 'tout': tspan.tolist(),
+                     'observables': values}
+        except Exception as e:
+            reply = {'id': request_id, 'error': '%s: %s' %
+                     (type(e).__name__, e)}
+        async with lock:
+            writer.write((json.dumps(reply) + '\n').encode('utf-8'))
+            await writer.drain()
+
+    async def _batcher(self):
+        """Collect queued requests into batches and dispatch them."""
+
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(),
+                                                        timeout))
+                except asyncio.TimeoutError:
+                    break
+            # Requests can only share a batch if they share the output grid
+            groups = {}
+            for item in batch:
+                key = (item[0].tobytes(), item[1])
+                groups.setdefault(key, []).append(item)
+            for items in groups.values():
+                asyncio.ensure_future(self._dispatch(items))
+
+    async def _dispatch(self, items):
+        loop = asyncio.get_running_loop()
+        tspan, observables = items[0][0], list(items[0][1])
+        try:
+            values = await loop.run_in_executor(
+                self._pool, _simulate_batch, tspan,
+                [item[2] for item in items], observables)
+        except Exception as e:
+            for item in items:
+                if not item[3].done():
+                    item[3].set_exception(e)
+            return
+        for item, v in zip(items, values):
+            if item[3].done():
+                continue
+            if isinstance(v, Exception):
+                item[3].set_exception(v)
+            else:
+                item[3].set_result(v)
+
+
+class ServiceClient(object):
+    """Minimal asyncio client for :py:class:`SimulationService`.
+
+    Requests issued concurrently through one client are pipelined over a
+    single connection.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8765, path=None):
+        self.host = host
+        self.port = port
+        self.path = path
+        self._reader = None
+        self._writer = None
+        self._waiting = {}
+        self._next_id = 0
+        self._listener = None
+
+    async def connect(self):
+        if self.path is not None:
+            self._reader, self._writer = \
+                await asyncio.open_unix_connection(self.path)
+        else:
+            self._reader, self._writer = \
+                await asyncio.open_connection(self.host, self.port)
+        self._listener = asyncio.ensure_future(self._listen())
+        return self
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+        if self._listener is not None:
+            self._listener.cancel()
+
+    async def simulate(self, tspan, params=None, observables=None):
+        """Submit one request and return its reply as a dict."""
+
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        tspan = tspan if isinstance(tspan, list) else list(tspan)
+        request = {'id': request_id, 'tspan': [float(t) for t in tspan],
+                   'params': params or {}, 'observables': observables}
+        self._writer.write((json.dumps(request) + '\n').encode('utf-8'))
+        await self._writer.drain()
+        reply = await future
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply
+
+    async def _listen(self):
+        while True:
+            line = await self._reader.readline()
+            if not line:
+                break
+            reply = json.loads(line.decode('utf-8'))
+            future = self._waiting.pop(reply.get('id'), None)
+            if future is not None and not future.done():
+                future.set_result(reply)
+        for future in self._waiting.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Service closed"))
+
+
+def _parse_tspan(spec):
+    """Turn a grid description or an explicit list into an array of times."""
+
+    if isinstance(spec, dict):
+        return np.linspace(spec['start'], spec['stop'], int(spec['n']))
+    return np.asarray(spec, dtype=float)
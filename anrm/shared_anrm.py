@@ -39,17 +39,43 @@ following four categories:
 # Preliminaries
 # =============
 
-# We need the main things from pysb.core plus a few extras:
+# PySB is only needed once a macro is called, so it is imported on first use:
+# `macros`, `_core` and `_util` stand for pysb.macros, pysb and pysb.util,
+# and the names that ``from pysb import *`` used to provide are looked up on
+# demand by the module-level `__getattr__` below. Importing this module for
+# its constants (`V`, `transloc_rates`, ...) therefore costs next to
+# nothing.
 
-from pysb import *
-from pysb import MonomerPattern, ComplexPattern, ComponentSet
-import pysb.macros as macros
-from pysb.util import alias_model_components
 import functools
+import importlib
 
-# Also pull in Avogadro's number from Scipy:
 
-from scipy.constants import N_A
+class _LazyModule(object):
+    """Stand-in for a module that is imported on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+macros = _LazyModule('pysb.macros')
+_core = _LazyModule('pysb')
+_util = _LazyModule('pysb.util')
+
+def __getattr__(name):
+    # Component classes and helpers of pysb, e.g. Observable or ComponentSet
+    pysb = importlib.import_module('pysb')
+    if name.startswith('__') or not hasattr(pysb, name):
+        raise AttributeError("module %r has no attribute %r" %
+                             (__name__, name))
+    return getattr(pysb, name)
+
+# Avogadro's number (as in scipy.constants, which takes longer to import than
+# everything else here):
+
+N_A = 6.02214076e23
 
 # Global variables
 # ================
@@ -114,12 +140,12 @@ def observables():
     Smac, and cleaved PARP.
     """
 
-    alias_model_components()
+    _util.alias_model_components()
     # Observables
     # ===========
-    Observable('mBid',  Bid(state='M'))
-    Observable('aSmac', Smac(state='A'))
-    Observable('cPARP', PARP(state='C'))
+    _core.Observable('mBid',  Bid(state='M'))
+    _core.Observable('aSmac', Smac(state='A'))
+    _core.Observable('cPARP', PARP(state='C'))
 
 # Aliases to pysb.macros
 # ======================
@@ -194,7 +220,7 @@ def assemble_pore_spontaneous(subunit, klist):
 
     # Create the pore formation rule
     macros._macro_rule('spontaneous_pore',
-        free_subunit + free_subunit + free_subunit + free_subunit <>
+        free_subunit + free_subunit + free_subunit + free_subunit |
         subunit(s1=1, s2=4) % subunit(s1=2, s2=1) % \
         subunit(s1=3, s2=2) % subunit(s1=4, s2=3),
         klist, ['kf', 'kr'], name_func=pore_rule_name)
@@ -221,7 +247,7 @@ def displace_reversibly(lig1, lig2, target, klist):
     """
 
     return macros._macro_rule('displace',
-         lig1({'bf':None}) + lig2({'bf':1}) % target({'bf':1}) <>
+         lig1({'bf':None}) + lig2({'bf':1}) % target({'bf':1}) |
          lig1({'bf':1}) % target({'bf':1}) + lig2({'bf':None}),
          klist, ['fwd_kf', 'rev_kf'])
 
@@ -239,7 +265,7 @@ def catalyze_convert(sub1, sub2, product, klist, site='bf'):
     macros._verify_sites(sub2, site)
 
     components = macros._macro_rule('bind',
-                             sub1({site: None}) + sub2({site: None}) <>
+                             sub1({site: None}) + sub2({site: None}) |
                              sub1({site: 1}) % sub2({site: 1}),
                              klist[0:2], ['kf', 'kr'])
     components |= macros._macro_rule('convert',
@@ -258,7 +284,7 @@ def one_step_conv(sub1, sub2, product, klist, site='bf'):
     macros._verify_sites(sub2, site)
 
     return macros._macro_rule('convert',
-                       sub1({site: None}) + sub2({site: None}) <> product,
+                       sub1({site: None}) + sub2({site: None}) | product,
                        klist, ['kf', 'kr'])
 
 def pore_bind(subunit, sp_site1, sp_site2, sc_site, size, cargo, c_site,
@@ -312,7 +338,7 @@ def pore_bind(subunit, sp_site1, sp_site2, sc_site, size, cargo, c_site,
         return '%s_%d_%s' % (subunit.name, size,
                              macros._monomer_pattern_label(cargo))
 
-    components = ComponentSet()
+    components = _core.ComponentSet()
     # Set up some aliases that are invariant with pore size
     subunit_free = subunit({sc_site: None})
     cargo_free = cargo({c_site: None})
@@ -342,7 +368,7 @@ def pore_bind(subunit, sp_site1, sp_site2, sc_site, size, cargo, c_site,
     # Create the rules
     name_func = functools.partial(pore_bind_rule_name, size=size)
     components |= macros._macro_rule('pore_bind',
-                              pore_free + cargo_free <> pc_complex,
+                              pore_free + cargo_free | pc_complex,
                               klist[0:2], ['kf', 'kr'],
                               name_func=name_func)
 
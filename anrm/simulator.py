@@ -0,0 +1,526 @@
+"""
+Overview
+========
+
+Deterministic simulation of ANRM models.
+
+:py:class:`Simulator` integrates the mass-action ODEs of a
+:py:class:`~anrm.network.Network` with SciPy's variable-order BDF method and
+an analytic sparse Jacobian. The solver is stepped explicitly and its dense
+output is sampled at the requested times, which lets a run be split at dosing
+events (see :py:mod:`anrm.dosing`): at every event the integration stops, the
+state is modified and the solver is restarted from there, without going back
+to time zero.
+
+Usage::
+
+    from anrm.irvin_mod import model
+    from anrm.simulator import Simulator
+
+    sim = Simulator(model)
+    result = sim.run(numpy.linspace(0, 20000, 101), {'TNFa_0': 0})
+    result['Obs_cPARP']
+"""
+
+import numpy as np
+import scipy.sparse as sparse
+
+from anrm import linsolve
+from anrm.network import Network
+
+
+class Simulator(object):
+    """ODE simulator for a PySB model or a generated :py:class:`Network`.
+
+    Parameters
+    ----------
+    model : pysb.Model or Network
+        Model to simulate. PySB models are expanded with BioNetGen once, on
+        construction.
+    rtol, atol : float
+        Relative and absolute tolerances of the integrator.
+    max_step : float
+        Largest step the integrator may take.
+    linear_solver : string or anrm.linsolve.LinearSolver
+        Solver of the Newton systems: 'dense', 'splu', 'splu-reuse',
+        'gmres', or 'auto' to choose by system size (see
+        :py:mod:`anrm.linsolve`).
+    jit : bool
+        Evaluate the right-hand side and Jacobian with compiled Numba
+        kernels (see :py:mod:`anrm.jit`), if Numba is installed.
+    """
+
+    def __init__(self, model, rtol=1e-3, atol=1e-6, max_step=np.inf,
+                 linear_solver='auto', jit=False):
+        if isinstance(model, Network):
+            self.network = model
+        else:
+            self.network = Network.from_model(model)
+        self.rtol = rtol
+        self.atol = atol
+        self.max_step = max_step
+        self.linear_solver = linear_solver
+        self._linear = {}
+        self._kernels = None
+        if jit:
+            from anrm import jit as _jit
+            self._kernels = _jit.kernels(self.network)
+
+    def run(self, tspan, param_values=None, y0=None, schedule=None,
+            fluxes=False, observables=None, dtype=None):
+        """Simulate the model and return a :py:class:`SimulationResult`.
+
+        Parameters
+        ----------
+        tspan : array of floats
+            Increasing output times; the run starts at ``tspan[0]``.
+        param_values : dict or array, optional
+            Parameter overrides, see :py:meth:`Network.param_vector`.
+        y0 : array of floats, optional
+            Initial species amounts. Defaults to the model's initial
+            conditions evaluated with `param_values`.
+        schedule : anrm.dosing.Schedule, optional
+            Bolus events and inputs applied during the run.
+        fluxes : bool
+            Also integrate the flux through every reaction, as extra
+            quadrature states (see :py:meth:`SimulationResult.flux_summary`).
+        observables : list of strings, optional
+            Keep only these observables, and no species. They are projected
+            from the states as the solver produces them, so the species
+            trajectories are never stored.
+        dtype : numpy dtype, optional
+            Storage type of the outputs, e.g. ``np.float32`` to halve their
+            memory. The integration itself is always in double precision.
+        """
+
+        tspan = _check_tspan(tspan)
+        net = self.network
+        params = net.param_vector(param_values)
+        k = net.rate_constants(params)
+        if y0 is None:
+            y0 = net.initial_state(params)
+        y0 = _with_fluxes(net, y0, fluxes)
+        names, proj = _projection(net, observables)
+        out, flux = _outputs(net, (len(tspan),), observables, fluxes, dtype)
+        for i, block in self._integrate(tspan, y0, k, schedule):
+            _record(net, out, flux, i, block,
+                    None if observables is None else proj)
+        if observables is None:
+            return SimulationResult(net, tspan, species=out, fluxes=flux)
+        return SimulationResult(net, tspan, observables=out,
+                                observable_names=names, fluxes=flux)
+
+    def stream(self, tspan, param_values=None, y0=None, schedule=None,
+               chunk_size=100, observables=None):
+        """Simulate the model, yielding the observables in time chunks.
+
+        Takes the same arguments as :py:meth:`run`, plus the number of output
+        times per chunk and, optionally, the names of the observables to
+        keep. Each chunk is a :py:class:`SimulationResult` holding only
+        observables, so memory use is bounded by `chunk_size` however long
+        `tspan` is. Chunks can be fed to the reducers in
+        :py:mod:`anrm.reducers`.
+        """
+
+        tspan = _check_tspan(tspan)
+        params = self.network.param_vector(param_values)
+        k = self.network.rate_constants(params)
+        if y0 is None:
+            y0 = self.network.initial_state(params)
+        blocks = self._integrate(tspan, y0, k, schedule)
+        return _chunks(self.network, blocks, tspan, chunk_size, observables)
+
+    def run_adaptive(self, tspan, param_values=None, y0=None, schedule=None,
+                     observables=None, rtol=1e-3, atol=1e-6, scale=None,
+                     chunk_size=1000):
+        """Simulate the model, recording observables only where they change.
+
+        The observables are evaluated on the dense candidate grid `tspan`
+        chunk by chunk, and only the points needed to reproduce them by
+        linear interpolation to within ``atol + rtol * scale`` are kept (see
+        :py:class:`anrm.compression.AdaptiveSampler`). The first two and the
+        remaining arguments are as for :py:meth:`stream`.
+
+        `scale` defaults to the range each observable can reach given the
+        conserved monomer totals of the initial state (see
+        :py:meth:`Network.observable_scale`), e.g. ``PARP_0`` for cleaved
+        PARP. Observables that start near 0 and grow, such as cleaved PARP,
+        then get the same tolerance as ones that start at their maximum.
+
+        Returns an :py:class:`anrm.compression.CompressedTrajectory`.
+        """
+
+        from anrm.compression import AdaptiveSampler, CompressedTrajectory
+
+        if scale is None:
+            if y0 is None:
+                y0 = self.network.initial_state(
+                    self.network.param_vector(param_values))
+            scale = self.network.observable_scale(y0, observables)
+        sampler = AdaptiveSampler(rtol, atol, scale)
+        names = None
+        for chunk in self.stream(tspan, param_values, y0, schedule,
+                                 chunk_size, observables):
+            names = chunk.observable_names
+            sampler.update(chunk.tout, chunk._obs)
+        times, values = sampler.finish()
+        return CompressedTrajectory(times, values, names, sampler.tolerance)
+
+    def run_batch(self, tspan, param_values, y0=None, observables=None,
+                  fluxes=False, dtype=None):
+        """Simulate several parameter sets together as one stacked system.
+
+        All members of the batch share the solver's step sequence and its
+        Jacobian factorizations, which amortizes the per-step Python
+        overhead over the whole batch. The tolerances are tightened by
+        ``sqrt(len(batch))`` so that the error of every member stays within
+        the tolerances even though the error norm is taken over the batch.
+
+        Parameters
+        ----------
+        tspan : array of floats
+            Output times shared by the batch.
+        param_values : list of dicts, or 2D array
+            One set of Parameter overrides (or full vector) per member.
+        y0 : 2D array of floats, optional
+            Initial species amounts, one row per member.
+        observables : list of strings, optional
+            Keep only these observables, and no species, in the results;
+            they are projected during integration as in :py:meth:`run`.
+        fluxes : bool
+            Also integrate the flux through every reaction.
+        dtype : numpy dtype, optional
+            Storage type of the outputs, see :py:meth:`run`.
+
+        Returns a list of :py:class:`SimulationResult`, one per member.
+        """
+
+        tspan = _check_tspan(tspan)
+        net = self.network
+        params = np.array([net.param_vector(p) for p in param_values])
+        k = net.rate_constants(params)
+        if y0 is None:
+            y0 = net.initial_state(params)
+        y0 = np.asarray(y0, dtype=float).reshape(len(params), net.n_species)
+        y0 = _with_fluxes(net, y0, fluxes)
+        names, proj = _projection(net, observables)
+        out, flux = _outputs(net, (len(tspan), len(params)), observables,
+                             fluxes, dtype)
+        for i, block in self._integrate(tspan, y0, k):
+            _record(net, out, flux, i, block,
+                    None if observables is None else proj)
+        results = []
+        for b in range(len(params)):
+            member_flux = None if flux is None else flux[:, b]
+            if observables is None:
+                results.append(SimulationResult(net, tspan, species=out[:, b],
+                                                fluxes=member_flux))
+            else:
+                results.append(SimulationResult(
+                    net, tspan, observables=out[:, b],
+                    observable_names=names, fluxes=member_flux))
+        return results
+
+    # Integration core
+    # ----------------
+
+    def _integrate(self, tspan, y0, k, schedule=None):
+        """Yield (index, states) blocks of the trajectory sampled at `tspan`.
+
+        `y0` is a state vector, or an array of them (one per row) to be
+        integrated as a batch with matching rows of rate constants `k`. The
+        run is split into segments at the schedule's breakpoints; the solver
+        is restarted at the start of each segment.
+        """
+
+        net = self.network
+        t0, t1 = tspan[0], tspan[-1]
+        bounds = [t0]
+        if schedule is not None:
+            bounds.extend(schedule.breakpoints(t0, t1))
+        if bounds[-1] != t1:
+            bounds.append(t1)
+
+        y = np.array(y0, dtype=float)
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            influx = None
+            if schedule is not None:
+                schedule.apply(net, a, y)
+                influx = schedule.influx(net, a)
+            # Outputs in [a, b) belong to this segment
+            i0 = np.searchsorted(tspan, a, 'left')
+            i1 = np.searchsorted(tspan, b, 'left')
+            if i0 < i1 and tspan[i0] == a:
+                yield i0, y[None].copy()
+                i0 += 1
+            for j, block in self._segment(a, b, y, k, influx, tspan[i0:i1]):
+                yield i0 + j, block
+        if schedule is not None:
+            schedule.apply(net, t1, y)
+        yield len(tspan) - 1, y[None].copy()
+
+    def _segment(self, a, b, y, k, influx, t_out):
+        """Integrate from `a` to `b`, advancing `y` in place.
+
+        Yields (offset, states) blocks for the times in `t_out` as the solver
+        passes them.
+        """
+
+        from scipy.integrate import BDF
+
+        net = self.network
+        shape = y.shape
+        batch = y.size // shape[-1]
+        fluxes = shape[-1] > net.n_species
+        # The error norm is an RMS over all components.
+        scale = np.sqrt(batch * shape[-1] / net.n_species)
+        fun, jac = self._functions(k, influx, batch, fluxes)
+        atol = self.atol / scale
+        if fluxes:
+            # Integrated fluxes are quadratures that follow the species;
+            # they are left out of the error control.
+            atol = np.concatenate([np.full(batch * net.n_species, atol),
+                                   np.full(batch * net.n_reactions, np.inf)])
+        solver = BDF(fun, a, _pack(y, net.n_species), b,
+                     rtol=self.rtol / scale, atol=atol,
+                     max_step=self.max_step, jac=jac)
+        linsolve.attach(solver, self._linear_solver(y.size))
+        j = 0
+        while solver.status == 'running':
+            message = solver.step()
+            if solver.status == 'failed':
+                raise RuntimeError("Integration failed at t=%g: %s" %
+                                   (solver.t, message))
+            m = np.searchsorted(t_out, solver.t, 'right')
+            if m > j:
+                block = solver.dense_output()(t_out[j:m]).T
+                yield j, _unpack(block, shape, net.n_species)
+                j = m
+        y[...] = _unpack(solver.y, shape, net.n_species)
+
+    def _linear_solver(self, n):
+        """Return the linear solver for systems of size `n`.
+
+        Solvers are kept per size so that state such as a reused ordering
+        carries over between segments and runs.
+        """
+
+        solver = self._linear.get(n)
+        if solver is None:
+            solver = self._linear[n] = linsolve.make(self.linear_solver, n)
+        return solver
+
+    def _functions(self, k, influx=None, batch=1, fluxes=False):
+        """Return the right-hand side and Jacobian callables for the solver.
+
+        The callables act on the flattened state of `batch` stacked copies of
+        the network, followed, with `fluxes`, by the integrated flux through
+        every reaction of every copy.
+        """
+
+        net = self.network
+        if influx is not None and influx.any():
+            influx = np.tile(influx, batch)
+        else:
+            influx = 0.
+
+        if fluxes:
+            n = batch * net.n_species
+            zeros = sparse.csr_matrix((n + batch * net.n_reactions,
+                                       batch * net.n_reactions))
+            if k.ndim == 1:
+                shape = (net.n_species,)
+                S, rate_jacobian = net.stoichiometry, net.rate_jacobian
+            else:
+                shape = (batch, net.n_species)
+                S = net._batch_stoichiometry(batch)
+                rate_jacobian = net.batch_rate_jacobian
+
+            def fun(t, x):
+                v = net.reaction_rates(x[:n].reshape(shape), k).ravel()
+                return np.concatenate([S.dot(v) + influx, v])
+
+            def jac(t, x):
+                dv = rate_jacobian(x[:n].reshape(shape), k)
+                return sparse.hstack([sparse.vstack([S.dot(dv), dv]), zeros],
+                                     format='csc')
+        elif self._kernels is not None:
+            fun, jac = self._kernels.functions(k, batch, influx)
+        elif k.ndim == 1:
+            def fun(t, y):
+                return net.rhs(y, k) + influx
+
+            def jac(t, y):
+                return net.jacobian(y, k)
+        else:
+            shape = (batch, net.n_species)
+
+            def fun(t, y):
+                return net.rhs(y.reshape(shape), k).ravel() + influx
+
+            def jac(t, y):
+                return net.batch_jacobian(y.reshape(shape), k)
+
+        return fun, jac
+
+
+class SimulationResult(object):
+    """Trajectory of a simulation, sampled at `tout`.
+
+    Attributes
+    ----------
+    tout : array of floats
+        Output times.
+    species : array of floats or None
+        Species amounts, times x species.
+    observables : numpy record array
+        Observable trajectories, one field per observable, as returned by
+        :py:func:`pysb.integrate.odesolve`.
+    fluxes : array of floats or None
+        Flux through every reaction integrated from ``tout[0]``, times x
+        reactions, if the run was made with ``fluxes=True``.
+    """
+
+    def __init__(self, network, tout, species=None, observables=None,
+                 observable_names=None, fluxes=None):
+        self.network = network
+        self.tout = tout
+        self.species = species
+        self.fluxes = fluxes
+        if observables is None:
+            observables = network.observe(species)
+            observable_names = network.observables
+        self.observable_names = list(observable_names)
+        self._obs = observables
+
+    @property
+    def observables(self):
+        return np.rec.fromarrays(self._obs.T, names=self.observable_names)
+
+    def __getitem__(self, name):
+        """Return the trajectory of an observable or species by name."""
+
+        if name in self.observable_names:
+            return self._obs[:, self.observable_names.index(name)]
+        if self.species is None:
+            raise KeyError(name)
+        return self.species[:, self.network.species_index(name)]
+
+    def flux_summary(self, start=None, stop=None):
+        """Return the flux through each rule between two output times.
+
+        `start` and `stop` default to the first and last output time and are
+        rounded to output times. The result maps every rule name to a dict
+        with the number of reaction events in its forward and reverse
+        direction and their difference ('forward', 'reverse', 'net'),
+        summed over the reactions the rule generated.
+        """
+
+        if self.fluxes is None:
+            raise ValueError("Run the simulation with fluxes=True")
+        i0 = 0 if start is None else np.searchsorted(self.tout, start)
+        i1 = len(self.tout) - 1 if stop is None else \
+            np.searchsorted(self.tout, stop, 'right') - 1
+        total = self.fluxes[i1] - self.fluxes[min(i0, i1)]
+        net = self.network
+        summary = {}
+        for rule, reverse, flux in zip(net.rules, net.reverse, total):
+            entry = summary.setdefault(rule, {'forward': 0., 'reverse': 0.})
+            entry['reverse' if reverse else 'forward'] += flux
+        for entry in summary.values():
+            entry['net'] = entry['forward'] - entry['reverse']
+        return summary
+
+
+def _projection(network, observables=None):
+    """Return the names and matrix projecting species onto observables."""
+
+    if observables is None:
+        return list(network.observables), network.obs_matrix
+    rows = [network.observable_index(name) for name in observables]
+    return list(observables), network.obs_matrix[rows]
+
+def _outputs(network, lead, observables, fluxes, dtype):
+    """Allocate the output arrays of a run: species or observables, and
+    integrated fluxes if asked."""
+
+    width = network.n_species if observables is None else len(observables)
+    dtype = float if dtype is None else dtype
+    out = np.empty(lead + (width,), dtype=dtype)
+    flux = np.empty(lead + (network.n_reactions,), dtype=dtype) \
+        if fluxes else None
+    return out, flux
+
+def _record(network, out, flux, i, block, proj=None):
+    """Store the states `block` at output index `i`, projected onto
+    observables by `proj` if given."""
+
+    n = network.n_species
+    species = block[..., :n]
+    if proj is not None:
+        species = proj.dot(species.reshape(-1, n).T).T.reshape(
+            species.shape[:-1] + (-1,))
+    out[i:i + len(block)] = species
+    if flux is not None:
+        flux[i:i + len(block)] = block[..., n:]
+
+def _chunks(network, blocks, tspan, chunk_size, observables=None):
+    """Regroup (index, states) blocks into observable-only result chunks.
+
+    `blocks` must cover the indices of `tspan` contiguously and in order.
+    """
+
+    names, proj = _projection(network, observables)
+    buffer = np.empty((chunk_size, len(names)))
+    start = fill = 0
+    for i, block in blocks:
+        values = proj.dot(block.T).T
+        while len(values):
+            n = min(chunk_size - fill, len(values))
+            buffer[fill:fill + n] = values[:n]
+            values = values[n:]
+            fill += n
+            if fill == chunk_size:
+                yield SimulationResult(network, tspan[start:start + fill],
+                                       observables=buffer.copy(),
+                                       observable_names=names)
+                start += fill
+                fill = 0
+    if fill:
+        yield SimulationResult(network, tspan[start:start + fill],
+                               observables=buffer[:fill].copy(),
+                               observable_names=names)
+
+def _with_fluxes(network, y0, fluxes):
+    """Append zero integrated fluxes to initial state(s) `y0` if asked."""
+
+    y0 = np.asarray(y0, dtype=float)
+    if not fluxes:
+        return y0
+    zeros = np.zeros(y0.shape[:-1] + (network.n_reactions,))
+    return np.concatenate([y0, zeros], axis=-1)
+
+def _pack(y, n):
+    """Flatten state(s) `y` for the solver: all species, then all fluxes."""
+
+    if y.shape[-1] == n:
+        return y.ravel()
+    return np.concatenate([y[..., :n].ravel(), y[..., n:].ravel()])
+
+def _unpack(x, shape, n):
+    """Invert :py:func:`_pack` over the last axis of `x`."""
+
+    lead = x.shape[:-1]
+    if shape[-1] == n:
+        return x.reshape(lead + shape)
+    split = x.shape[-1] * n // shape[-1]
+    species = x[..., :split].reshape(lead + shape[:-1] + (n,))
+    flux = x[..., split:].reshape(lead + shape[:-1] + (shape[-1] - n,))
+    return np.concatenate([species, flux], axis=-1)
+
+def _check_tspan(tspan):
+    tspan = np.asarray(tspan, dtype=float)
+    if tspan.ndim != 1 or len(tspan) < 2 or np.any(np.diff(tspan) <= 0):
+        raise ValueError("tspan must be an increasing sequence of at least "
+                         "two times")
+    return tspan
@@ -0,0 +1,428 @@
+"""
+Overview
+========
+
+Canonical labels and a lookup index for the species of a generated network.
+
+Rule expansion itself happens in BioNetGen, but the Python side still has to
+find species: the species of every initial condition when a network is built
+(:py:meth:`anrm.network.Network.from_model`; PySB compares the pattern with
+every species by graph isomorphism), species named by the user (doses,
+seeds, knockouts) and the species matched by a pattern. For complexes such
+as ``Necrosome1``, ``Riptosome_TRADD`` or Bax/Bak pores, a species has many
+equivalent spellings (monomer order, bond numbering, site order), so a
+string comparison is not enough and a scan with isomorphism tests is slow.
+
+This module provides
+
+- :py:func:`parse`, which reads species and patterns written the PySB way
+  (``Bax(bf=1, state='A') % Bax(bf=1, state='A')``) or the BioNetGen way
+  (``Bax(bf!1,state~A).Bax(bf!1,state~A)``),
+- :py:func:`canonical`, a canonical label of a species: the same string for
+  every spelling of the same complex, computed by colour refinement of the
+  monomer graph with individualization of tied monomers (symmetric pores
+  cost a handful of branches, not a permutation search), and cached by the
+  input text,
+- :py:class:`SpeciesIndex`, a hash index from canonical label to species and
+  from monomer and (monomer, site, state) to the species containing them,
+  so that finding a species is a dictionary lookup and matching a pattern
+  only tests the candidates that share all of its monomers and site states.
+"""
+
+import re
+
+import numpy as np
+
+# Bond placeholders in patterns: any bond, or bound or not.
+ANY = '+'
+WILD = '?'
+
+_cache = {}
+_CACHE_MAX = 100000
+
+
+class Monomer(object):
+    """One monomer of a species or pattern.
+
+    `sites` maps site names to (state, bonds) with `state` None if not
+    given and `bonds` a tuple of bond labels (ints, :py:data:`ANY` or
+    :py:data:`WILD`), empty for an unbound site. Sites missing from a
+    pattern are unconstrained.
+    """
+
+    __slots__ = ('name', 'sites', 'compartment')
+
+    def __init__(self, name, sites, compartment=None):
+        self.name = name
+        self.sites = sites
+        self.compartment = compartment
+
+    def __repr__(self):
+        return 'Monomer(%r, %r, %r)' % (self.name, self.sites,
+                                        self.compartment)
+
+
+def parse(text):
+    """Parse a species or pattern into a list of :py:class:`Monomer`.
+
+    Accepts PySB (``A(b=1, s='u') % B(a=1) ** cyto``) and BioNetGen
+    (``A(b!1,s~u).B(a!1)``, ``@cyto:A(...)``) notation.
+    """
+
+    text = text.strip()
+    compartment = None
+    m = re.match(r'^@(\w+)::?', text)
+    if m:
+        compartment = m.group(1)
+        text = text[m.end():]
+    bngl = ' % ' not in text and ('!' in text or '~' in text or
+                                  re.search(r'\)\s*\.\s*\w', text))
+    parts = _split(text, '.' if bngl else '%')
+    monomers = []
+    for part in parts:
+        part = part.strip()
+        comp = compartment
+        m = re.match(r'^(.*?)\s*(?:\*\*\s*(\w+)|@(\w+))$', part)
+        if m and (m.group(2) or m.group(3)):
+            part, comp = m.group(1), m.group(2) or m.group(3)
+        m = re.match(r'^(\w+)\s*(?:\((.*)\))?$', part, re.S)
+        if not m:
+            raise ValueError("Cannot parse monomer '%s' in '%s'" %
+                             (part, text))
+        args = m.group(2) or ''
+        sites = {}
+        for arg in _split(args, ','):
+            arg = arg.strip()
+            if arg:
+                site, state, bonds = (_bngl_site(arg) if bngl
+                                      else _pysb_site(arg))
+                sites[site] = (state, bonds)
+        monomers.append(Monomer(m.group(1), sites, comp))
+    return monomers
+
+def canonical(text):
+    """Return the canonical label of the species written as `text`."""
+
+    label = _cache.get(text)
+    if label is None:
+        label = _label(parse(text))
+        if len(_cache) >= _CACHE_MAX:
+            _cache.clear()
+        _cache[text] = label
+    return label
+
+def matches(pattern, species):
+    """Return whether the parsed `pattern` embeds into the parsed `species`.
+
+    Pattern monomers map to distinct species monomers of the same name and
+    compartment (if given); every site the pattern mentions must have its
+    state and bonding, and bonds shared by two pattern sites must join the
+    corresponding species sites.
+    """
+
+    partner = _partners(species)
+    order = sorted(range(len(pattern)), key=lambda i: len(pattern[i].sites),
+                   reverse=True)
+    pattern_bonds = {}
+    for i, mono in enumerate(pattern):
+        for site, (_, bonds) in mono.sites.items():
+            for b in bonds:
+                if isinstance(b, int):
+                    pattern_bonds.setdefault(b, []).append((i, site))
+
+    def site_ok(pm, sm):
+        if pm.compartment is not None and pm.compartment != sm.compartment:
+            return False
+        for site, (state, bonds) in pm.sites.items():
+            if site not in sm.sites:
+                return False
+            s_state, s_bonds = sm.sites[site]
+            if state is not None and state != s_state:
+                return False
+            if WILD in bonds:
+                continue
+            if not bonds and s_bonds:
+                return False
+            if bonds and len(s_bonds) < len(bonds):
+                return False
+        return True
+
+    def extend(k, mapping, used):
+        if k == len(order):
+            return _bonds_consistent(pattern_bonds, mapping, partner)
+        i = order[k]
+        for j, sm in enumerate(species):
+            if j not in used and sm.name == pattern[i].name and \
+                    site_ok(pattern[i], sm):
+                mapping[i] = j
+                used.add(j)
+                if extend(k + 1, mapping, used):
+                    return True
+                used.discard(j)
+                del mapping[i]
+        return False
+
+    return extend(0, {}, set())
+
+
+class SpeciesIndex(object):
+    """Hash indexes over the species of a network.
+
+    Parameters
+    ----------
+    species : list of strings
+        Species, as generated by BioNetGen (any notation :py:func:`parse`
+        reads).
+    """
+
+    def __init__(self, species):
+        self.species = list(species)
+        self._parsed = [parse(s) for s in self.species]
+        self._label = {}
+        self._by_monomer = {}
+        self._by_site = {}
+        for i, monomers in enumerate(self._parsed):
+            self._label.setdefault(_label(monomers), i)
+            for mono in monomers:
+                self._by_monomer.setdefault(mono.name, set()).add(i)
+                for site, (state, bonds) in mono.sites.items():
+                    for key in _site_keys(mono.name, site, state, bonds):
+                        self._by_site.setdefault(key, set()).add(i)
+
+    def index(self, text):
+        """Return the index of the species written as `text`, or None."""
+
+        return self._label.get(canonical(text))
+
+    def with_monomer(self, name):
+        """Return the indices of the species containing monomer `name`."""
+
+        return np.array(sorted(self._by_monomer.get(name, ())),
+                        dtype=np.intp)
+
+    def candidates(self, pattern):
+        """Return the species that contain every monomer, site state and
+        bond status of `pattern` (text or parsed); a superset of
+        :py:meth:`match`."""
+
+        if isinstance(pattern, str):
+            pattern = parse(pattern)
+        sets = []
+        for mono in pattern:
+            sets.append(self._by_monomer.get(mono.name, set()))
+            for site, (state, bonds) in mono.sites.items():
+                for key in _site_keys(mono.name, site, state, bonds):
+                    sets.append(self._by_site.get(key, set()))
+        if not sets:
+            return set(range(len(self.species)))
+        sets.sort(key=len)
+        found = set(sets[0])
+        for s in sets[1:]:
+            found &= s
+            if not found:
+                break
+        return found
+
+    def match(self, pattern):
+        """Return the sorted indices of the species matched by `pattern`."""
+
+        if isinstance(pattern, str):
+            pattern = parse(pattern)
+        return np.array(sorted(i for i in self.candidates(pattern)
+                               if matches(pattern, self._parsed[i])),
+                        dtype=np.intp)
+
+
+# Canonical labels
+# ================
+
+def _label(monomers):
+    """Canonical label of a parsed species (see :py:func:`canonical`)."""
+
+    n = len(monomers)
+    partner = _partners(monomers)
+    # Edges as (site, neighbour, neighbour site), per monomer
+    edges = [[] for _ in range(n)]
+    for (i, site), others in partner.items():
+        for j, other_site in others:
+            edges[i].append((site, j, other_site))
+    base = [(m.name, m.compartment or '',
+             tuple(sorted((s, st or '', len(b))
+                          for s, (st, b) in m.sites.items())))
+            for m in monomers]
+    ranks = _refine(_rank(base), edges)
+    best = None
+    for order in _orderings(ranks, edges):
+        text = _write(monomers, order, partner)
+        if best is None or text < best:
+            best = text
+    return best
+
+def _rank(keys):
+    """Replace sortable keys by their dense ranks."""
+
+    table = dict((k, r) for r, k in enumerate(sorted(set(keys))))
+    return [table[k] for k in keys]
+
+def _refine(ranks, edges):
+    """Colour refinement: split ranks by the ranks of bonded neighbours."""
+
+    while True:
+        keys = [(ranks[i], tuple(sorted((s, ranks[j], t)
+                                        for s, j, t in edges[i])))
+                for i in range(len(ranks))]
+        new = _rank(keys)
+        if len(set(new)) == len(set(ranks)):
+            return new
+        ranks = new
+
+def _orderings(ranks, edges):
+    """Yield the monomer orders left after individualization-refinement."""
+
+    counts = {}
+    for r in ranks:
+        counts[r] = counts.get(r, 0) + 1
+    tied = [r for r in sorted(counts) if counts[r] > 1]
+    if not tied:
+        yield sorted(range(len(ranks)), key=lambda i: ranks[i])
+        return
+    cell = tied[0]
+    for i in [i for i in range(len(ranks)) if ranks[i] == cell]:
+        # Put monomer i in a cell of its own, just before its old one
+        split = [2 * r + (0 if (j == i or r != cell) else 1)
+                 for j, r in enumerate(ranks)]
+        for order in _orderings(_refine(_rank(split), edges), edges):
+            yield order
+
+def _write(monomers, order, partner):
+    """Write the species with monomers in `order` and bonds renumbered by
+    first appearance."""
+
+    position = dict((i, p) for p, i in enumerate(order))
+    bond_of = {}
+    labels = {}
+    for p, i in enumerate(order):
+        for site in sorted(monomers[i].sites):
+            for j, other in sorted(partner.get((i, site), ()),
+                                   key=lambda e: (position[e[0]], e[1])):
+                key = frozenset([(i, site), (j, other)])
+                if key not in labels:
+                    labels[key] = len(labels) + 1
+                bond_of.setdefault((i, site), []).append(labels[key])
+    parts = []
+    for i in order:
+        m = monomers[i]
+        args = []
+        for site in sorted(m.sites):
+            state, bonds = m.sites[site]
+            numbered = sorted(bond_of.get((i, site), []))
+            bond = [str(b) for b in numbered] + \
+                [b for b in bonds if not isinstance(b, int)]
+            text = site
+            if state is not None:
+                text += '~' + state
+            for b in bond:
+                text += '!' + b
+            args.append(text)
+        comp = '@' + m.compartment if m.compartment else ''
+        parts.append('%s(%s)%s' % (m.name, ','.join(args), comp))
+    return '.'.join(parts)
+
+def _partners(monomers):
+    """Map (monomer, site) to the (monomer, site) pairs bonded to it."""
+
+    ends = {}
+    for i, m in enumerate(monomers):
+        for site, (_, bonds) in m.sites.items():
+            for b in bonds:
+                if isinstance(b, int):
+                    ends.setdefault(b, []).append((i, site))
+    partner = {}
+    for b, pair in ends.items():
+        if len(pair) != 2:
+            continue
+        (i, s), (j, t) = pair
+        partner.setdefault((i, s), []).append((j, t))
+        partner.setdefault((j, t), []).append((i, s))
+    return partner
+
+def _bonds_consistent(pattern_bonds, mapping, partner):
+    for ends in pattern_bonds.values():
+        if len(ends) != 2:
+            continue
+        (i, s), (j, t) = ends
+        if (mapping[j], t) not in partner.get((mapping[i], s), ()):
+            return False
+    return True
+
+def _site_keys(name, site, state, bonds):
+    """Index keys of a site: its state, and whether it is bound."""
+
+    keys = []
+    if state is not None:
+        keys.append((name, site, 'state', state))
+    if WILD not in bonds:
+        keys.append((name, site, 'bound', bool(bonds)))
+    return keys
+
+
+# Parsing
+# =======
+
+def _split(text, sep):
+    """Split `text` at `sep` outside brackets and quotes."""
+
+    parts, depth, quote, start = [], 0, None, 0
+    for i, c in enumerate(text):
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c in '([':
+            depth += 1
+        elif c in ')]':
+            depth -= 1
+        elif c == sep and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+def _pysb_value(value):
+    value = value.strip()
+    if value == 'None':
+        return None, ()
+    if value == 'ANY':
+        return None, (ANY,)
+    if value == 'WILD':
+        return None, (WILD,)
+    if re.match(r'^\d+$', value):
+        return None, (int(value),)
+    if value[:1] in '\'"':
+        return value[1:-1], ()
+    if re.match(r'^\w+$', value):
+        return value, ()
+    if value[:1] == '(':
+        state, bond = _split(value[1:-1], ',')
+        return _pysb_value(state)[0], _pysb_value(bond)[1]
+    if value[:1] == '[':
+        bonds = ()
+        for v in _split(value[1:-1], ','):
+            bonds += _pysb_value(v)[1]
+        return None, bonds
+    raise ValueError("Cannot parse site value '%s'" % value)
+
+def _pysb_site(arg):
+    site, _, value = arg.partition('=')
+    state, bonds = _pysb_value(value)
+    return site.strip(), state, bonds
+
+def _bngl_site(arg):
+    m = re.match(r'^(\w+)((?:~\w+)?)((?:![\w+?]+)*)$', arg)
+    if not m:
+        raise ValueError("Cannot parse site '%s'" % arg)
+    state = m.group(2)[1:] or None
+    bonds = tuple(int(b) if b.isdigit() else b
+                  for b in m.group(3).split('!')[1:])
+    return m.group(1), state, bonds
@@ -0,0 +1,273 @@
+"""
+Overview
+========
+
+Stochastic simulation of ANRM models with Gillespie's direct method.
+
+The ANRM rate constants are already expressed per molecule per cell, so the
+stochastic propensity of a reaction is its deterministic rate with the
+reactant amounts replaced by falling factorials (``n*(n-1)`` for a species
+that appears twice among the reactants).
+
+:py:class:`StochasticSimulator` mirrors :py:class:`~anrm.simulator.Simulator`:
+:py:meth:`~StochasticSimulator.run` returns a full trajectory, and
+:py:meth:`~StochasticSimulator.stream` yields observable-only chunks. For
+large ensembles, :py:meth:`~StochasticSimulator.ensemble` yields one such
+stream per cell, lazily, so that statistics can be accumulated with the
+reducers in :py:mod:`anrm.reducers` in constant memory::
+
+    sim = StochasticSimulator(model, seed=1)
+    moments = Moments(['Obs_cPARP', 'Obs_aPARP'])
+    reduce_ensemble(sim.ensemble(1000, tspan), [moments])
+
+Random streams
+--------------
+
+Every cell of an ensemble has its own random stream. It is spawned from the
+simulator's seed with the cell index as spawn key (``SeedSequence(seed,
+spawn_key=(cell,))``), so a cell's trajectory depends only on the seed and
+its index. It does not depend on which other cells run, in what order, in
+how many processes or on how many nodes. :py:func:`simulate_cells` spreads
+an ensemble over a process pool with identical results for any number of
+workers, and one suspicious cell of a large population can be rerun alone::
+
+    values = simulate_cells(network, range(10 ** 6), tspan, seed=7,
+                            processes=64)
+    StochasticSimulator(network, seed=7).run(tspan, cell=123456)
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from anrm.network import Network
+from anrm.simulator import (SimulationResult, _check_tspan, _chunks,
+                            _projection)
+
+
+class StochasticSimulator(object):
+    """Gillespie SSA for a PySB model or a generated :py:class:`Network`.
+
+    Parameters
+    ----------
+    model : pysb.Model or Network
+        Model to simulate.
+    seed : int or numpy.random.Generator, optional
+        Seed of the per-cell random streams (see the module docstring) and
+        of the generator shared by runs without a cell index. A fresh seed
+        is drawn if None; it is kept in :py:attr:`seed`.
+    jit : bool
+        Run the whole SSA loop as a compiled Numba kernel (see
+        :py:mod:`anrm.jit`), if Numba is installed. Each trajectory then
+        draws its own seed from the generator, so runs stay reproducible
+        but differ from the NumPy ones.
+    """
+
+    def __init__(self, model, seed=None, jit=False):
+        if isinstance(model, Network):
+            self.network = model
+        else:
+            self.network = Network.from_model(model)
+        if isinstance(seed, np.random.Generator):
+            seed = int(seed.integers(2 ** 63))
+        elif seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self._kernels = None
+        if jit:
+            from anrm import jit as _jit
+            self._kernels = _jit.kernels(self.network)
+
+        net = self.network
+        # Number of earlier slots holding the same reactant, so that a
+        # species appearing twice contributes n*(n-1).
+        reactants = net.reactants
+        self._offsets = np.zeros(reactants.shape)
+        for p in range(1, reactants.shape[1]):
+            self._offsets[:, p] = (reactants[:, :p] ==
+                                   reactants[:, p:p + 1]).sum(axis=1)
+        self._offsets[reactants == net.n_species] = 0.
+        # Species changes of each reaction, for the state update.
+        S = net.stoichiometry.tocsc()
+        self._changes = [(S.indices[S.indptr[j]:S.indptr[j + 1]],
+                          S.data[S.indptr[j]:S.indptr[j + 1]])
+                         for j in range(net.n_reactions)]
+
+    def propensities(self, y, k):
+        """Return the propensity of every reaction in state `y`."""
+
+        yext = np.append(y, 1.0)
+        counts = np.maximum(yext[self.network.reactants] - self._offsets, 0.)
+        return k * counts.prod(axis=1)
+
+    def cell_rng(self, cell):
+        """Return a new generator at the start of the stream of `cell`."""
+
+        return np.random.default_rng(
+            np.random.SeedSequence(self.seed, spawn_key=(int(cell),)))
+
+    def run(self, tspan, param_values=None, y0=None, cell=None):
+        """Simulate one cell and return a :py:class:`SimulationResult`.
+
+        With a `cell` index, the cell's own random stream is used, and the
+        trajectory is the one that cell has in any ensemble with the same
+        seed.
+        """
+
+        tspan = _check_tspan(tspan)
+        species = np.empty((len(tspan), self.network.n_species))
+        for i, block in self._sample(tspan, param_values, y0,
+                                     self._rng_for(cell)):
+            species[i] = block[0]
+        return SimulationResult(self.network, tspan, species=species)
+
+    def stream(self, tspan, param_values=None, y0=None, chunk_size=100,
+               observables=None, cell=None):
+        """Simulate one cell, yielding observable-only chunks.
+
+        See :py:meth:`anrm.simulator.Simulator.stream` and, for `cell`,
+        :py:meth:`run`.
+        """
+
+        tspan = _check_tspan(tspan)
+        blocks = self._sample(tspan, param_values, y0, self._rng_for(cell))
+        return _chunks(self.network, blocks, tspan, chunk_size, observables)
+
+    def ensemble(self, cells, tspan, param_values=None, y0=None,
+                 chunk_size=100, observables=None):
+        """Yield one chunk stream per cell.
+
+        `cells` is the number of cells (indices 0 to `cells` - 1) or a
+        sequence of cell indices. Cells are simulated only as their streams
+        are consumed, one after the other, each with its own random stream.
+        """
+
+        if isinstance(cells, (int, np.integer)):
+            cells = range(cells)
+        for cell in cells:
+            yield self.stream(tspan, param_values, y0, chunk_size,
+                              observables, cell)
+
+    def run_cells(self, cells, tspan, param_values=None, y0=None,
+                  observables=None):
+        """Simulate the given cell indices and return their observables
+        as an array (cells, times, observables)."""
+
+        tspan = _check_tspan(tspan)
+        names, proj = _projection(self.network, observables)
+        values = np.empty((len(cells), len(tspan), len(names)))
+        for c, cell in enumerate(cells):
+            for i, block in self._sample(tspan, param_values, y0,
+                                         self.cell_rng(cell)):
+                values[c, i] = proj.dot(block[0])
+        return values
+
+    def _rng_for(self, cell):
+        return self.rng if cell is None else self.cell_rng(cell)
+
+    def _sample(self, tspan, param_values=None, y0=None, rng=None):
+        """Yield (index, state) for each output time of one SSA trajectory."""
+
+        net = self.network
+        params = net.param_vector(param_values)
+        k = net.rate_constants(params)
+        if y0 is None:
+            y0 = net.initial_state(params)
+        if rng is None:
+            rng = self.rng
+        if self._kernels is not None:
+            seed = rng.integers(2 ** 31)
+            states = self._kernels.ssa(y0, k, tspan, seed)
+            for i in range(len(tspan)):
+                yield i, states[i:i + 1]
+            return
+        y = np.round(y0)
+
+        t = tspan[0]
+        i = 0
+        while i < len(tspan):
+            a = self.propensities(y, k)
+            a0 = a.sum()
+            t_next = t + rng.exponential(1. / a0) if a0 > 0 else np.inf
+            # The state is constant until the next reaction fires
+            while i < len(tspan) and tspan[i] < t_next:
+                yield i, y[None, :].copy()
+                i += 1
+            if i == len(tspan):
+                break
+            j = np.searchsorted(np.cumsum(a), rng.random() * a0, 'right')
+            j = min(j, net.n_reactions - 1)
+            index, delta = self._changes[j]
+            y[index] += delta
+            t = t_next
+
+
+# Parallel ensembles
+# ==================
+
+# Simulator and arguments of the current pool worker.
+_worker = None
+
+def _init_worker(network, seed, jit, args):
+    global _worker
+    _worker = (StochasticSimulator(network, seed=seed, jit=jit), args)
+
+def _pool_cells(cells):
+    sim, args = _worker
+    return sim.run_cells(cells, *args)
+
+def simulate_cells(network, cells, tspan, param_values=None, y0=None,
+                   seed=0, observables=None, processes=None, chunk_size=100,
+                   jit=False, threads=False):
+    """Simulate an ensemble of cells on a process pool.
+
+    Parameters
+    ----------
+    network : anrm.network.Network
+        Network to simulate.
+    cells : int or sequence of ints
+        Number of cells, or the indices of the cells to simulate.
+    seed : int
+        Seed of the per-cell random streams. Each cell's trajectory depends
+        only on `seed` and its index, not on `processes` or `chunk_size`.
+    processes : int, optional
+        Worker processes (or threads); 0 runs in the calling process.
+    chunk_size : int
+        Cells per task.
+    jit : bool
+        Run the compiled SSA loop of :py:mod:`anrm.jit` if available.
+    threads : bool
+        Use a thread pool sharing one simulator and network instead of a
+        process pool. This pays off with `jit`, as the compiled loop runs
+        without the GIL.
+
+    The other parameters are those of :py:meth:`StochasticSimulator.run`.
+    Returns the observables as an array (cells, times, observables).
+    """
+
+    if isinstance(cells, (int, np.integer)):
+        cells = range(cells)
+    cells = np.asarray(cells, dtype=np.int64)
+    tspan = _check_tspan(tspan)
+    args = (tspan, param_values, y0, observables)
+    if processes == 0:
+        sim = StochasticSimulator(network, seed=seed, jit=jit)
+        return sim.run_cells(cells, *args)
+    chunks = [cells[i:i + chunk_size]
+              for i in range(0, len(cells), chunk_size)]
+    if threads:
+        # Cells only draw from their own streams, so the threads can share
+        # one simulator
+        sim = StochasticSimulator(network, seed=seed, jit=jit)
+        with ThreadPoolExecutor(processes) as pool:
+            results = list(pool.map(lambda c: sim.run_cells(c, *args),
+                                    chunks))
+    else:
+        with ProcessPoolExecutor(processes, initializer=_init_worker,
+                                 initargs=(network, seed, jit, args)) as pool:
+            results = list(pool.map(_pool_cells, chunks))
+    if not results:
+        names, _ = _projection(network, observables)
+        return np.zeros((0, len(tspan), len(names)))
+    return np.concatenate(results, axis=0)
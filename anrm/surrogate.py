@@ -0,0 +1,391 @@
+"""
+Overview
+========
+
+A Gaussian-process emulator of the fate decision, for fast screening.
+
+Even batched, a full ANRM simulation takes milliseconds to seconds, which is
+too slow to explore a high-dimensional parameter space interactively.
+:py:class:`FateEmulator` learns the map from (log10) Parameter values to
+
+- the fate of the cell (see :py:mod:`anrm.fate`),
+- its time of death, and
+- the final fractions of cleaved and active PARP
+
+from full simulations, and then answers queries in microseconds per point.
+
+The emulator is a NumPy-only Gaussian process (:py:class:`GaussianProcess`)
+with an anisotropic squared-exponential kernel on the unit cube spanned by
+the Parameter bounds. Fates are emulated as one-hot scores that share one
+kernel matrix; the margin between the best and second-best score, in units
+of the predictive standard deviation, measures how sure the emulator is.
+Points whose margin is below `confidence` are sent to the full model by
+:py:meth:`FateEmulator.screen`.
+
+Training starts from a Latin hypercube design and is refined by active
+learning: :py:meth:`FateEmulator.refine` simulates the candidates closest to
+a fate boundary (by default any boundary, or e.g. only the
+apoptosis/necrosis one), spread out so that one round does not pile up on a
+single spot. :py:meth:`FateEmulator.error_report` compares the emulator to
+fresh simulations::
+
+    emu = FateEmulator(network, tspan, ['flip_S_0', 'XIAP_0', 'RIP1_0'],
+                       bounds=[(2, 5), (3, 6), (3, 5)], backend=backend)
+    emu.train(200)
+    for _ in range(5):
+        emu.refine(50, between=(APOPTOSIS, NECROSIS))
+    emu.error_report(500)
+    fates, times, simulated = emu.screen(theta)
+"""
+
+import numpy as np
+import scipy.linalg as linalg
+import scipy.optimize as optimize
+
+from anrm.fate import FAILED, FATE_NAMES, SURVIVAL, FateClassifier
+from anrm.sweep import run_chunks
+
+
+def latin_hypercube(n, dim, rng):
+    """Return `n` points of a random Latin hypercube in the unit cube."""
+
+    u = (rng.random((n, dim)) + np.arange(n)[:, None]) / n
+    for j in range(dim):
+        u[:, j] = u[rng.permutation(n), j]
+    return u
+
+
+class GaussianProcess(object):
+    """Gaussian-process regression with a shared kernel for all outputs.
+
+    The kernel is ``s2 * exp(-0.5 * sum(((x - x') / lengthscales) ** 2))``
+    plus `noise` on the diagonal, on outputs standardized column by column.
+    Lengthscales and noise are fitted by maximizing the marginal likelihood
+    summed over the outputs.
+    """
+
+    def __init__(self, lengthscales=None, noise=1e-4):
+        self.lengthscales = lengthscales
+        self.noise = noise
+
+    def _kernel(self, a, b, lengthscales):
+        a = a / lengthscales
+        b = b / lengthscales
+        d2 = ((a ** 2).sum(1)[:, None] + (b ** 2).sum(1)[None, :] -
+              2 * a.dot(b.T))
+        return np.exp(-0.5 * np.maximum(d2, 0.))
+
+    def _neg_log_marginal(self, log_hyper, x, y):
+        lengthscales, noise = np.exp(log_hyper[:-1]), np.exp(log_hyper[-1])
+        k = self._kernel(x, x, lengthscales)
+        k[np.diag_indices_from(k)] += noise + 1e-10
+        try:
+            factor = linalg.cho_factor(k, lower=True)
+        except linalg.LinAlgError:
+            return np.inf
+        alpha = linalg.cho_solve(factor, y)
+        logdet = 2 * np.log(np.diag(factor[0])).sum()
+        return 0.5 * ((y * alpha).sum() + y.shape[1] * logdet)
+
+    def fit(self, x, y, optimize_hyper=True):
+        """Condition on inputs `x` (n x dim) and outputs `y` (n or n x m)."""
+
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.squeeze = y.ndim == 1
+        y = y.reshape(len(x), -1)
+        self.mean = y.mean(axis=0)
+        self.scale = y.std(axis=0)
+        self.scale[self.scale == 0] = 1.
+        z = (y - self.mean) / self.scale
+        if self.lengthscales is None:
+            self.lengthscales = np.full(x.shape[1], 0.3)
+        if optimize_hyper and len(x) > 1:
+            start = np.log(np.append(self.lengthscales, self.noise))
+            bounds = [(np.log(1e-2), np.log(1e1))] * x.shape[1] + \
+                [(np.log(1e-8), np.log(1.))]
+            best = optimize.minimize(self._neg_log_marginal, start, (x, z),
+                                     method='L-BFGS-B', bounds=bounds)
+            if np.isfinite(best.fun):
+                self.lengthscales = np.exp(best.x[:-1])
+                self.noise = float(np.exp(best.x[-1]))
+        k = self._kernel(x, x, self.lengthscales)
+        k[np.diag_indices_from(k)] += self.noise + 1e-10
+        self._factor = linalg.cho_factor(k, lower=True)
+        self._alpha = linalg.cho_solve(self._factor, z)
+        self.x = x
+        return self
+
+    def predict(self, x):
+        """Return the predictive mean and standard deviation at `x`.
+
+        The standard deviation is per point and, like the kernel, shared by
+        all outputs (in standardized units); multiply by :py:attr:`scale`
+        for the spread of one output.
+        """
+
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        ks = self._kernel(x, self.x, self.lengthscales)
+        mean = ks.dot(self._alpha) * self.scale + self.mean
+        v = linalg.solve_triangular(self._factor[0], ks.T, lower=True)
+        std = np.sqrt(np.maximum(1. + self.noise - (v ** 2).sum(axis=0), 0.))
+        if self.squeeze:
+            mean = mean[:, 0]
+        return mean, std
+
+
+class FateSummary(FateClassifier):
+    """Sweep reduction to fates, times of death and final PARP fractions."""
+
+    def __call__(self, tspan, observables, params, values):
+        fates, times = FateClassifier.__call__(self, tspan, observables,
+                                               params, values)
+        parp_0 = params[:, self.parp_index]
+        cparp = values[:, -1, observables.index(self.cparp)] / parp_0
+        aparp = values[:, -1, observables.index(self.aparp)] / parp_0
+        return fates, times, cparp, aparp
+
+
+class FateEmulator(object):
+    """Emulator of fate, time of death and PARP summaries of a network.
+
+    Parameters
+    ----------
+    network : anrm.network.Network
+        Network to emulate.
+    tspan : array of floats
+        Output times of the training simulations.
+    parameters : list of strings
+        Emulated Parameters, varied as log10 values.
+    bounds : list of (low, high)
+        log10 range of each Parameter; the emulator is not meant to be
+        queried outside it.
+    param_values : dict, optional
+        Values of the other Parameters.
+    threshold : float
+        Fraction of PARP cleaved or activated at death.
+    confidence : float
+        Smallest fate margin, in predictive standard deviations, at which
+        :py:meth:`screen` trusts the emulator.
+    backend : optional
+        Sweep backend for the full simulations.
+    chunk_size : int
+        Simulations integrated together as one batch.
+    seed : int, optional
+        Seed of the design and candidate sampling.
+    """
+
+    def __init__(self, network, tspan, parameters, bounds, param_values=None,
+                 threshold=0.5, confidence=2., backend=None, chunk_size=64,
+                 seed=None, rtol=1e-3, atol=1e-6):
+        self.network = network
+        self.tspan = np.asarray(tspan, dtype=float)
+        self.parameters = list(parameters)
+        self.bounds = np.asarray(bounds, dtype=float).reshape(-1, 2)
+        self.base = network.param_vector(param_values)
+        self.index = [network.param_index(p) for p in self.parameters]
+        self.summary = FateSummary(network, threshold)
+        self.confidence = confidence
+        self.backend = backend
+        self.chunk_size = chunk_size
+        self.rng = np.random.default_rng(seed)
+        self.rtol = rtol
+        self.atol = atol
+        self.theta = np.zeros((0, len(self.parameters)))
+        self.fates = np.zeros(0, dtype=np.int8)
+        self.death_times = np.zeros(0)
+        self.parp = np.zeros((0, 2))
+        self.n_simulations = 0
+        self.n_failed = 0
+        self._fate_gp = None
+        self._time_gp = None
+
+    def _unit(self, theta):
+        low, high = self.bounds[:, 0], self.bounds[:, 1]
+        return (np.atleast_2d(theta) - low) / (high - low)
+
+    def _sample(self, n, design=False):
+        u = (latin_hypercube(n, len(self.parameters), self.rng) if design
+             else self.rng.random((n, len(self.parameters))))
+        return self.bounds[:, 0] + u * (self.bounds[:, 1] - self.bounds[:, 0])
+
+    def simulate(self, theta):
+        """Run the full model at log10 values `theta`.
+
+        Returns (fates, death times, final PARP fractions).
+        """
+
+        theta = np.atleast_2d(theta)
+        params = np.tile(self.base, (len(theta), 1))
+        params[:, self.index] = 10. ** theta
+        chunks = (params[i:i + self.chunk_size]
+                  for i in range(0, len(params), self.chunk_size))
+        fates, times, cparp, aparp = run_chunks(
+            self.network, chunks, self.tspan,
+            [self.summary.cparp, self.summary.aparp], self.backend,
+            self.rtol, self.atol, reduce=self.summary)
+        self.n_simulations += len(theta)
+        return fates, times.astype(float), np.column_stack([cparp, aparp])
+
+    def add(self, theta, fates, death_times, parp):
+        """Add simulated points to the training set (call :py:meth:`fit`)."""
+
+        self.theta = np.vstack([self.theta, np.atleast_2d(theta)])
+        self.fates = np.concatenate([self.fates, fates])
+        self.death_times = np.concatenate([self.death_times, death_times])
+        self.parp = np.vstack([self.parp, parp])
+
+    def fit(self):
+        """Fit the fate and time-of-death processes to the training set.
+
+        Points whose simulation failed (FAILED fate, NaN PARP fractions)
+        are left out; their number is kept in `n_failed`.
+        """
+
+        ok = np.all(np.isfinite(self.parp), axis=1) & (self.fates != FAILED)
+        self.n_failed = int((~ok).sum())
+        x = self._unit(self.theta[ok])
+        onehot = np.eye(len(FATE_NAMES))[self.fates[ok]]
+        self._fate_gp = GaussianProcess().fit(
+            x, np.column_stack([onehot, self.parp[ok]]))
+        times = self.death_times[ok]
+        dead = (self.fates[ok] != SURVIVAL) & np.isfinite(times)
+        if dead.sum() > 1:
+            self._time_gp = GaussianProcess().fit(
+                x[dead], np.log(np.maximum(times[dead],
+                                           self.tspan[1] - self.tspan[0])))
+        else:
+            self._time_gp = None
+        return self
+
+    def train(self, n):
+        """Simulate a Latin hypercube design of `n` points and fit to it."""
+
+        theta = self._sample(n, design=True)
+        self.add(theta, *self.simulate(theta))
+        return self.fit()
+
+    def refine(self, n, n_candidates=None, between=None):
+        """One round of active learning: simulate `n` boundary points.
+
+        Among `n_candidates` random candidates, those with the smallest fate
+        margin are selected, greedily keeping each new point as far as
+        possible from those already chosen. With `between` a pair of fate
+        codes, the margin is taken between these two fates only, e.g.
+        ``(APOPTOSIS, NECROSIS)`` to resolve the apoptosis/necrosis
+        boundary.
+        """
+
+        if n_candidates is None:
+            n_candidates = 50 * n
+        candidates = self._sample(n_candidates)
+        mean, std = self._fate_gp.predict(self._unit(candidates))
+        margin = np.abs(self._margin(mean, std, between))
+        pool = candidates[np.argsort(margin)[:4 * n]]
+        u = self._unit(pool)
+        chosen = [0]
+        distance = np.full(len(pool), np.inf)
+        while len(chosen) < min(n, len(pool)):
+            distance = np.minimum(distance,
+                                  ((u - u[chosen[-1]]) ** 2).sum(axis=1))
+            chosen.append(int(np.argmax(distance)))
+        theta = pool[chosen]
+        self.add(theta, *self.simulate(theta))
+        return self.fit()
+
+    def _margin(self, mean, std, between=None):
+        """Fate margin in predictive standard deviations."""
+
+        scores = mean[:, :len(FATE_NAMES)]
+        top = np.sort(scores, axis=1)
+        diff = top[:, -1] - top[:, -2]
+        if between is not None:
+            # Only points whose two likeliest fates are the pair lie near
+            # that boundary
+            a, b = between
+            pair = np.argsort(scores, axis=1)[:, -2:]
+            near = ((pair == a) | (pair == b)).all(axis=1)
+            diff = np.where(near, diff, np.inf)
+        spread = np.sqrt(2.) * std * self._fate_gp.scale[:len(FATE_NAMES)].max()
+        return diff / np.maximum(spread, 1e-12)
+
+    def predict(self, theta):
+        """Emulate the model at log10 values `theta`.
+
+        Returns a dict with 'fates', 'death_times' (NaN for survivors),
+        'cparp' and 'aparp' (final fractions of PARP), 'margin' and
+        'confident' (margin at least :py:attr:`confidence`).
+        """
+
+        theta = np.atleast_2d(theta)
+        mean, std = self._fate_gp.predict(self._unit(theta))
+        scores = mean[:, :len(FATE_NAMES)]
+        fates = np.argmax(scores, axis=1).astype(np.int8)
+        margin = self._margin(mean, std)
+        times = np.full(len(theta), np.nan)
+        dead = fates != SURVIVAL
+        if self._time_gp is not None and dead.any():
+            times[dead] = np.exp(self._time_gp.predict(
+                self._unit(theta[dead]))[0])
+        return {'fates': fates, 'death_times': times,
+                'cparp': np.clip(mean[:, len(FATE_NAMES)], 0., 1.),
+                'aparp': np.clip(mean[:, len(FATE_NAMES) + 1], 0., 1.),
+                'margin': margin, 'confident': margin >= self.confidence}
+
+    def screen(self, theta):
+        """Fates and times of death, from the full model where uncertain.
+
+        Returns (fates, death times, simulated), where `simulated` marks the
+        points that were run with the full model. Points whose simulation
+        failed have the fate FAILED.
+        """
+
+        theta = np.atleast_2d(theta)
+        pred = self.predict(theta)
+        fates, times = pred['fates'], pred['death_times']
+        simulated = ~pred['confident']
+        if simulated.any():
+            f, t, _ = self.simulate(theta[simulated])
+            fates[simulated] = f
+            times[simulated] = t
+        return fates, times, simulated
+
+    def error_report(self, n=200, theta=None):
+        """Compare the emulator with fresh full simulations.
+
+        Tests on `theta` if given, else on `n` random points. Returns a dict
+        with the fate accuracy overall and on confident points, the fraction
+        of confident points, the fate confusion matrix (rows: model, columns:
+        emulator), the median relative error of the time of death of cells
+        that both call dead, and the RMS error of the final PARP fractions.
+        Points whose simulation failed are left out of all of these and
+        counted under 'failed'.
+        """
+
+        theta = self._sample(n) if theta is None else np.atleast_2d(theta)
+        fates, times, parp = self.simulate(theta)
+        pred = self.predict(theta)
+        ok = fates != FAILED
+        failed = int((~ok).sum())
+        fates, times, parp = fates[ok], times[ok], parp[ok]
+        pred = dict((key, value[ok]) for key, value in pred.items())
+        k = len(FATE_NAMES)
+        confusion = np.zeros((k, k), dtype=int)
+        np.add.at(confusion, (fates, pred['fates']), 1)
+        right = fates == pred['fates']
+        confident = pred['confident']
+        both_dead = (fates != SURVIVAL) & (pred['fates'] != SURVIVAL)
+        rel = np.abs(pred['death_times'][both_dead] - times[both_dead]) / \
+            times[both_dead]
+        emulated = np.column_stack([pred['cparp'], pred['aparp']])
+        return {'n': len(theta),
+                'failed': failed,
+                'accuracy': float(right.mean()),
+                'confident_fraction': float(confident.mean()),
+                'confident_accuracy': (float(right[confident].mean())
+                                       if confident.any() else np.nan),
+                'confusion': confusion,
+                'death_time_error': (float(np.median(rel))
+                                     if len(rel) else np.nan),
+                'parp_rmse': np.sqrt(((emulated - parp) ** 2).mean(axis=0)),
+                'training_points': len(self.theta)}
@@ -0,0 +1,634 @@
+"""
+Overview
+========
+
+Parameter sweeps over a generated network, on one node or many.
+
+:py:func:`run_sweep` splits a list of parameter sets into chunks, simulates
+every chunk with :py:meth:`anrm.simulator.Simulator.run_batch` and assembles
+the observables of all sets into one array. Where the chunks run is decided
+by a backend:
+
+- :py:class:`SerialBackend` -- in the calling process,
+- :py:class:`PoolBackend` -- in a local process pool; every worker receives
+  the network once, when it starts,
+- :py:class:`ThreadBackend` -- in a thread pool of the calling process;
+  all threads share one network, and with compiled kernels (see
+  :py:mod:`anrm.jit`) the right-hand side and Jacobian run without the GIL,
+- :py:class:`QueueBackend` -- through a :py:class:`WorkQueue` that any
+  number of nodes drain with :py:func:`work`.
+
+The work queue hands out chunks under time-limited leases. A chunk whose
+worker fails is retried (up to `max_attempts` times); a chunk whose worker
+disappears is handed out again once its lease expires. Results are committed
+idempotently, keyed by sweep and chunk, so a late duplicate commit is a
+no-op and finished chunks are never recomputed -- a sweep can be resubmitted
+after an interruption and only the missing chunks will run.
+
+:py:class:`SQLiteWorkQueue` implements the queue in a single SQLite file,
+which is enough for testing and for nodes sharing a filesystem. Each node
+deserializes a sweep's network from the queue once and caches it in a
+node-local file for its worker processes.
+
+Example::
+
+    queue = SQLiteWorkQueue('/shared/screen.db')
+    # on the submitting node
+    result = run_sweep(network, param_sets, tspan, ['Obs_cPARP'],
+                       backend=QueueBackend(queue, sweep_id='cell-lines'))
+    # on every other node
+    work(SQLiteWorkQueue('/shared/screen.db'), processes=32)
+"""
+
+import copy
+import hashlib
+import io
+import os
+import pickle
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+import numpy as np
+
+from anrm.simulator import Simulator
+
+
+def run_sweep(network, param_sets, tspan, observables=None, chunk_size=64,
+              backend=None, rtol=1e-3, atol=1e-6, reduce=None, dtype=None):
+    """Simulate every parameter set and return their observables.
+
+    Parameters
+    ----------
+    network : anrm.network.Network
+        Network to simulate.
+    param_sets : list of dicts, or 2D array
+        Parameter overrides (or full vectors), one per simulation.
+    tspan : array of floats
+        Output times.
+    observables : list of strings, optional
+        Observables to return (default: all).
+    chunk_size : int
+        Number of parameter sets simulated together as one batch.
+    backend : optional
+        Where to run the chunks (default: :py:class:`SerialBackend`).
+    rtol, atol : float
+        Integrator tolerances.
+    reduce : callable, optional
+        Applied to every chunk's output in the worker, see
+        :py:class:`SweepSpec`.
+    dtype : numpy dtype, optional
+        Storage type of the observables, e.g. ``np.float32``; the
+        integration is always in double precision.
+
+    Returns an array of shape (sets, times, observables), or the
+    concatenated outputs of `reduce`.
+    """
+
+    params = np.array([network.param_vector(p) for p in param_sets])
+    chunks = [params[i:i + chunk_size]
+              for i in range(0, len(params), chunk_size)]
+    return run_chunks(network, chunks, tspan, observables, backend, rtol,
+                      atol, reduce, dtype)
+
+def run_chunks(network, chunks, tspan, observables=None, backend=None,
+               rtol=1e-3, atol=1e-6, reduce=None, dtype=None):
+    """Simulate pre-chunked full parameter vectors.
+
+    Like :py:func:`run_sweep`, but `chunks` is an iterable of 2D arrays of
+    full Parameter vectors. It may be a generator: local backends only draw
+    chunks as workers become free, so the parameter sets never all need to
+    be in memory at once.
+    """
+
+    if observables is None:
+        observables = list(network.observables)
+    spec = SweepSpec(network, np.asarray(tspan, dtype=float),
+                     list(observables), rtol, atol, reduce, dtype)
+    if backend is None:
+        backend = SerialBackend()
+    results = backend.run(spec, chunks)
+    if results and isinstance(results[0], tuple):
+        return tuple(np.concatenate(parts, axis=0) for parts in zip(*results))
+    return np.concatenate(results, axis=0)
+
+
+class SweepSpec(object):
+    """Everything but the parameter values needed to simulate a chunk.
+
+    If `reduce` is given, it is called in the worker as
+    ``reduce(tspan, observables, params, values)`` with the chunk's full
+    Parameter vectors and its observables array (sets, times, observables),
+    and its return value (an array, or a tuple of arrays) replaces the
+    observables as the chunk's result. It must be picklable.
+
+    `dtype` is the storage type of the observables (default: float64).
+    """
+
+    def __init__(self, network, tspan, observables, rtol, atol, reduce=None,
+                 dtype=None):
+        self.network = network
+        self.tspan = tspan
+        self.observables = observables
+        self.rtol = rtol
+        self.atol = atol
+        self.reduce = reduce
+        self.dtype = dtype
+
+def simulate_chunk(simulator, spec, params):
+    """Simulate one chunk and apply the spec's reduction, if any.
+
+    If the batch as a whole fails to integrate, its members are retried
+    one by one and those that still fail get NaN observables.
+    """
+
+    try:
+        results = simulator.run_batch(spec.tspan, params,
+                                      observables=spec.observables,
+                                      dtype=spec.dtype)
+        values = np.array([r._obs for r in results])
+    except RuntimeError:
+        values = np.full((len(params), len(spec.tspan),
+                          len(spec.observables)), np.nan,
+                         dtype=spec.dtype or float)
+        for i, p in enumerate(params):
+            try:
+                values[i] = simulator.run_batch(
+                    spec.tspan, [p], observables=spec.observables,
+                    dtype=spec.dtype)[0]._obs
+            except RuntimeError:
+                pass
+    if spec.reduce is None:
+        return values
+    return spec.reduce(spec.tspan, spec.observables, params, values)
+
+
+# Local backends
+# ==============
+
+class SerialBackend(object):
+    """Run all chunks in the calling process."""
+
+    def run(self, spec, chunks):
+        sim = Simulator(spec.network, rtol=spec.rtol, atol=spec.atol)
+        return [simulate_chunk(sim, spec, c) for c in chunks]
+
+
+# Simulator of the current pool worker.
+_worker_sim = None
+
+def _init_worker(spec):
+    global _worker_sim
+    _worker_sim = (Simulator(spec.network, rtol=spec.rtol, atol=spec.atol),
+                   spec)
+
+def _pool_chunk(params):
+    return simulate_chunk(_worker_sim[0], _worker_sim[1], params)
+
+
+class PoolBackend(object):
+    """Run chunks in a local process pool.
+
+    At most `backlog` chunks per process are submitted ahead of the
+    results, so chunks produced by a generator are drawn lazily.
+
+    Used as a context manager, the backend keeps its pool alive between
+    calls made with the same :py:class:`SweepSpec`, which saves the worker
+    startup for iterative callers (samplers, optimizers)::
+
+        with PoolBackend(8) as backend:
+            for step in range(n):
+                backend.run(spec, chunks)
+
+    Parameters
+    ----------
+    processes : int, optional
+        Number of worker processes (default: number of CPUs).
+    backlog : int
+        Chunks queued per process.
+    """
+
+    def __init__(self, processes=None, backlog=2):
+        self.processes = processes or os.cpu_count()
+        self.backlog = backlog
+        self._persistent = False
+        self._pool = None
+        self._spec = None
+
+    def __enter__(self):
+        self._persistent = True
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._persistent = False
+        self._shutdown()
+
+    def _shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+            self._spec = None
+
+    def run(self, spec, chunks):
+        if self._pool is None or self._spec is not spec:
+            self._shutdown()
+            self._pool = ProcessPoolExecutor(self.processes,
+                                             initializer=_init_worker,
+                                             initargs=(spec,))
+            self._spec = spec
+        try:
+            return self._run(self._pool, chunks)
+        finally:
+            if not self._persistent:
+                self._shutdown()
+
+    def _run(self, pool, chunks):
+        return _bounded_map(pool, _pool_chunk, chunks,
+                            self.processes * self.backlog)
+
+
+class ThreadBackend(object):
+    """Run chunks in a thread pool sharing one network.
+
+    Unlike :py:class:`PoolBackend`, the network (which may be memory-mapped,
+    see :py:meth:`anrm.network.Network.load`) exists once however many
+    workers run, so memory stays flat as threads are added. Every thread
+    has its own :py:class:`~anrm.simulator.Simulator` (the linear solvers
+    keep per-run state); the network itself is only read.
+
+    Threads run concurrently only where the work releases the GIL: in the
+    Numba kernels (`jit`, when Numba is installed) and in those NumPy and
+    SciPy routines that release it. Without Numba, the NumPy
+    right-hand side holds the GIL for most of a step and
+    :py:class:`PoolBackend` scales better. How throughput scales with the
+    number of threads when Numba is installed has not been measured yet;
+    ``benchmarks/threads.py`` compares both backends.
+
+    Parameters
+    ----------
+    threads : int, optional
+        Number of threads (default: number of CPUs).
+    backlog : int
+        Chunks queued per thread.
+    jit : bool
+        Use the compiled kernels of :py:mod:`anrm.jit` if available.
+    """
+
+    def __init__(self, threads=None, backlog=2, jit=True):
+        self.threads = threads or os.cpu_count()
+        self.backlog = backlog
+        self.jit = jit
+
+    def run(self, spec, chunks):
+        from anrm import jit as _jit
+
+        local = threading.local()
+        jit = self.jit and _jit.available()
+        if jit:
+            # Compile (or load) the kernels once, before the threads start
+            _jit.kernels(spec.network)
+
+        def simulate(params):
+            sim = getattr(local, 'sim', None)
+            if sim is None:
+                sim = local.sim = Simulator(spec.network, rtol=spec.rtol,
+                                            atol=spec.atol, jit=jit)
+            return simulate_chunk(sim, spec, params)
+
+        with ThreadPoolExecutor(self.threads) as pool:
+            return _bounded_map(pool, simulate, chunks,
+                                self.threads * self.backlog)
+
+
+def _bounded_map(pool, fn, chunks, limit):
+    """Map `fn` over `chunks` on `pool`, with at most `limit` chunks
+    submitted ahead of the results; returns the results in order."""
+
+    results = {}
+    running = {}
+    for i, chunk in enumerate(chunks):
+        if len(running) >= limit:
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for f in done:
+                results[running.pop(f)] = f.result()
+        running[pool.submit(fn, chunk)] = i
+    for f in list(running):
+        results[running.pop(f)] = f.result()
+    return [results[i] for i in sorted(results)]
+
+
+# Work queue backend
+# ==================
+
+class WorkQueue(object):
+    """Interface of a leased, retrying, idempotent work queue.
+
+    A queue holds sweeps (a serialized :py:class:`SweepSpec`) and their
+    tasks (one parameter chunk each). Implementations must make
+    :py:meth:`lease` atomic and :py:meth:`commit` idempotent.
+    """
+
+    def submit(self, sweep_id, spec, chunks):
+        """Add a sweep and its chunks, unless `sweep_id` already exists."""
+        raise NotImplementedError
+
+    def lease(self, worker, duration):
+        """Lease one runnable task as (sweep_id, chunk, params) or None."""
+        raise NotImplementedError
+
+    def commit(self, sweep_id, chunk, result):
+        """Store the result of a chunk; later commits are ignored."""
+        raise NotImplementedError
+
+    def fail(self, sweep_id, chunk, error):
+        """Release a failed task for retry, or fail it for good."""
+        raise NotImplementedError
+
+    def spec(self, sweep_id):
+        """Return the serialized :py:class:`SweepSpec` of a sweep."""
+        raise NotImplementedError
+
+    def progress(self, sweep_id):
+        """Return counts of tasks by state for a sweep."""
+        raise NotImplementedError
+
+    def results(self, sweep_id):
+        """Return the committed results of a sweep, ordered by chunk."""
+        raise NotImplementedError
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """:py:class:`WorkQueue` stored in one SQLite database file.
+
+    Parameters
+    ----------
+    path : string
+        Database file; created if missing.
+    max_attempts : int
+        Number of failures after which a task is abandoned.
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS sweeps (
+            id TEXT PRIMARY KEY, spec BLOB, n_chunks INTEGER);
+        CREATE TABLE IF NOT EXISTS tasks (
+            sweep_id TEXT, chunk INTEGER, params BLOB,
+            state TEXT DEFAULT 'pending', owner TEXT, expires REAL,
+            attempts INTEGER DEFAULT 0, error TEXT,
+            PRIMARY KEY (sweep_id, chunk));
+        CREATE TABLE IF NOT EXISTS results (
+            sweep_id TEXT, chunk INTEGER, data BLOB,
+            PRIMARY KEY (sweep_id, chunk));
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        with self._connect() as db:
+            for statement in self._schema.split(';'):
+                db.execute(statement)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        db.execute('PRAGMA busy_timeout = 60000')
+        return _Transaction(db)
+
+    def submit(self, sweep_id, spec, chunks):
+        with self._connect() as db:
+            if db.execute('SELECT 1 FROM sweeps WHERE id = ?',
+                          (sweep_id,)).fetchone():
+                return False
+            db.execute('INSERT INTO sweeps VALUES (?, ?, ?)',
+                       (sweep_id, _dump_spec(spec), len(chunks)))
+            db.executemany(
+                'INSERT INTO tasks (sweep_id, chunk, params) VALUES (?, ?, ?)',
+                [(sweep_id, i, _to_blob(c)) for i, c in enumerate(chunks)])
+        return True
+
+    def lease(self, worker, duration):
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT sweep_id, chunk, params FROM tasks "
+                "WHERE state = 'pending' OR (state = 'leased' AND expires < ?) "
+                "ORDER BY sweep_id, chunk LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE tasks SET state = 'leased', owner = ?, "
+                       "expires = ? WHERE sweep_id = ? AND chunk = ?",
+                       (worker, now + duration, row[0], row[1]))
+        return row[0], row[1], _from_blob(row[2])
+
+    def commit(self, sweep_id, chunk, result):
+        with self._connect() as db:
+            db.execute('INSERT OR IGNORE INTO results VALUES (?, ?, ?)',
+                       (sweep_id, chunk, _to_blob(result)))
+            db.execute("UPDATE tasks SET state = 'done', owner = NULL "
+                       "WHERE sweep_id = ? AND chunk = ?", (sweep_id, chunk))
+
+    def fail(self, sweep_id, chunk, error):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE tasks SET attempts = attempts + 1, error = ?, "
+                "owner = NULL, state = CASE WHEN attempts + 1 >= ? "
+                "THEN 'failed' ELSE 'pending' END "
+                "WHERE sweep_id = ? AND chunk = ? AND state != 'done'",
+                (error, self.max_attempts, sweep_id, chunk))
+
+    def spec(self, sweep_id):
+        with self._connect() as db:
+            row = db.execute('SELECT spec FROM sweeps WHERE id = ?',
+                             (sweep_id,)).fetchone()
+        if row is None:
+            raise ValueError("Unknown sweep '%s'" % sweep_id)
+        return row[0]
+
+    def progress(self, sweep_id):
+        with self._connect() as db:
+            rows = db.execute('SELECT state, COUNT(*) FROM tasks '
+                              'WHERE sweep_id = ? GROUP BY state',
+                              (sweep_id,)).fetchall()
+        return dict(rows)
+
+    def errors(self, sweep_id):
+        """Return {chunk: last error} for the failed tasks of a sweep."""
+
+        with self._connect() as db:
+            rows = db.execute("SELECT chunk, error FROM tasks WHERE "
+                              "sweep_id = ? AND state = 'failed'",
+                              (sweep_id,)).fetchall()
+        return dict(rows)
+
+    def results(self, sweep_id):
+        with self._connect() as db:
+            rows = db.execute('SELECT data FROM results WHERE sweep_id = ? '
+                              'ORDER BY chunk', (sweep_id,)).fetchall()
+        return [_from_blob(r[0]) for r in rows]
+
+
+class _Transaction(object):
+    """Context manager running a connection's statements in one transaction."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.db.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        finally:
+            self.db.close()
+
+
+class QueueBackend(object):
+    """Run chunks through a :py:class:`WorkQueue`.
+
+    The sweep is submitted (or, if `sweep_id` already exists, resumed) and
+    the call blocks until every chunk is done. With `local_processes` the
+    submitting node also works on the queue itself.
+
+    Parameters
+    ----------
+    queue : WorkQueue
+        The queue shared with the worker nodes.
+    sweep_id : string, optional
+        Name of the sweep; a random one is used if not given.
+    local_processes : int
+        Number of processes to work with on the submitting node (0 to only
+        wait for other nodes).
+    poll : float
+        Seconds between progress checks.
+    """
+
+    def __init__(self, queue, sweep_id=None, local_processes=1, poll=1.0):
+        self.queue = queue
+        self.sweep_id = sweep_id or uuid.uuid4().hex
+        self.local_processes = local_processes
+        self.poll = poll
+
+    def run(self, spec, chunks):
+        chunks = list(chunks)
+        self.queue.submit(self.sweep_id, spec, chunks)
+        while True:
+            if self.local_processes:
+                work(self.queue, self.local_processes, exit_when_idle=True)
+            progress = self.queue.progress(self.sweep_id)
+            if progress.get('failed'):
+                raise RuntimeError("Sweep '%s' has failed chunks: %r" %
+                                   (self.sweep_id,
+                                    self.queue.errors(self.sweep_id)))
+            if progress.get('done', 0) == len(chunks):
+                return self.queue.results(self.sweep_id)
+            time.sleep(self.poll)
+
+
+# Worker nodes
+# ============
+
+# Simulators of the current worker process, keyed by spec file.
+_node_sims = {}
+
+def _queue_chunk(spec_path, params):
+    sim = _node_sims.get(spec_path)
+    if sim is None:
+        with open(spec_path, 'rb') as f:
+            spec = pickle.load(f)
+        sim = (Simulator(spec.network, rtol=spec.rtol, atol=spec.atol), spec)
+        _node_sims[spec_path] = sim
+    return simulate_chunk(sim[0], sim[1], params)
+
+
+def work(queue, processes=1, lease_duration=600., exit_when_idle=True,
+         poll=1.0, cache_dir=None):
+    """Drain `queue` on this node.
+
+    Leases tasks, runs them in `processes` local worker processes and
+    commits their results. Each sweep's specification (including its
+    network) is fetched from the queue once per node and written to
+    `cache_dir`, from where the worker processes load it once each.
+
+    `lease_duration` must exceed the time a chunk takes: a task whose lease
+    expires is handed out again. Returns when the queue has no runnable task
+    left if `exit_when_idle`, otherwise polls forever.
+    """
+
+    worker = '%s:%d:%s' % (socket.gethostname(), os.getpid(),
+                           uuid.uuid4().hex[:8])
+    cache_dir = cache_dir or tempfile.gettempdir()
+    spec_paths = {}
+    running = {}
+    with ProcessPoolExecutor(processes) as pool:
+        while True:
+            while len(running) < processes:
+                task = queue.lease(worker, lease_duration)
+                if task is None:
+                    break
+                sweep_id, chunk, params = task
+                if sweep_id not in spec_paths:
+                    spec_paths[sweep_id] = _cache_spec(queue, sweep_id,
+                                                       cache_dir)
+                future = pool.submit(_queue_chunk, spec_paths[sweep_id],
+                                     params)
+                running[future] = (sweep_id, chunk)
+            if not running:
+                if exit_when_idle:
+                    return
+                time.sleep(poll)
+                continue
+            done, _ = wait(list(running), timeout=poll,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                sweep_id, chunk = running.pop(future)
+                try:
+                    queue.commit(sweep_id, chunk, future.result())
+                except Exception as e:
+                    queue.fail(sweep_id, chunk, '%s: %s' %
+                               (type(e).__name__, e))
+
+def _cache_spec(queue, sweep_id, cache_dir):
+    """Write a sweep's spec to a node-local file named by its content."""
+
+    blob = queue.spec(sweep_id)
+    path = os.path.join(cache_dir, 'anrm-sweep-%s.pkl' %
+                        hashlib.sha1(blob).hexdigest())
+    if not os.path.exists(path):
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(blob)
+        os.rename(tmp, path)
+    return path
+
+
+def _dump_spec(spec):
+    """Pickle a spec with its network's arrays, so that a queued sweep does
+    not depend on a network file that may change after submission."""
+
+    network = spec.network.detach()
+    if network is not spec.network:
+        spec = copy.copy(spec)
+        spec.network = network
+    return pickle.dumps(spec, 2)
+
+def _to_blob(value):
+    """Serialize an array, or a tuple of arrays, without pickling."""
+
+    buf = io.BytesIO()
+    if isinstance(value, tuple):
+        np.savez(buf, *value)
+    else:
+        np.save(buf, np.asarray(value), allow_pickle=False)
+    return buf.getvalue()
+
+def _from_blob(blob):
+    data = np.load(io.BytesIO(blob), allow_pickle=False)
+    if isinstance(data, np.ndarray):
+        return data
+    return tuple(data['arr_%d' % i] for i in range(len(data.files)))
@@ -0,0 +1,367 @@
+"""
+Overview
+========
+
+A registry of ANRM model variants built from shared module fragments.
+
+``irvin_mod`` and ``irvin_modv2`` are each written as one script: a block of
+generic rate constants, a series of module functions (CD95 and TNFR1
+signalling, the secondary complexes, MOMP, execution) called in order, and a
+list of observables. Here a model variant is instead *declared* as
+
+- an ordered list of fragments, each one module function (or one block of
+  top-level declarations) of a model file, and
+- a dict of Parameter overrides,
+
+so that new variants are written by swapping fragments and changing values
+instead of copying a model file::
+
+    from anrm import variants
+
+    variants.register('irvin_mod_tnfa', base='irvin_mod',
+                      overrides={'Fas_0': 0})
+    network = variants.get('irvin_mod_tnfa').network()
+
+Fragments are read from the source of their model file and executed in a
+fresh namespace, so building a variant neither imports nor modifies the
+module-level model of ``irvin_mod`` and friends. Each fragment is identified
+by a hash of its source text and arguments, and a variant by the sequence of
+its fragment hashes (its *structure*). BioNetGen expands the rules of a
+whole model at once, so the expanded network is cached per structure rather
+than per fragment: a variant that shares all its fragments with one built
+before, whatever the Parameter values, reuses that network (in memory, and on
+disk with `cache_dir`) and only swaps in its own values; a fragment shared by
+two model files, such as ``CD95_to_SecondaryComplex_monomers``, gets the same
+hash in both.
+"""
+
+import copy
+import hashlib
+import io
+import os
+import re
+import tokenize
+
+# Header executed in the namespace of every variant, as in the model files.
+_HEADER = """\
+import numpy
+from pysb import *
+from pysb.util import alias_model_components
+from pysb.macros import *
+
+Model(%r)
+"""
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Kinds of top-level declarations that Declarations fragments select.
+_DECLARATION_KINDS = {
+    'parameters': re.compile(r'^Parameter\('),
+    'observables': re.compile(r'^Observable\('),
+    'constants': re.compile(r'^[A-Za-z_]\w*\s*='),
+}
+
+_registry = {}
+_networks = {}
+
+
+# Parsed model files: path -> (mtime, size, blocks)
+_blocks_cache = {}
+
+def _module_blocks(module):
+    """Split the source of an anrm model file into top-level statements.
+
+    Each block runs from an unindented statement to the next one, so
+    function definitions are one block each. Files are parsed once, and
+    again only when they change on disk.
+    """
+
+    path = os.path.join(_PACKAGE_DIR, module + '.py')
+    stat = os.stat(path)
+    cached = _blocks_cache.get(path)
+    if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return path, cached[2]
+    with open(path) as f:
+        source = f.read()
+    lines = source.splitlines(True)
+    starts = []
+    logical = True
+    skip = (tokenize.NL, tokenize.COMMENT, tokenize.INDENT, tokenize.DEDENT,
+            tokenize.ENDMARKER)
+    for token in tokenize.generate_tokens(io.StringIO(source).readline):
+        if token.type == tokenize.NEWLINE:
+            logical = True
+        elif token.type not in skip and logical:
+            if token.start[1] == 0:
+                starts.append(token.start[0] - 1)
+            logical = False
+    ends = starts[1:] + [len(lines)]
+    blocks = [''.join(lines[i:j]) for i, j in zip(starts, ends)]
+    _blocks_cache[path] = (stat.st_mtime_ns, stat.st_size, blocks)
+    return path, blocks
+
+
+class Fragment(object):
+    """One module function of a model file, called with given arguments.
+
+    Parameters
+    ----------
+    module : string
+        Name of the model file within the package, e.g. ``'irvin_mod'``.
+    function : string
+        Name of the module function.
+    *args, **kwargs
+        Arguments of the call.
+    """
+
+    def __init__(self, module, function, *args, **kwargs):
+        self.module = module
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return '%s.%s' % (self.module, self.function)
+
+    def source(self):
+        """Return (path, source text) of the fragment."""
+
+        path, blocks = _module_blocks(self.module)
+        pattern = re.compile(r'^def %s\(' % re.escape(self.function))
+        for block in blocks:
+            if pattern.match(block):
+                return path, block
+        raise ValueError("No function '%s' in anrm.%s" %
+                         (self.function, self.module))
+
+    @property
+    def key(self):
+        """Hash of the source and arguments of the fragment."""
+
+        text = self.source()[1]
+        args = repr((self.function, self.args, sorted(self.kwargs.items())))
+        return hashlib.sha1((text + args).encode('utf-8')).hexdigest()
+
+    def apply(self, namespace):
+        """Define the function in `namespace` and call it."""
+
+        path, text = self.source()
+        exec(compile(text, path, 'exec'), namespace)
+        namespace[self.function](*self.args, **self.kwargs)
+
+
+class Declarations(Fragment):
+    """The top-level declarations of one kind of a model file.
+
+    `kind` is ``'parameters'`` (the generic rate constants), ``'constants'``
+    (plain assignments such as ``N_A``) or ``'observables'``.
+    """
+
+    def __init__(self, module, kind):
+        if kind not in _DECLARATION_KINDS:
+            raise ValueError("Unknown kind of declarations '%s'" % kind)
+        Fragment.__init__(self, module, kind)
+
+    def __repr__(self):
+        return '%s:%s' % (self.module, self.function)
+
+    def source(self):
+        path, blocks = _module_blocks(self.module)
+        pattern = _DECLARATION_KINDS[self.function]
+        return path, ''.join(b for b in blocks if pattern.match(b))
+
+    def apply(self, namespace):
+        path, text = self.source()
+        exec(compile(text, path, 'exec'), namespace)
+
+
+class Variant(object):
+    """A model declared as a composition of fragments plus overrides.
+
+    Parameters
+    ----------
+    name : string
+        Name of the variant, used as the model name.
+    fragments : list of Fragment
+        Fragments applied in order to build the model.
+    overrides : dict, optional
+        Parameter values replacing those set by the fragments.
+    """
+
+    def __init__(self, name, fragments, overrides=None):
+        self.name = name
+        self.fragments = list(fragments)
+        self.overrides = dict(overrides or {})
+
+    def __repr__(self):
+        return 'Variant(%r, %d fragments, %d overrides)' % (
+            self.name, len(self.fragments), len(self.overrides))
+
+    @property
+    def structure_key(self):
+        """Hash of the fragment sequence; independent of Parameter values."""
+
+        keys = '\n'.join(f.key for f in self.fragments)
+        return hashlib.sha1(keys.encode('utf-8')).hexdigest()
+
+    def _build(self):
+        """Build the model from the fragments alone, without overrides."""
+
+        namespace = {'__name__': 'anrm.variants.' + self.name}
+        exec(_HEADER % self.name, namespace)
+        for fragment in self.fragments:
+            fragment.apply(namespace)
+        return namespace['model']
+
+    def model(self):
+        """Build and return the PySB model of the variant."""
+
+        model = self._build()
+        for name, value in self.overrides.items():
+            parameter = model.parameters.get(name)
+            if parameter is None:
+                raise ValueError("Variant '%s' overrides unknown parameter "
+                                 "'%s'" % (self.name, name))
+            parameter.value = value
+        return model
+
+    def network(self, cache_dir=None):
+        """Return the generated network of the variant.
+
+        Networks are cached by :py:attr:`structure_key`, in memory and, with
+        `cache_dir`, on disk, with the Parameter values set by the fragments;
+        the returned copy carries the overrides of this variant.
+        """
+
+        key = self.structure_key
+        network = _networks.get(key)
+        path = None
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, 'anrm-network-%s.net' % key)
+        if network is None and path is not None and os.path.exists(path):
+            from anrm.network import Network
+            network = Network.load(path)
+        if network is None:
+            from anrm.network import Network
+            network = Network.from_model(self._build())
+            if path is not None:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                network.save(path)
+        _networks[key] = network
+        return self._with_values(network)
+
+    def _with_values(self, network):
+        result = copy.copy(network)
+        result.name = self.name
+        result.param_values = network.param_vector(self.overrides)
+        return result
+
+    def derive(self, name, replace=None, add=None, overrides=None):
+        """Return a new variant based on this one.
+
+        `replace` maps the repr of existing fragments (e.g.
+        ``'irvin_mod.lopez_pore_formation'``) to a fragment or a list of
+        fragments taking their place, `add` lists fragments appended before
+        the observables, and `overrides` updates the Parameter overrides.
+        """
+
+        replace = replace or {}
+        fragments = []
+        for fragment in self.fragments:
+            new = replace.get(repr(fragment), fragment)
+            fragments.extend(new if isinstance(new, list) else [new])
+        if add:
+            at = len(fragments)
+            while at and isinstance(fragments[at - 1], Declarations) and \
+                    fragments[at - 1].function == 'observables':
+                at -= 1
+            fragments[at:at] = list(add)
+        values = dict(self.overrides)
+        values.update(overrides or {})
+        return Variant(name, fragments, values)
+
+
+def register(name, fragments=None, overrides=None, base=None):
+    """Register a variant and return it.
+
+    Either give the `fragments` of a new variant, or the name of a
+    registered `base` variant whose fragments (and overrides, updated with
+    `overrides`) are reused.
+    """
+
+    if base is not None:
+        variant = get(base).derive(name, overrides=overrides)
+        if fragments is not None:
+            variant.fragments = list(fragments)
+    elif fragments is None:
+        raise ValueError("A variant needs fragments or a base variant")
+    else:
+        variant = Variant(name, fragments, overrides)
+    _registry[name] = variant
+    return variant
+
+def get(name):
+    """Return the registered variant `name`."""
+
+    try:
+        return _registry[name]
+    except KeyError:
+        raise ValueError("Unknown model variant '%s'" % name)
+
+def names():
+    """Return the names of the registered variants."""
+
+    return sorted(_registry)
+
+
+# Registered variants
+# ===================
+
+# Identical in both model files, so it is one fragment.
+_cd95_monomers = Fragment('irvin_mod', 'CD95_to_SecondaryComplex_monomers')
+
+register('irvin_mod', [
+    Declarations('irvin_mod', 'parameters'),
+    Declarations('irvin_mod', 'constants'),
+    _cd95_monomers,
+    Fragment('irvin_mod', 'CD95_to_SecondaryComplex'),
+    Fragment('irvin_mod', 'TNFR1_to_SecondaryComplex_monomers'),
+    Fragment('irvin_mod', 'TNFR1_to_SecondaryComplex'),
+    Fragment('irvin_mod', 'SecondaryComplex_to_Bid_monomers'),
+    Fragment('irvin_mod', 'SecondaryComplex_to_Bid'),
+    Fragment('irvin_mod', 'momp_monomers'),
+    Fragment('irvin_mod', 'declare_initial_conditions'),
+    Fragment('irvin_mod', 'translocate_tBid_Bax_BclxL'),
+    Fragment('irvin_mod', 'tBid_activates_Bax_and_Bak'),
+    Fragment('irvin_mod', 'tBid_binds_all_anti_apoptotics'),
+    Fragment('irvin_mod', 'sensitizers_bind_anti_apoptotics'),
+    Fragment('irvin_mod', 'effectors_bind_anti_apoptotics'),
+    Fragment('irvin_mod', 'lopez_pore_formation'),
+    Fragment('irvin_mod', 'apaf1_to_parp_monomers'),
+    Fragment('irvin_mod', 'pore_to_parp'),
+    Fragment('irvin_mod', 'rip1_to_parp'),
+    Declarations('irvin_mod', 'observables'),
+])
+
+register('irvin_modv2', [
+    Declarations('irvin_modv2', 'parameters'),
+    _cd95_monomers,
+    Fragment('irvin_modv2', 'CD95_to_SecondaryComplex'),
+    Fragment('irvin_modv2', 'TNFR1_to_SecondaryComplex_monomers'),
+    Fragment('irvin_modv2', 'TNFR1_to_SecondaryComplex'),
+    Fragment('irvin_modv2', 'SecondaryComplex_to_Bid_monomers'),
+    Fragment('irvin_modv2', 'SecondaryComplex_to_Bid'),
+    Fragment('irvin_modv2', 'momp_monomers'),
+    Fragment('irvin_modv2', 'apaf1_to_parp_monomers'),
+    Fragment('irvin_modv2', 'pore_to_parp'),
+    Fragment('irvin_modv2', 'Bax_tetramerizes'),
+    Fragment('irvin_modv2', 'Bcl2_binds_Bax1_Bax2_and_Bax4',
+             bax_active_state='A'),
+    Declarations('irvin_modv2', 'observables'),
+])
+
+# Single-ligand stimulations of ANRM 1.0; these share the network of
+# irvin_mod.
+register('irvin_mod_tnfa', base='irvin_mod', overrides={'Fas_0': 0})
+register('irvin_mod_fas', base='irvin_mod', overrides={'TNFa_0': 0})
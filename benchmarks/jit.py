@@ -0,0 +1,112 @@
+"""
+NumPy versus Numba kernel benchmark.
+
+Times the right-hand side, the Jacobian and a full ODE run of a network with
+the NumPy code of :py:class:`anrm.network.Network` and with the compiled
+kernels of :py:mod:`anrm.jit`, and an SSA trajectory with both
+:py:class:`anrm.ssa.StochasticSimulator` paths. Networks are compiled network
+files or synthetic pore-assembly networks (see ``linear_solvers.py``)::
+
+    python benchmarks/jit.py
+    python benchmarks/jit.py anrm.net --batch 16
+
+The first Numba call of a network includes compilation (or loading the
+cached machine code) and is reported separately.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from anrm import jit
+from anrm.network import Network
+from anrm.simulator import Simulator
+from anrm.ssa import StochasticSimulator
+from linear_solvers import pore_network
+
+
+def per_call(f, repeat):
+    """Return the best time per call of `f` over `repeat` timing loops."""
+
+    f()
+    best = np.inf
+    for _ in range(repeat):
+        n, start = 0, time.perf_counter()
+        while n < 10 or time.perf_counter() - start < 0.2:
+            f()
+            n += 1
+        best = min(best, (time.perf_counter() - start) / n)
+    return best
+
+def benchmark(network, batch, stop, repeat, ssa_stop):
+    p = network.param_vector()
+    k = np.tile(network.rate_constants(p), (batch, 1))
+    y = np.tile(network.initial_state(p), (batch, 1))
+    y += np.random.default_rng(0).random(y.shape)
+    tspan = np.linspace(0., stop, 101)
+    params = [p] * batch
+    rows = [('rhs', 'numpy', per_call(lambda: network.rhs(y, k), repeat)),
+            ('jacobian', 'numpy',
+             per_call(lambda: network.batch_jacobian(y, k), repeat))]
+    sim = Simulator(network)
+    rows.append(('ode run', 'numpy',
+                 per_call(lambda: sim.run_batch(tspan, params), 1)))
+    ssa = StochasticSimulator(network, seed=0)
+    ssa_span = np.linspace(0., ssa_stop, 11)
+    rows.append(('ssa run', 'numpy',
+                 per_call(lambda: ssa.run(ssa_span), 1)))
+    if not jit.available():
+        rows.append(('numba', 'n/a', None))
+        return rows
+
+    start = time.perf_counter()
+    kernels = jit.kernels(network)
+    kernels.rhs(y, k)
+    kernels.jacobian(y, k)
+    kernels.ssa(y[0], k[0], ssa_span[:2], 0)
+    rows.append(('compile/load', 'numba', time.perf_counter() - start))
+    rows.append(('rhs', 'numba', per_call(lambda: kernels.rhs(y, k), repeat)))
+    rows.append(('jacobian', 'numba',
+                 per_call(lambda: kernels.jacobian(y, k), repeat)))
+    sim = Simulator(network, jit=True)
+    rows.append(('ode run', 'numba',
+                 per_call(lambda: sim.run_batch(tspan, params), 1)))
+    ssa = StochasticSimulator(network, seed=0, jit=True)
+    rows.append(('ssa run', 'numba',
+                 per_call(lambda: ssa.run(ssa_span), 1)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('networks', nargs='*',
+                        help='compiled network files (default: synthetic)')
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stop', type=float, default=20000.)
+    parser.add_argument('--ssa-stop', type=float, default=1.)
+    args = parser.parse_args()
+
+    if args.networks:
+        networks = [Network.load(path) for path in args.networks]
+    else:
+        networks = [pore_network(8, 2), pore_network(40, 10)]
+    for network in networks:
+        print('%s: %d species, %d reactions, batch %d' % (
+            network.name, network.n_species, network.n_reactions,
+            args.batch))
+        for what, path, seconds in benchmark(network, args.batch, args.stop,
+                                             args.repeat, args.ssa_stop):
+            if seconds is None:
+                print('  %-13s %-6s not installed' % (what, path))
+            else:
+                print('  %-13s %-6s %12.1f us' % (what, path, 1e6 * seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Linear-solver benchmark for the stiff integrator.
+
+Times :py:meth:`anrm.simulator.Simulator.run` with each linear solver of
+:py:mod:`anrm.linsolve` and reports the largest deviation from the 'splu'
+reference. Networks are either compiled network files (see
+:py:meth:`anrm.network.Network.save`), e.g. of the standard ANRM models, or
+synthetic pore-assembly networks that mimic extending
+``lopez_pore_formation``/``pore_transport`` to larger pores and more
+cargos::
+
+    python benchmarks/linear_solvers.py                      # synthetic
+    python benchmarks/linear_solvers.py anrm.net --batch 16  # compiled model
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from anrm.network import Network
+from anrm.simulator import Simulator
+
+SOLVERS = ['dense', 'splu', 'splu-reuse', 'gmres']
+
+
+def pore_network(max_size, n_cargo):
+    """Sequential pore assembly with size-specific cargo transport.
+
+    Subunits activate, assemble into pores of 2..`max_size` subunits, and
+    every pore of 4 or more subunits binds and releases each of `n_cargo`
+    cargos, as in ``pore_transport``.
+    """
+
+    species = ['Bax(state=C)', 'Bax(state=A)']
+    species += ['Pore%d' % k for k in range(2, max_size + 1)]
+    pore = dict((k, k) for k in range(2, max_size + 1))
+    pore[1] = 1
+    parameters = ['k_act', 'kf_pore', 'kr_pore', 'kf_cargo', 'kr_cargo',
+                  'kc_cargo', 'Bax_0']
+    values = [1e-3, 2e-4, 1e-3, 3e-5, 1e-3, 10., 1e5]
+    reactants, products, rate_param, rules = [], [], [], []
+
+    def reaction(r, p, k, rule):
+        reactants.append(r)
+        products.append(p)
+        rate_param.append(parameters.index(k))
+        rules.append(rule)
+
+    reaction((0,), (1,), 'k_act', 'Bax_activation')
+    for k in range(2, max_size + 1):
+        reaction((1, pore[k - 1]), (pore[k],), 'kf_pore', 'pore_assembly')
+        reaction((pore[k],), (1, pore[k - 1]), 'kr_pore', 'pore_assembly')
+    for c in range(n_cargo):
+        parameters.append('Cargo%d_0' % c)
+        values.append(1e5)
+        src = len(species)
+        species += ['Cargo%d(state=M)' % c, 'Cargo%d(state=C)' % c]
+        for k in range(4, max_size + 1):
+            bound = len(species)
+            species.append('Pore%d:Cargo%d' % (k, c))
+            reaction((pore[k], src), (bound,), 'kf_cargo', 'pore_transport')
+            reaction((bound,), (pore[k], src), 'kr_cargo', 'pore_transport')
+            reaction((bound,), (pore[k], src + 1), 'kc_cargo',
+                     'pore_transport')
+    n = len(species)
+    obs = np.zeros((n_cargo + 1, n))
+    obs[0, 1:max_size + 1] = 1
+    observables = ['Obs_Bax']
+    for c in range(n_cargo):
+        obs[c + 1, species.index('Cargo%d(state=C)' % c)] = 1
+        observables.append('Obs_Cargo%d' % c)
+    initial_params = ['Bax_0'] + ['Cargo%d_0' % c for c in range(n_cargo)]
+    initial_species = [0] + [species.index('Cargo%d(state=M)' % c)
+                             for c in range(n_cargo)]
+    return Network(species, parameters, values, reactants, products,
+                   rate_param, np.ones(len(rules)), rules,
+                   [False] * len(rules), observables, obs, initial_params,
+                   initial_species, name='pore%d_x%d' % (max_size, n_cargo))
+
+
+def benchmark(network, tspan, batch, solvers, repeat):
+    params = [network.param_vector()] * batch
+    rows, reference = [], None
+    for name in solvers:
+        sim = Simulator(network, linear_solver=name)
+        best = np.inf
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                if batch == 1:
+                    result = sim.run(tspan).species
+                else:
+                    result = np.array([r.species for r in
+                                       sim.run_batch(tspan, params)])
+                best = min(best, time.perf_counter() - start)
+        except Exception as e:
+            rows.append((name, None, '%s: %s' % (type(e).__name__, e)))
+            continue
+        if name == 'splu' or reference is None:
+            reference = result if reference is None or name == 'splu' \
+                else reference
+        scale = np.abs(reference).max()
+        rows.append((name, best, np.abs(result - reference).max() / scale))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('networks', nargs='*',
+                        help='compiled network files (default: synthetic)')
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stop', type=float, default=20000.)
+    parser.add_argument('--solvers', default=','.join(SOLVERS))
+    args = parser.parse_args()
+
+    if args.networks:
+        networks = [Network.load(path) for path in args.networks]
+    else:
+        networks = [pore_network(8, 2), pore_network(40, 10),
+                    pore_network(120, 40)]
+    tspan = np.linspace(0., args.stop, 101)
+    solvers = args.solvers.split(',')
+    if 'splu' in solvers:
+        solvers.remove('splu')
+        solvers.insert(0, 'splu')
+    for network in networks:
+        n = network.n_species * args.batch
+        print('%s: %d species x %d = %d, %d reactions' % (
+            network.name, network.n_species, args.batch, n,
+            network.n_reactions))
+        for name, seconds, err in benchmark(network, tspan, args.batch,
+                                            solvers, args.repeat):
+            if seconds is None:
+                print('  %-11s failed: %s' % (name, err))
+            else:
+                print('  %-11s %9.3f s   max rel. deviation %.1e' % (
+                    name, seconds, err))
+
+
+if __name__ == '__main__':
+    main()
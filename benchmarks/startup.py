@@ -0,0 +1,76 @@
+"""
+Startup-time benchmark.
+
+Imports each target in a fresh interpreter, several times, and reports the
+median wall time of the import along with the heavy packages it pulled in::
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py anrm.shared_anrm anrm.simulator -n 20
+
+The package and lightweight helpers such as ``anrm.shared_anrm`` should
+import in well under 100 ms and without loading PySB or SciPy.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+DEFAULT_TARGETS = ['anrm', 'anrm.shared_anrm', 'anrm.variants', 'anrm.fate',
+                   'anrm.network', 'anrm.simulator', 'anrm.irvin_mod']
+
+HEAVY = ['numpy', 'scipy', 'sympy', 'pysb']
+
+# Run in the child interpreter; prints the import time and heavy modules.
+_PROBE = """
+import json, sys, time
+t = time.perf_counter()
+try:
+    __import__(%r)
+    error = None
+except Exception as e:
+    error = '%%s: %%s' %% (type(e).__name__, e)
+elapsed = time.perf_counter() - t
+print(json.dumps({'time': elapsed, 'error': error,
+                  'loaded': [m for m in %r if m in sys.modules]}))
+"""
+
+
+def measure(target, repeat):
+    """Return (median seconds, loaded heavy modules, error) for `target`."""
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [p for p in [env.get('PYTHONPATH')] if p])
+    times = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c',
+                                       _PROBE % (target, HEAVY)], env=env)
+        result = json.loads(out.decode('utf-8').strip().splitlines()[-1])
+        if result['error']:
+            return None, result['loaded'], result['error']
+        times.append(result['time'])
+    times.sort()
+    return times[len(times) // 2], result['loaded'], None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('targets', nargs='*', default=DEFAULT_TARGETS)
+    parser.add_argument('-n', '--repeat', type=int, default=7)
+    args = parser.parse_args()
+
+    print('%-22s %10s   %s' % ('module', 'median ms', 'heavy imports'))
+    for target in args.targets:
+        seconds, loaded, error = measure(target, args.repeat)
+        if error:
+            print('%-22s %10s   %s' % (target, 'failed', error))
+        else:
+            print('%-22s %10.1f   %s' % (target, 1e3 * seconds,
+                                         ', '.join(loaded) or '-'))
+
+
+if __name__ == '__main__':
+    main()
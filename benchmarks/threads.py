@@ -0,0 +1,104 @@
+"""
+Thread-pool versus process-pool sweep benchmark.
+
+Runs the same sweep with :py:class:`anrm.sweep.SerialBackend`,
+:py:class:`~anrm.sweep.PoolBackend` and :py:class:`~anrm.sweep.ThreadBackend`
+at several worker counts, each in a fresh interpreter, and reports the
+throughput and the peak resident memory (of the parent, plus every worker
+process for the process pool)::
+
+    python benchmarks/threads.py                       # synthetic network
+    python benchmarks/threads.py anrm.net -w 1,2,4,8
+
+Thread throughput scales only where the integrator releases the GIL, i.e.
+with Numba installed (see :py:mod:`anrm.jit`).
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def load(path):
+    from anrm.network import Network
+    if path:
+        return Network.load(path)
+    from linear_solvers import pore_network
+    return pore_network(40, 10)
+
+def measure(path, backend, workers, n_sets, chunk_size, stop):
+    """Run one sweep in this process; return seconds and peak RSS in MB."""
+
+    from anrm import sweep
+
+    network = load(path)
+    rng = np.random.default_rng(0)
+    base = network.param_vector()
+    params = np.tile(base, (n_sets, 1))
+    params *= rng.lognormal(0., 0.2, params.shape)
+    tspan = np.linspace(0., stop, 51)
+    if backend == 'serial':
+        runner = sweep.SerialBackend()
+    elif backend == 'process':
+        runner = sweep.PoolBackend(workers)
+    else:
+        runner = sweep.ThreadBackend(workers)
+    start = time.perf_counter()
+    sweep.run_sweep(network, params, tspan, chunk_size=chunk_size,
+                    backend=runner)
+    seconds = time.perf_counter() - start
+    parent = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    child = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.
+    # ru_maxrss of the children is that of the largest worker
+    total = parent + (workers * child if backend == 'process' else 0.)
+    return {'seconds': seconds, 'memory': total}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('network', nargs='?',
+                        help='compiled network file (default: synthetic)')
+    parser.add_argument('-w', '--workers', default='1,2,4')
+    parser.add_argument('-n', '--sets', type=int, default=64)
+    parser.add_argument('--chunk-size', type=int, default=4)
+    parser.add_argument('--stop', type=float, default=20000.)
+    parser.add_argument('--one', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.one:
+        backend, workers = args.one[0], int(args.one[1])
+        print(json.dumps(measure(args.network, backend, workers, args.sets,
+                                 args.chunk_size, args.stop)))
+        return
+
+    from anrm import jit
+    print('numba: %s' % ('yes' if jit.available() else 'not installed'))
+    print('%-8s %7s %10s %12s %10s' % ('backend', 'workers', 'seconds',
+                                       'sets/s', 'memory MB'))
+    runs = [('serial', 1)]
+    for w in [int(w) for w in args.workers.split(',')]:
+        runs += [('process', w), ('thread', w)]
+    for backend, workers in runs:
+        cmd = [sys.executable, os.path.abspath(__file__), '--one', backend,
+               str(workers), '-n', str(args.sets), '--chunk-size',
+               str(args.chunk_size), '--stop', str(args.stop)]
+        if args.network:
+            cmd.insert(2, args.network)
+        out = subprocess.check_output(cmd, cwd=os.path.dirname(cmd[1]))
+        r = json.loads(out.decode('utf-8').strip().splitlines()[-1])
+        print('%-8s %7d %10.2f %12.1f %10.0f' % (
+            backend, workers, r['seconds'], args.sets / r['seconds'],
+            r['memory']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from anrm.network import Network
+
+
+@pytest.fixture
+def network():
+    """A small TNF-to-PARP network with apoptotic and necrotic branches."""
+
+    species = ['TNFa()', 'C8()', 'PARP(state=U)', 'PARP(state=C)',
+               'PARP(state=A)', 'RIP1()', 'XIAP()']
+    parameters = ['k1', 'k2', 'k3', 'k4', 'TNFa_0', 'PARP_0', 'RIP1_0',
+                  'XIAP_0']
+    values = [1e-4, 1e-6, 1e-5, 1e-10, 3000., 1e6, 2e4, 1e5]
+    reactants = [(0,), (1, 2), (6, 1), (5, 2)]
+    products = [(0, 1), (1, 3), (6,), (5, 4)]
+    obs = np.zeros((3, len(species)))
+    obs[0, 3] = obs[1, 4] = obs[2, 1] = 1
+    return Network(species, parameters, values, reactants, products,
+                   [0, 1, 2, 3], [1] * 4,
+                   ['C8_activation', 'PARP_cleavage', 'C8_inhibition',
+                    'PARP_activation'], [False] * 4,
+                   ['Obs_cPARP', 'Obs_aPARP', 'Obs_C8'], obs,
+                   ['TNFa_0', 'PARP_0', 'RIP1_0', 'XIAP_0'], [0, 2, 5, 6],
+                   name='mini')
@@ -0,0 +1,30 @@
+import numpy as np
+
+from anrm.cascade import FateCascade
+
+# Small copy numbers, so that the SSA tier is quick
+VALUES = {'PARP_0': 1e3, 'XIAP_0': 100., 'RIP1_0': 20., 'TNFa_0': 3.,
+          'k2': 1e-3, 'k3': 1e-2, 'k4': 1e-6}
+TSPAN = np.linspace(0, 40000, 21)
+
+
+def _sets():
+    return [dict(VALUES, XIAP_0=x) for x in (10., 100., 300., 1000.)]
+
+
+def test_ssa_tier_is_reproducible(network):
+    # With an unreachable margin every set goes on to the SSA tier
+    kwargs = dict(margin=np.inf, n_cells=8, seed=5)
+    serial = FateCascade(network, TSPAN, processes=0, **kwargs).run(_sets())
+    assert (serial.tier == 1).all()
+    np.testing.assert_allclose(serial.probabilities.sum(axis=1), 1.)
+
+    pooled = FateCascade(network, TSPAN, processes=2, **kwargs).run(_sets())
+    np.testing.assert_array_equal(pooled.fates, serial.fates)
+    np.testing.assert_array_equal(pooled.probabilities, serial.probabilities)
+
+    # A set's ensemble does not depend on the other sets
+    cascade = FateCascade(network, TSPAN, processes=0, **kwargs)
+    params = np.array([network.param_vector(p) for p in _sets()])
+    fates, times, probs, _, _ = cascade._ssa(params[2:3], [2])
+    np.testing.assert_array_equal(probs[0], serial.probabilities[2])
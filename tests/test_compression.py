@@ -0,0 +1,36 @@
+import numpy as np
+
+from anrm.compression import AdaptiveSampler, CompressedTrajectory
+
+
+def test_round_trip_is_bit_exact(tmp_path):
+    rng = np.random.default_rng(0)
+    times = np.cumsum(rng.random(50))
+    values = np.column_stack([np.cumsum(rng.normal(size=50)),
+                              1e6 * rng.random(50), np.zeros(50)])
+    values[3, 1] = np.nan
+    traj = CompressedTrajectory(times, values, ['a', 'b', 'c'],
+                                tolerance=[1e-3, 1., 0.])
+
+    path = str(tmp_path / 'traj.bin')
+    traj.save(path)
+    back = CompressedTrajectory.load(path)
+    assert back.names == traj.names
+    assert back.times.tobytes() == traj.times.tobytes()
+    assert back.values.tobytes() == traj.values.tobytes()
+    np.testing.assert_array_equal(back.tolerance, traj.tolerance)
+
+
+def test_sampler_keeps_interpolation_within_tolerance():
+    t = np.linspace(0, 10, 2001)
+    x = np.column_stack([1e3 / (1 + np.exp(-5 * (t - 5))), np.sin(t)])
+    sampler = AdaptiveSampler(rtol=1e-3, atol=1e-6, scale=[1e3, 1.])
+    for start in range(0, len(t), 300):
+        sampler.update(t[start:start + 300], x[start:start + 300])
+    times, values = sampler.finish()
+
+    assert len(times) < len(t) // 10
+    traj = CompressedTrajectory(times, values, ['s', 'sin'],
+                                sampler.tolerance)
+    err = np.abs(traj.interpolate(t) - x)
+    assert (err <= traj.tolerance * (1 + 1e-9)).all()
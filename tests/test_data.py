@@ -0,0 +1,39 @@
+import numpy as np
+
+from anrm.data import Dataset, read_table
+
+
+def test_blank_cells_are_missing(tmp_path):
+    path = tmp_path / 'plate.csv'
+    path.write_text('time,well,cPARP\n0,A1,1\n10,A1,\n20,A1,3\n')
+    columns = read_table(str(path))
+    np.testing.assert_array_equal(columns['cPARP'], [1., np.nan, 3.])
+    assert list(columns['well']) == ['A1'] * 3
+
+    data = Dataset.from_file(str(path), observables={'cPARP': 'Obs_cPARP'})
+    align = data.align(np.linspace(0, 20, 3))
+    # The blank cell is dropped, not compared with -1
+    values = np.array([[[1.], [7.], [3.]]])
+    assert align.log_likelihood(values) == 0.
+
+
+def test_single_row(tmp_path):
+    path = tmp_path / 'one.csv'
+    path.write_text('time,well,cPARP\n0,A1,1\n')
+    columns = read_table(str(path))
+    np.testing.assert_array_equal(columns['time'], [0.])
+    np.testing.assert_array_equal(columns['cPARP'], [1.])
+    numeric = read_table(str(path), ['time', 'cPARP'])
+    np.testing.assert_array_equal(numeric['cPARP'], [1.])
+
+    data = Dataset.from_file(str(path), observables={'cPARP': 'Obs_cPARP'})
+    assert len(data) == 1
+
+
+def test_wells_default_to_conditions(tmp_path):
+    path = tmp_path / 'plate.csv'
+    path.write_text('time,TNF,cPARP\n0,1,0\n10,1,5\n0,10,0\n10,10,50\n')
+    data = Dataset.from_file(str(path), observables={'cPARP': 'Obs_cPARP'},
+                             conditions={'TNF': ('TNFa_0', 100.)})
+    assert data.n_conditions == 2 and len(data.wells) == 2
+    np.testing.assert_array_equal(data.conditions, [[100.], [1000.]])
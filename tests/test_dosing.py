@@ -0,0 +1,40 @@
+import numpy as np
+
+from anrm.dosing import Schedule
+from anrm.simulator import Simulator
+
+# TNFa, RIP1 and XIAP are catalysts in the test network, so their amounts
+# change only through the schedule.
+TSPAN = np.linspace(0, 400, 9)
+
+
+def test_bolus_and_set_level(network):
+    schedule = Schedule().bolus(100, 'TNFa', 500).set_level(200, 'XIAP', 0)
+    result = Simulator(network).run(TSPAN, schedule=schedule)
+    np.testing.assert_array_equal(result['TNFa'],
+                                  np.where(TSPAN < 100, 3000., 3500.))
+    np.testing.assert_array_equal(result['XIAP'],
+                                  np.where(TSPAN < 200, 1e5, 0.))
+
+
+def test_pulse_and_repeated_bolus(network):
+    schedule = Schedule().pulse('TNFa', 1000, start=100, duration=100)
+    schedule.repeat_bolus('TNFa', 10, start=300, interval=50, count=2)
+    result = Simulator(network).run(TSPAN, schedule=schedule)
+    expected = [3000, 3000, 4000, 4000, 0, 0, 10, 20, 20]
+    np.testing.assert_array_equal(result['TNFa'], expected)
+
+
+def test_infuse(network):
+    schedule = Schedule().infuse('RIP1_0', 2., start=100, stop=300)
+    result = Simulator(network, rtol=1e-8).run(TSPAN, schedule=schedule)
+    expected = 2e4 + 2. * np.clip(TSPAN - 100, 0, 200)
+    np.testing.assert_allclose(result['RIP1'], expected, rtol=1e-8)
+
+
+def test_events_do_not_restart_the_run(network):
+    # A run through a no-op event matches an uninterrupted run
+    sim = Simulator(network, rtol=1e-8, atol=1e-8)
+    plain = sim.run(TSPAN)
+    dosed = sim.run(TSPAN, schedule=Schedule().bolus(150, 'TNFa', 0))
+    np.testing.assert_allclose(dosed['Obs_C8'], plain['Obs_C8'], rtol=1e-5)
@@ -0,0 +1,53 @@
+import numpy as np
+
+from anrm.cascade import FateMargin
+from anrm.fate import (APOPTOSIS, FAILED, NECROSIS, SURVIVAL, classify,
+                       first_crossing)
+from anrm.population import PopulationResult
+
+TOUT = np.arange(5.)
+
+
+def test_first_crossing_interpolates():
+    x = np.array([[0., 1., 2., 3., 4.], [5., 5., 5., 5., 5.],
+                  [0., 0., 0., 0., 0.]])
+    np.testing.assert_array_equal(first_crossing(TOUT, x, 2.5),
+                                  [2.5, 0., np.nan])
+
+
+def test_classify_calls_failed_rows():
+    ramp = np.array([0., 1., 2., 3., 4.])
+    flat = np.zeros(5)
+    nan = np.full(5, np.nan)
+    cparp = np.array([ramp, flat, flat, nan, ramp])
+    aparp = np.array([flat, ramp, flat, nan, nan])
+    fates, times = classify(TOUT, cparp, aparp, [4.] * 5)
+    np.testing.assert_array_equal(
+        fates, [APOPTOSIS, NECROSIS, SURVIVAL, FAILED, FAILED])
+    np.testing.assert_array_equal(times, [2., 2., np.nan, np.nan, np.nan])
+
+
+def test_failed_sets_are_not_confident(network):
+    margin = FateMargin(network)
+    params = np.tile(network.param_values, (2, 1))
+    values = np.zeros((2, len(TOUT), 2))
+    values[1] = np.nan
+    fates, times, m = margin(TOUT, ['Obs_cPARP', 'Obs_aPARP'], params,
+                             values)
+    np.testing.assert_array_equal(fates, [SURVIVAL, FAILED])
+    assert m[0] >= 0.25 and not m[1] >= 0.25
+
+
+def test_population_leaves_out_failed_cells():
+    fates = np.array([SURVIVAL, APOPTOSIS, FAILED, NECROSIS, FAILED],
+                     dtype=np.int8)
+    times = np.array([np.nan, 1., np.nan, 3., np.nan], dtype=np.float32)
+    pop = PopulationResult(TOUT, fates, times)
+    assert pop.n_failed == 2
+    assert pop.counts() == {'survival': 1, 'apoptosis': 1, 'necrosis': 1,
+                            'failed': 2}
+    np.testing.assert_allclose(pop.fractions([0., 2., 4.]),
+                               [[1., 0., 0.], [2 / 3., 1 / 3., 0.],
+                                [1 / 3., 1 / 3., 1 / 3.]])
+    np.testing.assert_array_equal(pop.death_time_histogram([0., 2., 4.]),
+                                  [1, 1])
@@ -0,0 +1,34 @@
+import numpy as np
+
+from anrm.simulator import Simulator
+
+
+def test_fluxes_integrate_to_species_change(network):
+    tspan = np.linspace(0, 40000, 21)
+    sim = Simulator(network, rtol=1e-8, atol=1e-8)
+    params = {'XIAP_0': 1e4, 'k4': 1e-9}
+    result = sim.run(tspan, params, fluxes=True)
+    assert result.fluxes.shape == (len(tspan), network.n_reactions)
+    np.testing.assert_array_equal(result.fluxes[0], 0.)
+    change = result.species - result.species[0]
+    np.testing.assert_allclose(
+        network.stoichiometry.dot(result.fluxes.T).T, change,
+        rtol=1e-6, atol=1e-3)
+
+    summary = result.flux_summary()
+    assert set(summary) == set(network.rules)
+    cleaved = summary['PARP_cleavage']
+    np.testing.assert_allclose(cleaved['forward'], result['Obs_cPARP'][-1],
+                               rtol=1e-6)
+    assert cleaved['reverse'] == 0. and cleaved['net'] == cleaved['forward']
+    late = result.flux_summary(start=tspan[10])['PARP_cleavage']['net']
+    np.testing.assert_allclose(
+        late, result['Obs_cPARP'][-1] - result['Obs_cPARP'][10], rtol=1e-6)
+
+    # Fluxes do not change the trajectories, alone or in a batch
+    plain = sim.run(tspan, params)
+    np.testing.assert_allclose(result.species, plain.species, rtol=1e-6,
+                               atol=1e-6)
+    (batched,) = sim.run_batch(tspan, [params], fluxes=True)
+    np.testing.assert_allclose(batched.fluxes, result.fluxes, rtol=1e-6,
+                               atol=1e-3)
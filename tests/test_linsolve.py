@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import scipy.sparse as sparse
+
+from anrm import linsolve
+from anrm.simulator import Simulator
+
+
+def _system(n, seed):
+    """A sparse, diagonally dominant matrix like I - c J."""
+
+    rng = np.random.default_rng(seed)
+    J = sparse.random(n, n, density=0.02, random_state=seed, format='csc')
+    return sparse.identity(n, format='csc') + 0.1 * J, rng.normal(size=n)
+
+
+def test_choice_by_size():
+    assert linsolve.choose(linsolve.DENSE_MAX) == 'dense'
+    assert linsolve.choose(linsolve.DENSE_MAX + 1) == 'splu-reuse'
+    assert linsolve.choose(linsolve.DIRECT_MAX + 1) == 'gmres'
+    assert isinstance(linsolve.make('auto', 10), linsolve.DenseLU)
+    assert isinstance(linsolve.make('auto', 5000), linsolve.GMRES)
+    solver = linsolve.GMRES(rtol=1e-6)
+    assert linsolve.make(solver, 10) is solver
+    with pytest.raises(ValueError):
+        linsolve.make('cholesky', 10)
+
+
+@pytest.mark.parametrize('name', sorted(linsolve.SOLVERS))
+def test_solve_residual(name):
+    solver = linsolve.make(name, 400)
+    # Factor twice, as the ordering of 'splu-reuse' is kept from the first
+    for seed in (0, 1):
+        A, b = _system(400, seed)
+        x = solver.solve(solver.factor(A), b)
+        assert np.linalg.norm(A.dot(x) - b) <= 1e-8 * np.linalg.norm(b)
+
+
+@pytest.mark.parametrize('name', sorted(linsolve.SOLVERS))
+def test_solvers_agree_in_simulations(network, name):
+    tspan = np.linspace(0, 40000, 21)
+    params = [{'XIAP_0': x} for x in (1e3, 1e4, 1e5)]
+    kwargs = dict(rtol=1e-8, atol=1e-6)
+    expected = Simulator(network, linear_solver='dense', **kwargs).run_batch(
+        tspan, params)
+    results = Simulator(network, linear_solver=name, **kwargs).run_batch(
+        tspan, params)
+    for r, e in zip(results, expected):
+        np.testing.assert_allclose(r['Obs_cPARP'], e['Obs_cPARP'],
+                                   rtol=1e-5, atol=1e-3)
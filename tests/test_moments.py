@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from anrm.dosing import Schedule
+from anrm.moments import MomentSimulator
+from anrm.network import Network
+
+
+@pytest.fixture
+def birth_death():
+    """0 -> X at rate kb, X -> 0 at rate kd * X."""
+
+    return Network(['X()'], ['kb', 'kd', 'X_0'], [10., 0.1, 0.],
+                   [(), (0,)], [(0,), ()], [0, 1], [1, 1],
+                   ['birth', 'death'], [False, False], ['Obs_X'],
+                   np.array([[1.]]), ['X_0'], [0], name='birth_death')
+
+
+@pytest.mark.parametrize('method', ['lna', '2ma'])
+def test_stationary_variance_equals_mean(birth_death, method):
+    # The stationary distribution is Poisson with mean kb / kd
+    sim = MomentSimulator(birth_death, method=method, rtol=1e-8, atol=1e-8)
+    result = sim.run(np.linspace(0, 200, 5))
+    np.testing.assert_allclose(result.mean('Obs_X')[-1], 100., rtol=1e-6)
+    np.testing.assert_allclose(result.variance('Obs_X')[-1], 100.,
+                               rtol=1e-6)
+    # Starting from none, the count is Poisson at all times
+    np.testing.assert_allclose(result.variance('X'), result.mean('X'),
+                               rtol=1e-6)
+
+
+def test_set_level_clears_the_variance(birth_death):
+    sim = MomentSimulator(birth_death, rtol=1e-8, atol=1e-8)
+    schedule = Schedule().set_level(100, 'X', 50.)
+    result = sim.run(np.array([0., 50., 100., 110.]), schedule=schedule)
+    assert result.mean('X')[2] == 50. and result.variance('X')[2] == 0.
+    # Binomial survival of the 50 plus Poisson births
+    assert 0 < result.variance('X')[3] < result.mean('X')[3]
@@ -0,0 +1,79 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from anrm.network import Network
+from anrm.simulator import Simulator
+
+
+def _same(a, b):
+    assert a.species == b.species and a.parameters == b.parameters
+    assert a.rules == b.rules and a.observables == b.observables
+    assert a.initial_params == b.initial_params
+    np.testing.assert_array_equal(a.param_values, b.param_values)
+    np.testing.assert_array_equal(a.reactants, b.reactants)
+    np.testing.assert_array_equal(a.stoichiometry.toarray(),
+                                  b.stoichiometry.toarray())
+    np.testing.assert_array_equal(a.obs_matrix.toarray(),
+                                  b.obs_matrix.toarray())
+
+
+@pytest.mark.parametrize('mmap', [False, True])
+def test_save_load_round_trip(network, tmp_path, mmap):
+    path = str(tmp_path / 'mini.anrmnet')
+    network.save(path)
+    loaded = Network.load(path, mmap=mmap)
+    _same(loaded, network)
+    tspan = np.linspace(0, 20000, 11)
+    np.testing.assert_array_equal(Simulator(loaded).run(tspan).species,
+                                  Simulator(network).run(tspan).species)
+
+
+def test_mapped_network_pickles_as_its_path(network, tmp_path):
+    path = str(tmp_path / 'mini.anrmnet')
+    network.save(path)
+    mapped = Network.load(path)
+    mapped.param_values = mapped.param_values * 2
+    data = pickle.dumps(mapped)
+    assert len(data) < len(pickle.dumps(network))
+    back = pickle.loads(data)
+    _same(back, mapped)
+
+    # A detached copy carries its arrays and outlives the file
+    detached = pickle.dumps(mapped.detach())
+    os.remove(path)
+    _same(pickle.loads(detached), mapped)
+    with pytest.raises(FileNotFoundError):
+        pickle.loads(data)
+
+
+def test_prune_zero_rate(network):
+    pruned, report = network.prune({'k4': 0.})
+    np.testing.assert_array_equal(report.zero_rate, [3])
+    assert len(report.unreachable) == 0
+    assert report.species == ['PARP(state=A)']
+    assert report.rules == ['PARP_activation']
+    assert pruned.n_species == network.n_species - 1
+    assert pruned.rules == network.rules[:3]
+
+
+def test_prune_unreachable(network):
+    pruned, report = network.prune({'XIAP_0': 0.})
+    assert len(report.zero_rate) == 0
+    np.testing.assert_array_equal(report.unreachable, [2])
+    assert report.species == ['XIAP()']
+    assert pruned.rules == ['C8_activation', 'PARP_cleavage',
+                            'PARP_activation']
+
+    # Same results for the kept species, zeros for the others
+    tspan = np.linspace(0, 40000, 21)
+    full = Simulator(network, rtol=1e-8).run(tspan, {'XIAP_0': 0.})
+    small = Simulator(pruned, rtol=1e-8).run(tspan, {'XIAP_0': 0.})
+    np.testing.assert_allclose(report.expand(small.species), full.species,
+                               rtol=1e-6, atol=1e-6)
+
+    # Seeds are kept even without an initial amount
+    _, report = network.prune({'XIAP_0': 0.}, seeds=['XIAP'])
+    assert report.species == [] and len(report.unreachable) == 0
@@ -0,0 +1,33 @@
+import numpy as np
+
+from anrm.fate import FATE_NAMES
+from anrm.population import LognormalSampler, simulate_population
+
+
+def test_sampler_moments_and_fixed_proteins():
+    corr = [[1., .5, 0.], [.5, 1., 0.], [0., 0., 1.]]
+    sampler = LognormalSampler([100., 2e4, 50.], cv=[.25, .25, 0.],
+                               corr=corr)
+    x = sampler.sample(200000, np.random.default_rng(0))
+    np.testing.assert_allclose(x[:, :2].mean(axis=0), [100., 2e4],
+                               rtol=1e-2)
+    np.testing.assert_allclose(x[:, :2].std(axis=0) / [100., 2e4], .25,
+                               rtol=2e-2)
+    np.testing.assert_allclose(np.corrcoef(np.log(x[:, :2].T))[0, 1], .5,
+                               atol=1e-2)
+    np.testing.assert_allclose(x[:, 2], 50.)
+
+
+def test_population_is_reproducible(network):
+    tspan = np.linspace(0, 40000, 41)
+    kwargs = dict(proteins=['XIAP_0', 'RIP1_0'], cv=[1., 0.], seed=3,
+                  param_values={'XIAP_0': 3e3}, chunk_size=8)
+    pop = simulate_population(network, 30, tspan, **kwargs)
+    again = simulate_population(network, 30, tspan, **kwargs)
+    np.testing.assert_array_equal(pop.fates, again.fates)
+    counts = pop.counts()
+    assert sum(counts.values()) == 30
+    assert 0 < counts['apoptosis'] < 30
+    fractions = pop.fractions()
+    assert fractions.shape == (len(tspan), len(FATE_NAMES))
+    np.testing.assert_allclose(fractions.sum(axis=1), 1.)
@@ -0,0 +1,47 @@
+import numpy as np
+
+from anrm.reducers import FirstPassage, Moments, reduce_ensemble
+from anrm.simulator import SimulationResult
+
+
+def _streams(network, tout, trajectories, chunk_size=3):
+    """One stream of single-observable chunks per trajectory."""
+
+    for x in trajectories:
+        yield [SimulationResult(network, tout[i:i + chunk_size],
+                                observables=x[i:i + chunk_size, None],
+                                observable_names=['x'])
+               for i in range(0, len(tout), chunk_size)]
+
+
+def test_moments_match_numpy(network):
+    rng = np.random.default_rng(1)
+    tout = np.arange(10.)
+    x = 1e4 + rng.random((40, len(tout)))
+    a, b = Moments(['x']), Moments(['x'])
+    reduce_ensemble(_streams(network, tout, x[:15]), [a])
+    reduce_ensemble(_streams(network, tout, x[15:]), [b])
+    a.merge(b)
+    np.testing.assert_allclose(a.mean[:, 0], x.mean(axis=0), rtol=1e-12)
+    np.testing.assert_allclose(a.variance[:, 0], x.var(axis=0, ddof=1),
+                               rtol=1e-9)
+
+
+def test_first_passage_variance_is_accurate(network):
+    # Crossing times near 1e4 s with a spread of milliseconds
+    rng = np.random.default_rng(2)
+    crossings = 1e4 + 1e-3 * rng.random(30)
+    tout = np.linspace(9990., 10010., 11)
+    ramps = tout - crossings[:, None]
+    ramps[-5:] = -1.
+    bins = np.linspace(9990., 10010., 5)
+    a = FirstPassage('x', 0., bins)
+    b = FirstPassage('x', 0., bins)
+    reduce_ensemble(_streams(network, tout, ramps[:10]), [a])
+    reduce_ensemble(_streams(network, tout, ramps[10:]), [b])
+    a.merge(b)
+    crossed = crossings[:-5]
+    assert (a.n_crossed, a.n_total) == (25, 30)
+    np.testing.assert_allclose(a.mean, crossed.mean(), rtol=1e-12)
+    np.testing.assert_allclose(a.variance, crossed.var(ddof=1), rtol=1e-4)
+    assert a.counts.sum() == 25
@@ -0,0 +1,28 @@
+import numpy as np
+
+from anrm.fate import classify
+from anrm.screen import run_screen
+from anrm.simulator import Simulator
+
+
+def test_screen_matches_brute_force(network):
+    tspan = np.linspace(0, 40000, 201)
+    result = run_screen(network, tspan, ligands=['TNFa_0'], processes=0)
+    sim = Simulator(network)
+    for i, a in enumerate(result.perturbations):
+        for j, b in enumerate(result.perturbations):
+            if a.param == b.param and i != j:
+                assert result.fates[i, j] == -1
+                continue
+            params = network.param_vector().copy()
+            for p in set([a, b]):
+                params[network.param_index(p.param)] *= p.factor
+            parp_0 = params[network.param_index('PARP_0')]
+            if parp_0 == 0:
+                continue
+            r = sim.run(tspan, params)
+            fates, times = classify(tspan, r['Obs_cPARP'][None],
+                                    r['Obs_aPARP'][None], [parp_0])
+            assert result.fates[i, j] == fates[0]
+            np.testing.assert_allclose(result.death_times[i, j], times[0],
+                                       rtol=1e-2)
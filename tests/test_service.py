@@ -0,0 +1,47 @@
+import asyncio
+import os
+
+import numpy as np
+
+from anrm import service
+from anrm.service import ServiceClient, SimulationService
+from anrm.simulator import Simulator
+
+
+def test_round_trip(network, tmp_path):
+    path = str(tmp_path / 'anrm.sock')
+    tspan = np.linspace(0, 20000, 11)
+
+    async def session():
+        server = asyncio.ensure_future(
+            SimulationService(network, processes=1).serve(path=path))
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+        client = await ServiceClient(path=path).connect()
+        try:
+            good = client.simulate(tspan, {'XIAP_0': 1e4}, ['Obs_cPARP'])
+            bad = client.simulate(tspan, {'k1': float('nan')})
+            return await asyncio.gather(good, bad, return_exceptions=True)
+        finally:
+            await client.close()
+            server.cancel()
+
+    good, bad = asyncio.run(session())
+    expected = Simulator(network).run(tspan, {'XIAP_0': 1e4})
+    assert good['tout'] == tspan.tolist()
+    np.testing.assert_allclose(good['observables']['Obs_cPARP'],
+                               expected['Obs_cPARP'], rtol=1e-6)
+    assert isinstance(bad, RuntimeError)
+    assert 'finite' in str(bad)
+
+
+def test_failed_member_does_not_fail_batch(network):
+    service._init_worker(network, 1e-3, 1e-6)
+    tspan = np.linspace(0, 1000, 3)
+    values = service._simulate_batch(
+        tspan, [{'k1': 1e-4}, {'no_such_param': 1.}, {'k1': 1e-5}],
+        ['Obs_C8'])
+    assert isinstance(values[1], Exception)
+    for v, k1 in zip(values[::2], [1e-4, 1e-5]):
+        expected = Simulator(network).run(tspan, {'k1': k1})
+        np.testing.assert_allclose(v['Obs_C8'], expected['Obs_C8'])
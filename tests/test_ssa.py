@@ -0,0 +1,28 @@
+import numpy as np
+
+from anrm.ssa import StochasticSimulator, simulate_cells
+
+VALUES = {'PARP_0': 1e3, 'XIAP_0': 100., 'RIP1_0': 20., 'TNFa_0': 3.,
+          'k2': 1e-3, 'k3': 1e-2, 'k4': 1e-6}
+TSPAN = np.linspace(0, 40000, 21)
+
+
+def test_cells_do_not_depend_on_chunking(network):
+    serial = simulate_cells(network, 12, TSPAN, VALUES, seed=7, processes=0)
+    pooled = simulate_cells(network, 12, TSPAN, VALUES, seed=7, processes=2,
+                            chunk_size=5)
+    np.testing.assert_array_equal(serial, pooled)
+    # Cells differ from one another, and with the seed
+    assert (serial[1:] != serial[0]).any()
+    other = simulate_cells(network, 12, TSPAN, VALUES, seed=8, processes=0)
+    assert (other != serial).any()
+
+
+def test_single_cell_matches_ensemble(network):
+    cells = simulate_cells(network, [3, 9], TSPAN, VALUES, seed=7,
+                           processes=0)
+    sim = StochasticSimulator(network, seed=7)
+    one = sim.run(TSPAN, VALUES, cell=9)
+    np.testing.assert_array_equal(one['Obs_cPARP'], cells[1, :, 0])
+    np.testing.assert_array_equal(sim.run_cells([3], TSPAN, VALUES),
+                                  cells[:1])
@@ -0,0 +1,84 @@
+import numpy as np
+
+from anrm.simulator import Simulator
+from anrm.sweep import (QueueBackend, SQLiteWorkQueue, SweepSpec,
+                        ThreadBackend, run_sweep)
+
+
+def _spec(network):
+    return SweepSpec(network, np.linspace(0, 1000, 5), ['Obs_cPARP'], 1e-3,
+                     1e-6)
+
+
+def test_queue_lease_retry_commit(network, tmp_path):
+    queue = SQLiteWorkQueue(str(tmp_path / 'queue.db'), max_attempts=2)
+    chunks = [np.zeros((2, 8)), np.ones((1, 8))]
+    assert queue.submit('s', _spec(network), chunks)
+    assert not queue.submit('s', _spec(network), chunks)
+
+    sweep, chunk, params = queue.lease('w1', 60.)
+    assert (sweep, chunk) == ('s', 0)
+    np.testing.assert_array_equal(params, chunks[0])
+    # Chunk 0 is leased, so the next worker gets chunk 1
+    assert queue.lease('w2', 60.)[1] == 1
+    assert queue.lease('w3', 60.) is None
+
+    # A failed task is retried until max_attempts
+    queue.fail('s', 0, 'boom')
+    assert queue.lease('w3', 60.)[1] == 0
+    queue.fail('s', 0, 'boom again')
+    assert queue.progress('s') == {'failed': 1, 'leased': 1}
+    assert queue.errors('s') == {0: 'boom again'}
+
+    # Commits are idempotent, and a committed task cannot fail anymore
+    queue.commit('s', 1, np.arange(3.))
+    queue.commit('s', 1, np.zeros(3))
+    queue.fail('s', 1, 'late')
+    assert queue.progress('s') == {'failed': 1, 'done': 1}
+    (result,) = queue.results('s')
+    np.testing.assert_array_equal(result, np.arange(3.))
+
+
+def test_expired_lease_is_released(network, tmp_path):
+    queue = SQLiteWorkQueue(str(tmp_path / 'queue.db'))
+    queue.submit('s', _spec(network), [np.zeros((1, 8))])
+    assert queue.lease('w1', -1.)[1] == 0
+    assert queue.lease('w2', 60.)[1] == 0
+    assert queue.lease('w3', 60.) is None
+
+
+def test_queue_backend_matches_serial(network, tmp_path):
+    sets = [{'k1': k} for k in np.logspace(-5, -3, 5)]
+    tspan = np.linspace(0, 20000, 11)
+    expected = run_sweep(network, sets, tspan, chunk_size=2)
+    queue = SQLiteWorkQueue(str(tmp_path / 'queue.db'))
+    backend = QueueBackend(queue, 'sweep', local_processes=1, poll=0.05)
+    values = run_sweep(network, sets, tspan, chunk_size=2, backend=backend)
+    np.testing.assert_array_equal(values, expected)
+
+
+def test_thread_backend_matches_serial(network):
+    sets = [{'k1': k} for k in np.logspace(-5, -3, 5)]
+    tspan = np.linspace(0, 20000, 11)
+    expected = run_sweep(network, sets, tspan, chunk_size=2)
+    values = run_sweep(network, sets, tspan, chunk_size=2,
+                       backend=ThreadBackend(2))
+    np.testing.assert_array_equal(values, expected)
+
+
+def test_observable_only_float32_output(network):
+    sets = [{'k1': k} for k in np.logspace(-5, -3, 3)]
+    tspan = np.linspace(0, 20000, 11)
+    full = run_sweep(network, sets, tspan)
+    small = run_sweep(network, sets, tspan, ['Obs_aPARP', 'Obs_cPARP'],
+                      dtype=np.float32)
+    assert small.dtype == np.float32 and small.shape == (3, 11, 2)
+    np.testing.assert_allclose(small, full[:, :, [1, 0]], rtol=1e-6)
+
+    sim = Simulator(network)
+    result = sim.run(tspan, sets[0], observables=['Obs_cPARP'],
+                     dtype=np.float32)
+    assert result.species is None
+    assert result['Obs_cPARP'].dtype == np.float32
+    expected = sim.run(tspan, sets[0])['Obs_cPARP']
+    np.testing.assert_allclose(result['Obs_cPARP'], expected, rtol=1e-6)
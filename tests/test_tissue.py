@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from anrm.network import Network
+from anrm.simulator import Simulator
+from anrm.tissue import TissueSimulator
+
+
+@pytest.fixture
+def binding():
+    """L + R <-> LR, with the ligand L taken up by the cells."""
+
+    return Network(['L()', 'R()', 'L() % R()'], ['kf', 'kr', 'L_0', 'R_0'],
+                   [1e-3, 1e-2, 100., 50.], [(0, 1), (2,)], [(2,), (0, 1)],
+                   [0, 1], [1, 1], ['bind', 'bind'], [False, True],
+                   ['Obs_L', 'Obs_LR'], np.array([[1., 0., 1.],
+                                                  [0., 0., 1.]]),
+                   ['L_0', 'R_0'], [0, 1], name='binding')
+
+
+def test_ligand_is_conserved_under_diffusion(binding):
+    rng = np.random.default_rng(1)
+    volume = rng.uniform(0.5, 3., 16)
+    # Cells crowd the first sites, so ligand is depleted there first
+    sites = np.arange(40) % 5
+    sim = TissueSimulator(binding, 40, grid=(4, 4), sites=sites,
+                          ligand='L_0', volume=volume, diffusion=0.05,
+                          rtol=1e-8, atol=1e-8)
+    result = sim.run(np.linspace(0, 2000, 21), observables=['Obs_LR'])
+    total = (result.ligand * volume).sum(axis=1) + \
+        result['Obs_LR'].sum(axis=1)
+    np.testing.assert_allclose(total, total[0], rtol=1e-6)
+    field = result.ligand_field(1)
+    assert field.shape == (4, 4)
+    assert field.ravel()[:5].max() < field.ravel()[5:].min()
+    # and evens out in the end
+    np.testing.assert_allclose(result.ligand[-1], result.ligand[-1, 0],
+                               rtol=1e-6)
+
+
+def test_identical_cells_in_one_pool_act_as_one(network):
+    tspan = np.linspace(0, 20000, 21)
+    one = Simulator(network, rtol=1e-8, atol=1e-6).run(tspan)
+    result = TissueSimulator(network, 10, rtol=1e-8, atol=1e-6).run(tspan)
+    np.testing.assert_allclose(result['Obs_cPARP'],
+                               np.tile(one['Obs_cPARP'][:, None], (1, 10)),
+                               rtol=1e-5, atol=1e-3)
+    np.testing.assert_allclose(result.ligand[:, 0], one['TNFa'], rtol=1e-6)